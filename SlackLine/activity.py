@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+メッセージの時間帯別の件数・よく投稿した人・盛り上がったスレッドを集計するモジュール（numpy が必要）
+
+MessageBatch の列（タイムスタンプの配列・ユーザー番号の配列）をそのまま numpy で集計するので、
+7日分・30日分といった大量のメッセージでもすぐに終わる。
+"""
+
+from datetime import datetime
+from typing import Dict, List
+
+from message_batch import MessageBatch
+from numpy_utils import import_numpy
+
+
+# 「よく投稿した人」「盛り上がったスレッド」に載せる数
+DEFAULT_TOP_N = 3
+
+# 時間帯別のグラフに使う文字（少ない → 多い）
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+# 現地時刻の「何時台か」は15分単位で求める（30分ずれのタイムゾーンにも対応するため）
+_SLOT_SECONDS = 900
+
+
+def compute_activity(batch: MessageBatch, top_n: int = DEFAULT_TOP_N) -> Dict:
+    """
+    時間帯別の件数・よく投稿した人・盛り上がったスレッドを集計する。
+
+    Args:
+        batch: 集計するメッセージ
+        top_n: 上位何人・何スレッドまで返すか（デフォルト: 3）
+
+    Returns:
+        {
+            "hourly": 0時台〜23時台のメッセージ数（24個のリスト）,
+            "top_users": [(ユーザー名, 投稿数), ...]（多い順）,
+            "busiest_threads": [(返信数, 親メッセージの本文), ...]（多い順）,
+        }
+
+    Raises:
+        RuntimeError: numpy がインストールされていない場合
+    """
+    np = import_numpy("活動の集計")
+    if not len(batch):
+        return {"hourly": [0] * 24, "top_users": [], "busiest_threads": []}
+
+    # 時間帯別: 15分ごとの枠に分け、枠ごとに現地時刻の「何時台か」を1回だけ求める
+    slots = (batch.timestamp_array() // _SLOT_SECONDS).astype(np.int64)
+    first_slot = int(slots.min())
+    slot_count = int(slots.max()) - first_slot + 1
+    hour_of_slot = np.fromiter(
+        (datetime.fromtimestamp((first_slot + i) * _SLOT_SECONDS).hour for i in range(slot_count)),
+        dtype=np.int64,
+        count=slot_count
+    )
+    hourly = np.bincount(hour_of_slot[slots - first_slot], minlength=24)
+
+    # よく投稿した人: ユーザー番号ごとの件数
+    posts = np.bincount(batch.user_code_array(), minlength=len(batch.users))
+    top_codes = np.argsort(-posts, kind="stable")[:top_n]
+    top_users = [(batch.users[code], int(posts[code])) for code in top_codes.tolist()]
+
+    # 盛り上がったスレッド: 返信数の多い親メッセージ
+    parents = [index for index, extra in batch.extras.items() if extra.get("reply_count")]
+    reply_counts = np.array([batch.extras[index]["reply_count"] for index in parents], dtype=np.int64)
+    busiest_threads = [
+        (int(reply_counts[i]), batch.text(parents[i]))
+        for i in np.argsort(-reply_counts, kind="stable")[:top_n].tolist()
+    ]
+
+    return {
+        "hourly": hourly.tolist(),
+        "top_users": top_users,
+        "busiest_threads": busiest_threads,
+    }
+
+
+def sparkline(values: List[int]) -> str:
+    """数値の並びを ▁▂▃▄▅▆▇█ の棒グラフの文字列にする"""
+    peak = max(values) if values else 0
+    if peak == 0:
+        return SPARK_CHARS[0] * len(values)
+    last = len(SPARK_CHARS) - 1
+    return "".join(SPARK_CHARS[(value * last + peak - 1) // peak] for value in values)
+
+
+def format_activity(stats: Dict) -> List[str]:
+    """
+    compute_activity() の結果を要約の見出しに載せる行にする。
+
+    Args:
+        stats: compute_activity() の結果
+
+    Returns:
+        行のリスト
+    """
+    hourly = stats["hourly"]
+    lines = [f"📈 時間帯（0〜23時）: {sparkline(hourly)}"]
+    if any(hourly):
+        peak_hour = max(range(24), key=hourly.__getitem__)
+        lines.append(f"   最も多い時間帯: {peak_hour}時台（{hourly[peak_hour]}件）")
+
+    if stats["top_users"]:
+        ranking = " / ".join(f"{user} {count}件" for user, count in stats["top_users"])
+        lines.append(f"🏆 よく投稿した人: {ranking}")
+
+    if stats["busiest_threads"]:
+        lines.append("🧵 盛り上がったスレッド:")
+        for reply_count, text in stats["busiest_threads"]:
+            text = text.replace("\n", " ").strip()
+            if len(text) > 40:
+                text = text[:40] + "..."
+            lines.append(f"   • 返信{reply_count}件: {text}")
+    return lines
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+メッセージ処理の速さとメモリ使用量を測るスクリプト
+
+本物に近い Slack の履歴（日本語の本文、投稿の多い人・少ない人の偏り、長文や複数行のメッセージ、
+通知の繰り返し）を作り、要約・整形・LINE 用の分割などの各処理を 1千件・10万件・100万件で測る。
+LINE への送信は行わない（line_client.send_line_messages を差し替え、分割までを測る）ので、ネットワークにつながっていなくても実行できる。
+
+使い方:
+  # 1千件・1万件・10万件・100万件で測る（100万件は数GBのメモリと数分の時間が必要）
+  python benchmark.py
+
+  # 件数を指定する
+  python benchmark.py --sizes 1k 100k
+
+  # 今回の結果を基準として保存する
+  python benchmark.py --save-baseline
+
+  # 基準より遅く（またはメモリを多く使うように）なった処理があれば終了コード 1 で終わる
+  python benchmark.py --sizes 1k 100k --max-regression 0.2
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import line_client
+from message_batch import MessageBatch
+from numpy_utils import has_numpy
+from slack_cache import CACHE_DIR
+from slack_client import format_messages_for_display
+from summarizer import create_simple_summary, summarize_messages
+
+
+# 基準の結果を保存するファイル（マシンごとに違うので、ほかのキャッシュと同じく .cache/ に置く）
+DEFAULT_BASELINE_PATH = os.path.join(CACHE_DIR, "benchmark_baseline.json")
+
+# 測る件数（デフォルト）
+DEFAULT_SIZES = ["1k", "10k", "100k", "1m"]
+
+# 目標の時間（秒）。(件数, 処理名) ごとに、1回あたりの時間がこれを超えたら結果の最後に表示する
+TIME_TARGETS = {
+    (10_000, "summarize_messages(tfidf)"): 0.1,
+}
+
+# 1回の測定がこれより短い場合は、繰り返して平均を取る（秒）
+MIN_MEASURE_SECONDS = 0.2
+
+# 基準との差がこれより小さい場合は、割合が大きくても悪化とみなさない（測定のぶれで誤検出しないため）
+MIN_REGRESSION = {"seconds": 0.005, "peak_bytes": 1_000_000}
+
+# 本文に使う語句
+_WORDS = [
+    "デプロイ", "リリース", "本番環境", "ステージング", "レビュー", "お願いします", "確認しました",
+    "対応します", "障害", "復旧", "ログ", "サーバー", "データベース", "API", "テスト", "明日", "今日",
+    "会議", "資料", "共有します", "ありがとうございます", "了解です", "よろしくお願いします", "修正",
+    "プルリクエスト", "マージ", "ブランチ", "エラー", "タイムアウト", "メモリ", "CPU", "監視", "アラート",
+]
+_PUNCTUATION = ["、", "。", "！", "？", " ", "（", "）"]
+_ALERTS = [
+    "デプロイ完了 build #{n} (main)",
+    "[ALERT] CPU使用率 {n}% web-{m}",
+    "バックアップが完了しました（{n}件）",
+]
+
+
+def _parse_size(text: str) -> int:
+    """"1k"・"100k"・"1m"・"5000" のような指定を件数にする"""
+    text = text.strip().lower()
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+def generate_history(
+    count: int,
+    channels: int = 3,
+    users: int = 200,
+    days: int = 30,
+    seed: int = 0
+) -> List[Dict]:
+    """
+    本物に近い Slack の履歴を作る。
+
+    - 投稿者はジップの法則に近い偏りにする（一部の人が大半を投稿する）
+    - 本文は日本語の語句と句読点をつなげたもの。5% は数百〜数千文字の長文、10% は複数行
+    - 15% は通知（数字だけが違う、ほぼ同じ文）
+    - スレッドの親メッセージには返信数を付ける
+
+    Args:
+        count: 件数
+        channels: チャンネル数
+        users: ユーザー数
+        days: 期間（日）
+        seed: 乱数の種（同じ種なら同じ履歴ができる）
+
+    Returns:
+        get_channel_messages() と同じ形式のメッセージのリスト（新しい順）
+    """
+    rng = random.Random(seed)
+    user_names = [f"ユーザー{i:03d}" for i in range(users)]
+    user_weights = [1.0 / (rank + 1) ** 1.1 for rank in range(users)]
+    channel_names = [f"#channel-{i}" for i in range(channels)]
+    newest = 1_700_000_000.0
+    step = days * 86400 / max(count, 1)
+
+    picked_users = rng.choices(user_names, weights=user_weights, k=count)
+    messages = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.15:
+            text = rng.choice(_ALERTS).format(n=rng.randint(1, 9999), m=rng.randint(1, 9))
+        else:
+            length = rng.randint(200, 600) if kind > 0.95 else rng.randint(2, 25)
+            pieces = rng.choices(_WORDS, k=length)
+            for j in range(0, length, 4):
+                pieces[j] += rng.choice(_PUNCTUATION)
+            text = "".join(pieces)
+            if 0.85 < kind <= 0.95:
+                text = "\n".join(text[k:k + 40] for k in range(0, len(text), 40))
+
+        timestamp = newest - i * step - rng.random() * step
+        msg = {
+            "text": text,
+            "user": picked_users[i],
+            "timestamp": timestamp,
+            "ts": f"{timestamp:.6f}",
+            "channel": channel_names[i % channels],
+        }
+        if rng.random() < 0.02:
+            msg["reply_count"] = rng.randint(1, 50)
+            msg["latest_reply"] = f"{timestamp + 60:.6f}"
+        messages.append(msg)
+    return messages
+
+
+def _split_for_line(text: str) -> int:
+    """send_long_message() の分割を、送信せずに行う。分割した数を返す"""
+    parts = []
+    original = line_client.send_line_messages
+    line_client.send_line_messages = lambda messages, *args, **kwargs: parts.extend(messages) or True
+    try:
+        line_client.send_long_message(text, channel_access_token="benchmark", user_id="benchmark")
+    finally:
+        line_client.send_line_messages = original
+    return len(parts)
+
+
+def build_stages(messages: List[Dict]) -> Dict[str, Callable[[], object]]:
+    """
+    測る処理の一覧を作る。
+
+    Returns:
+        {処理名: 引数なしで呼ぶ関数}（numpy が必要な処理は、numpy がある場合だけ含める）
+    """
+    batch = MessageBatch.from_messages(messages)
+    # --no-summary のときに LINE に送る全文（分割が最も多くなる）
+    full_text = format_messages_for_display(messages)
+
+    stages: Dict[str, Callable[[], object]] = {
+        "MessageBatch.from_messages": lambda: MessageBatch.from_messages(messages),
+        "summarize_messages": lambda: summarize_messages(messages),
+        "summarize_messages(batch)": lambda: summarize_messages(batch),
+        "summarize_messages(topics)": lambda: summarize_messages(messages, topics=True),
+        "create_simple_summary": lambda: create_simple_summary(messages),
+        "format_messages_for_display": lambda: format_messages_for_display(messages),
+        "send_long_message(split)": lambda: _split_for_line(full_text),
+    }
+    if has_numpy():
+        from dedup import collapse_near_duplicates
+
+        stages["summarize_messages(tfidf)"] = lambda: summarize_messages(messages, mode="tfidf")
+        stages["summarize_messages(stats)"] = lambda: summarize_messages(batch, stats=True)
+        stages["collapse_near_duplicates"] = lambda: collapse_near_duplicates(messages)
+    return stages
+
+
+def measure(func: Callable[[], object], with_memory: bool = True) -> Dict[str, float]:
+    """
+    処理1つの時間とメモリ使用量のピークを測る。
+
+    時間は tracemalloc を止めた状態で測り（tracemalloc を使うと遅くなるため）、メモリは別にもう1回実行して測る。
+
+    Returns:
+        {"seconds": 1回あたりの秒数, "peak_bytes": 処理中に増えたメモリのピーク（バイト）}
+    """
+    gc.collect()
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        func()
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_MEASURE_SECONDS:
+            break
+    result = {"seconds": elapsed / runs, "peak_bytes": 0.0}
+
+    if with_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            baseline, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result["peak_bytes"] = float(peak - baseline)
+    return result
+
+
+def run(sizes: List[int], with_memory: bool = True, seed: int = 0) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    全ての件数・全ての処理を測って表示する。
+
+    Returns:
+        {件数（文字列）: {処理名: {"seconds", "peak_bytes", "per_second"}}}
+    """
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for size in sizes:
+        print(f"\n📦 {size:,}件の履歴を作成中...")
+        messages = generate_history(size, seed=seed)
+        print(f"{'処理':<32}{'1回あたり':>12}{'件/秒':>14}{'メモリ(ピーク)':>16}")
+        print("-" * 74)
+
+        results[str(size)] = {}
+        for name, func in build_stages(messages).items():
+            result = measure(func, with_memory=with_memory)
+            result["per_second"] = size / result["seconds"] if result["seconds"] else 0.0
+            results[str(size)][name] = result
+            memory = f"{result['peak_bytes'] / 1e6:,.1f}MB" if with_memory else "-"
+            print(
+                f"{name:<32}{result['seconds'] * 1000:>10,.1f}ms"
+                f"{result['per_second']:>14,.0f}{memory:>16}"
+            )
+        del messages
+        gc.collect()
+    return results
+
+
+def check_targets(results: Dict[str, Dict[str, Dict[str, float]]]) -> List[str]:
+    """
+    TIME_TARGETS の目標の時間を超えた処理を返す。
+
+    Returns:
+        目標を超えた処理の説明のリスト
+    """
+    misses = []
+    for (size, name), target in TIME_TARGETS.items():
+        result = results.get(str(size), {}).get(name)
+        if result is not None and result["seconds"] > target:
+            misses.append(
+                f"{size:,}件 {name}: {result['seconds'] * 1000:,.1f}ms（目標 {target * 1000:,.0f}ms）"
+            )
+    return misses
+
+
+def compare(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Dict[str, Dict[str, float]]],
+    max_regression: float
+) -> List[str]:
+    """
+    基準と比べて、max_regression（0.2 なら 20%）以上遅く・メモリを多く使うようになった処理を返す。
+
+    差が MIN_REGRESSION（5ミリ秒・1MB）未満のものは、割合にかかわらず悪化とみなさない。
+
+    Returns:
+        悪化した処理の説明のリスト
+    """
+    regressions = []
+    for size, stages in results.items():
+        for name, result in stages.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            for key, label in (("seconds", "時間"), ("peak_bytes", "メモリ")):
+                if result[key] - base.get(key, 0) < MIN_REGRESSION[key]:
+                    continue
+                if base.get(key) and result[key] > base[key] * (1 + max_regression):
+                    ratio = result[key] / base[key]
+                    regressions.append(f"{int(size):,}件 {name}: {label}が基準の{ratio:.2f}倍")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(
+        description="メッセージ処理の速さとメモリ使用量を測る（LINE には送信しない）"
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="測る件数（1k・100k・1m のように指定。デフォルト: 1k 10k 100k 1m）"
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="メモリ使用量を測らない（時間だけを測る。速く終わる）"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="履歴を作る乱数の種（デフォルト: 0）"
+    )
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE_PATH,
+        help=f"基準の結果のファイル（デフォルト: {DEFAULT_BASELINE_PATH}）"
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="今回の結果を基準として保存する"
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="基準よりこの割合以上悪化したら失敗とする（デフォルト: 0.2 = 20%%）"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+    sizes = [_parse_size(size) for size in args.sizes]
+    results = run(sizes, with_memory=not args.no_memory, seed=args.seed)
+
+    misses = check_targets(results)
+    if misses:
+        print("\n⚠️  目標の時間を超えた処理があります:")
+        for miss in misses:
+            print(f"  - {miss}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 基準を保存しました: {args.baseline}")
+        return
+
+    baseline: Optional[Dict] = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if baseline is None:
+        print("\nℹ️  基準がありません（--save-baseline で保存できます）")
+        return
+
+    regressions = compare(results, baseline, args.max_regression)
+    if regressions:
+        print(f"\n❌ 基準より {args.max_regression:.0%} 以上悪化した処理があります:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print(f"\n✅ 基準と比べて悪化した処理はありません（許容: {args.max_regression:.0%}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ほぼ同じ内容のメッセージを1件にまとめるモジュール（numpy が必要）
+
+通知用のチャンネルでは「デプロイ完了 build #123」「デプロイ完了 build #124」のような
+ほぼ同じメッセージが大量に並ぶ。ここでは MinHash と LSH（似たものを同じバケツに入れるハッシュ）で
+似ているメッセージの組を見つけ、まとめたグループごとに代表の1件だけを残す。
+全ての組み合わせを比べないので、件数にほぼ比例した時間で終わる。
+"""
+
+from typing import Dict, Iterable, List, Union
+
+from message_batch import MessageBatch
+from numpy_utils import HASH_MULTIPLIER, code_points, import_numpy, ngram_hashes
+
+
+# 何文字ずつ区切って比べるか（文字シングル）
+SHINGLE_SIZE = 3
+
+# MinHash の数（BANDS × ROWS_PER_BAND）
+BANDS = 8
+ROWS_PER_BAND = 4
+NUM_HASHES = BANDS * ROWS_PER_BAND
+
+# この割合以上のシングルが共通していれば「ほぼ同じ」とみなす
+DEFAULT_THRESHOLD = 0.7
+
+# 同じバケツの中で、各メッセージと比べる直前のメッセージの数（バケツの最初のメッセージとは常に比べる）
+BUCKET_COMPARE_LIMIT = 4
+
+# 候補の組の署名を一度に比べる数（署名をコピーする一時配列が大きくなりすぎないようにする）
+_COMPARE_CHUNK = 65536
+
+# MinHash の係数を作る乱数の種（実行ごとに結果が変わらないよう固定する）
+_SEED = 20240131
+
+# numpy がないときのエラーメッセージに出す用途
+_NUMPY_PURPOSE = "類似メッセージをまとめる"
+
+
+def _signatures(texts: List[str]):
+    """
+    各テキストの MinHash の署名を作る。
+
+    Returns:
+        (署名, 署名のあるテキストの番号)。署名は (件数, NUM_HASHES) の uint32 配列。
+        SHINGLE_SIZE 文字より短いテキストには署名を作らない
+    """
+    np = import_numpy(_NUMPY_PURPOSE)
+    count = len(texts)
+
+    # 全テキストを区切り文字（\0）でつなげたコードポイントの配列
+    # （数字は 0 に、英字は小文字にそろえて、build #123 と build #124 を同じものとして扱う）
+    codes = code_points(texts, fold_digits=True)
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=count)
+    doc_of_position = np.repeat(np.arange(count, dtype=np.int64), lengths + 1)
+
+    # 区切り文字をまたがない、各位置から始まるシングルのハッシュ値
+    shingles = np.zeros(0, dtype=np.uint64)
+    docs = np.zeros(0, dtype=np.int64)
+    for _, key, valid in ngram_hashes(codes, codes != 0, (SHINGLE_SIZE,)):
+        shingles = key[valid].astype(np.uint64)
+        docs = doc_of_position[:len(key)][valid]
+    if len(shingles) == 0:
+        return np.zeros((0, NUM_HASHES), dtype=np.uint32), np.zeros(0, dtype=np.int64)
+
+    # シングルはテキストの順に並んでいるので、テキストごとの最小値を reduceat で求める
+    starts = np.flatnonzero(np.concatenate(([True], docs[1:] != docs[:-1])))
+    rng = np.random.default_rng(_SEED)
+    multipliers = rng.integers(0, 2 ** 63, size=NUM_HASHES, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 2 ** 63, size=NUM_HASHES, dtype=np.uint64)
+    signatures = np.empty((len(starts), NUM_HASHES), dtype=np.uint32)
+    for i in range(NUM_HASHES):
+        hashed = ((shingles * multipliers[i] + offsets[i]) >> np.uint64(32)).astype(np.uint32)
+        signatures[:, i] = np.minimum.reduceat(hashed, starts)
+    return signatures, docs[starts]
+
+
+def find_clusters(texts: List[str], threshold: float = DEFAULT_THRESHOLD) -> List[int]:
+    """
+    ほぼ同じ内容のテキストをグループにまとめる。
+
+    Args:
+        texts: テキストのリスト
+        threshold: 共通するシングルの割合（Jaccard 係数の推定値）がこれ以上なら同じグループにする
+
+    Returns:
+        各テキストが属するグループの代表（グループ内で最初のテキスト）の番号のリスト
+
+    Raises:
+        RuntimeError: numpy がインストールされていない場合
+    """
+    np = import_numpy(_NUMPY_PURPOSE)
+    parent = list(range(len(texts)))
+    signatures, doc_ids = _signatures(texts)
+
+    # LSH: 署名をバンドに分け、あるバンドが完全に一致する（同じバケツに入る）組を候補にする。
+    # 並べ替えで隣り合うものだけを比べると、間に似ていないものが挟まったときに見落とすので、
+    # 各メッセージをバケツの最初のメッセージ（代表）と、直前の BUCKET_COMPARE_LIMIT 件と比べる
+    count = len(doc_ids)
+    positions = np.arange(count)
+    left_parts = []
+    right_parts = []
+    for band in range(BANDS):
+        rows = signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        bucket = rows[:, 0].copy()
+        for column in range(1, ROWS_PER_BAND):
+            bucket *= np.uint32(HASH_MULTIPLIER)
+            bucket += rows[:, column]
+        order = np.argsort(bucket, kind="stable")
+        bucket = bucket[order]
+        # 並べ替えた後の、各バケツの先頭の位置と、バケツの中で何番目か
+        is_start = np.empty(count, dtype=bool)
+        is_start[:1] = True
+        np.not_equal(bucket[1:], bucket[:-1], out=is_start[1:])
+        group_start = np.maximum.accumulate(np.where(is_start, positions, 0))
+        rank = positions - group_start
+        # 代表との組
+        has_representative = rank > 0
+        left_parts.append(order[group_start[has_representative]])
+        right_parts.append(order[has_representative])
+        # k 件前との組（代表との組は上で作ったので除く）
+        for k in range(1, min(BUCKET_COMPARE_LIMIT, count - 1) + 1):
+            neighbour = rank[k:] > k
+            left_parts.append(order[:-k][neighbour])
+            right_parts.append(order[k:][neighbour])
+
+    # 複数のバンドで同じ組が候補になることが多いので、重複を除いてから比べる
+    left = np.concatenate(left_parts)
+    right = np.concatenate(right_parts)
+    pair_keys = np.unique(np.minimum(left, right) * count + np.maximum(left, right))
+    left = pair_keys // count
+    right = pair_keys % count
+    # 候補の組は、署名全体の一致率で本当に似ているかを確かめる
+    similar = np.empty(len(pair_keys), dtype=bool)
+    for start in range(0, len(pair_keys), _COMPARE_CHUNK):
+        chunk = slice(start, start + _COMPARE_CHUNK)
+        matches = (signatures[left[chunk]] == signatures[right[chunk]]).mean(axis=1)
+        similar[chunk] = matches >= threshold
+
+    # 似ている組をつないで、グループにする（Union-Find）
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(doc_ids[left[similar]].tolist(), doc_ids[right[similar]].tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            # 番号の小さい方（先に現れた方）を代表にする
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    return [find(i) for i in range(len(texts))]
+
+
+def collapse_near_duplicates(
+    messages: Union[MessageBatch, Iterable[Dict]],
+    threshold: float = DEFAULT_THRESHOLD
+) -> List[Dict]:
+    """
+    ほぼ同じ内容のメッセージをまとめ、グループごとに代表の1件だけを残す。
+
+    代表は、グループの中で最初に現れたメッセージ（新しい順のリストなら最新のもの）。
+    2件以上をまとめた代表には "duplicate_count"（まとめた件数）が付き、本文の先頭に [×件数] が付く。
+
+    Args:
+        messages: メッセージのリストまたは MessageBatch
+        threshold: ほぼ同じとみなす類似度（0〜1、デフォルト: 0.7）
+
+    Returns:
+        まとめた後のメッセージのリスト（元の順番）
+
+    Raises:
+        RuntimeError: numpy がインストールされていない場合
+    """
+    messages = list(messages)
+    if not messages:
+        return []
+    representatives = find_clusters([msg["text"] for msg in messages], threshold)
+
+    sizes: Dict[int, int] = {}
+    for representative in representatives:
+        sizes[representative] = sizes.get(representative, 0) + 1
+
+    collapsed = []
+    for index, msg in enumerate(messages):
+        if representatives[index] != index:
+            continue
+        size = sizes[index]
+        if size > 1:
+            msg = dict(msg, text=f"[×{size}] {msg['text']}", duplicate_count=size)
+        collapsed.append(msg)
+    return collapsed
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Slackメッセージに添付されたファイルをローカルに保存するモジュール
+
+- 複数のファイルを同時にダウンロードする（同時に実行する数には上限を設ける）
+- ファイルは内容のハッシュ（SHA-256）を名前にして保存するので、同じファイルは1つしか保存されない
+- 一度保存したファイル（Slack のファイルID）は次回からダウンロードしない
+  （Slack は内容のハッシュを返さないので、同じ内容を新しいファイルIDでアップロードし直したものは、
+  一度ダウンロードしてからハッシュで同じと分かり、保存はされない。通信量は節約できない）
+- 途中で止まったダウンロードは、次回続きから再開する
+"""
+
+import hashlib
+import http.client
+import os
+import sqlite3
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional
+
+from slack_cache import CACHE_DIR
+from slack_client import get_slack_token
+from slack_clients import get_ssl_context
+
+
+# ファイルを保存するフォルダ
+DEFAULT_FILES_DIR = os.path.join(CACHE_DIR, "files")
+
+# 同時にダウンロードするファイル数の上限
+DEFAULT_MAX_WORKERS = 4
+
+# ダウンロード時に一度に読み書きするバイト数
+CHUNK_SIZE = 64 * 1024
+
+# ダウンロードのタイムアウト（秒）
+DOWNLOAD_TIMEOUT = 60
+
+
+def collect_files(messages: Iterable[Dict]) -> List[Dict]:
+    """
+    メッセージから添付ファイルの情報を集める（同じファイルIDは1つにまとめる）。
+
+    Args:
+        messages: get_channel_messages() のメッセージリストまたは MessageBatch
+
+    Returns:
+        ファイル情報のリスト。各要素は id, name, mimetype, size, url_private, channel, ts を持つ
+    """
+    files: Dict[str, Dict] = {}
+    for msg in messages:
+        for file in msg.get("files") or []:
+            if not file.get("url_private") or file["id"] in files:
+                continue
+            files[file["id"]] = dict(file, channel=msg["channel"], ts=msg["ts"])
+    return list(files.values())
+
+
+class FileArchiver:
+    """
+    添付ファイルを内容のハッシュで管理して保存する。
+
+    保存先のフォルダ構成:
+        <root>/blobs/ab/abcdef...   ファイル本体（名前は SHA-256）
+        <root>/partial/<ID>.part    ダウンロード途中のファイル
+        <root>/manifest.db          ファイルID → ハッシュ・ファイル名などの対応表
+    """
+
+    def __init__(
+        self,
+        root_dir: str = DEFAULT_FILES_DIR,
+        bot_token: Optional[str] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS
+    ):
+        """
+        Args:
+            root_dir: 保存先のフォルダ
+            bot_token: Bot Token（files:read スコープが必要。省略時は get_slack_token() で取得）
+            max_workers: 同時にダウンロードするファイル数の上限
+        """
+        self.bot_token = bot_token or get_slack_token()
+        self.root_dir = root_dir
+        self.max_workers = max_workers
+        self.blobs_dir = os.path.join(root_dir, "blobs")
+        self.partial_dir = os.path.join(root_dir, "partial")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(root_dir, "manifest.db"))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " file_id TEXT PRIMARY KEY,"
+            " sha256 TEXT NOT NULL,"
+            " name TEXT,"
+            " mimetype TEXT,"
+            " size INTEGER,"
+            " channel TEXT,"
+            " ts TEXT"
+            ")"
+        )
+        self.conn.commit()
+
+    def blob_path(self, sha256: str) -> str:
+        """ハッシュからファイル本体の保存先を返す"""
+        return os.path.join(self.blobs_dir, sha256[:2], sha256)
+
+    def lookup(self, file_id: str) -> Optional[str]:
+        """
+        保存済みのファイルのパスを返す。
+
+        Args:
+            file_id: Slack のファイルID（F1234567890）
+
+        Returns:
+            保存先のパス。まだ保存していない場合は None
+        """
+        row = self.conn.execute("SELECT sha256 FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return self.blob_path(row[0]) if row else None
+
+    def archive(self, messages: Iterable[Dict]) -> Dict[str, int]:
+        """
+        メッセージの添付ファイルをダウンロードして保存する。
+
+        Args:
+            messages: get_channel_messages() のメッセージリストまたは MessageBatch
+
+        Returns:
+            {"downloaded": 保存した数, "skipped": 保存済みで飛ばした数, "failed": 失敗した数}
+        """
+        files = collect_files(messages)
+        pending = [file for file in files if self.lookup(file["id"]) is None]
+        stats = {"downloaded": 0, "skipped": len(files) - len(pending), "failed": 0}
+        if not pending:
+            return stats
+
+        # ダウンロードは並列に行い、対応表への記録はこのスレッドでまとめて行う
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(pending)))) as executor:
+            futures = {executor.submit(self._download, file): file for file in pending}
+            for future in as_completed(futures):
+                file = futures[future]
+                try:
+                    sha256 = future.result()
+                except (OSError, RuntimeError, http.client.HTTPException):
+                    # HTTPException: 受信途中で切断された（IncompleteRead など）。途中の分は次回続きから取得する
+                    stats["failed"] += 1
+                    continue
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO files"
+                        " (file_id, sha256, name, mimetype, size, channel, ts)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (file["id"], sha256, file.get("name"), file.get("mimetype"),
+                         file.get("size"), file["channel"], file["ts"])
+                    )
+                stats["downloaded"] += 1
+        return stats
+
+    def _download(self, file: Dict) -> str:
+        """
+        ファイルを1つダウンロードして、ハッシュ名で保存する。
+
+        Returns:
+            ファイル内容の SHA-256
+
+        Raises:
+            OSError: ダウンロードや保存に失敗した場合
+            http.client.HTTPException: 受信途中で接続が切れた場合（IncompleteRead など）
+            RuntimeError: 権限不足などでファイルの代わりにログインページが返ってきた場合
+        """
+        part_path = os.path.join(self.partial_dir, file["id"] + ".part")
+        hasher = hashlib.sha256()
+
+        # 途中までダウンロード済みなら、その分のハッシュを計算して続きから取得する
+        offset = 0
+        if os.path.exists(part_path):
+            with open(part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+                    offset += len(chunk)
+
+        headers = {"Authorization": f"Bearer {self.bot_token}"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        request = urllib.request.Request(file["url_private"], headers=headers)
+
+        try:
+            response = urllib.request.urlopen(request, context=get_ssl_context(), timeout=DOWNLOAD_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code != 416:
+                raise
+            # 416: 途中のファイルがすでに最後まで揃っている
+            response = None
+
+        if response is not None:
+            with response:
+                content_type = response.headers.get("Content-Type", "")
+                if content_type.startswith("text/html") and "html" not in (file.get("mimetype") or ""):
+                    raise RuntimeError(
+                        "ファイルの代わりにログインページが返ってきました。"
+                        "Slack App に files:read スコープを追加してください。"
+                    )
+
+                mode = "ab"
+                if offset and response.status != 206:
+                    # サーバーが続きからの取得に対応していない場合は最初から
+                    hasher = hashlib.sha256()
+                    mode = "wb"
+
+                received = 0
+                with open(part_path, mode) as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        received += len(chunk)
+
+                # 途中で切断されても read() はエラーにならないことがあるので、受信した長さを確かめる
+                # （途中までの分は .part に残り、次回続きから取得する）
+                expected = response.headers.get("Content-Length")
+                if expected is not None and expected.isdigit() and received < int(expected):
+                    raise http.client.IncompleteRead(b"", int(expected) - received)
+
+        sha256 = hasher.hexdigest()
+        blob_path = self.blob_path(sha256)
+        if os.path.exists(blob_path):
+            # 同じ内容のファイルが保存済み（別のチャンネルに再投稿されたファイルなど）
+            os.remove(part_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(part_path, blob_path)
+        return sha256
+
+    def close(self) -> None:
+        """対応表のデータベースを閉じる"""
+        self.conn.close()
+
+    def __enter__(self) -> "FileArchiver":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Slackメッセージの履歴を、集計しやすい列形式のファイルに書き出すモジュール
+
+チャンネルごと・日付ごとに1ファイル（<出力先>/<チャンネルID>/<YYYY-MM-DD>.parquet または .npz）を作る。
+- pyarrow がインストールされていれば Parquet 形式
+- なければ numpy の .npz 形式
+同じ日のファイルがすでにある場合は、新しいメッセージがあるときだけ追加して書き直す（同じメッセージは重複しない）。
+どちらの形式も後から追記できないので、書き直すのはその日・そのチャンネルの1ファイルだけにしている。
+チャンネル名 → チャンネルID の対応は <出力先>/channels.json に保存し、名前での読み込みに使う。
+"""
+
+import glob
+import json
+import os
+from datetime import datetime
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from message_batch import MessageBatch
+from numpy_utils import has_numpy
+
+
+# 1日分のファイルに保存する列（タイムスタンプ, ユーザー名一覧, ユーザー番号, 本文）
+Columns = Tuple[List[float], List[str], List[int], List[str]]
+
+FORMAT_EXTENSIONS = {
+    "parquet": ".parquet",
+    "npz": ".npz",
+}
+
+# チャンネル名 → チャンネルID の対応を保存するファイル（出力先のフォルダの中）
+CHANNEL_INDEX_FILE = "channels.json"
+
+
+def _has_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def choose_format(fmt: str = "auto") -> str:
+    """
+    書き出す形式を決める。
+
+    Args:
+        fmt: "auto"（使えるものを自動で選ぶ）、"parquet"、"npz" のいずれか
+
+    Returns:
+        "parquet" または "npz"
+
+    Raises:
+        RuntimeError: 必要なパッケージがインストールされていない場合
+    """
+    if fmt in ("auto", "parquet") and _has_pyarrow():
+        return "parquet"
+    if fmt in ("auto", "npz") and has_numpy():
+        return "npz"
+    raise RuntimeError(
+        "エクスポートには pyarrow（Parquet 形式）または numpy（.npz 形式）が必要です。\n"
+        "pip install pyarrow または pip install numpy を実行してください。"
+    )
+
+
+def _channel_dir(channel: str) -> str:
+    """チャンネルID（ID がない場合はチャンネル名）をフォルダ名に使える形にする"""
+    name = channel[1:] if channel.startswith("#") else channel
+    return name.replace(os.sep, "_").replace("/", "_") or "_"
+
+
+def _load_channel_index(out_dir: str) -> Dict[str, str]:
+    """チャンネル名（# なし）→ チャンネルID の対応を読み込む（ない・壊れている場合は空）"""
+    try:
+        with open(os.path.join(out_dir, CHANNEL_INDEX_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_channel_index(out_dir: str, index: Dict[str, str]) -> None:
+    path = os.path.join(out_dir, CHANNEL_INDEX_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _iter_export_rows(
+    messages: Union[MessageBatch, Iterable[Dict]]
+) -> Iterable[Tuple[float, str, str, str, str]]:
+    """(タイムスタンプ, ユーザー名, チャンネルID, チャンネル名, 本文) で順に返す（ID がなければ名前を使う）"""
+    if isinstance(messages, MessageBatch):
+        return ((t, user, channel, channel, text) for t, user, channel, text in messages.rows())
+    return (
+        (msg["timestamp"], msg["user"], msg.get("channel_id") or msg.get("channel", ""),
+         msg.get("channel", ""), msg["text"])
+        for msg in messages
+    )
+
+
+def _write_parquet(path: str, channel: str, columns: Columns) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    timestamps, users, user_codes, texts = columns
+    table = pa.table({
+        "timestamp": pa.array(timestamps, pa.float64()),
+        "user": pa.DictionaryArray.from_arrays(
+            pa.array(user_codes, pa.int32()), pa.array(users, pa.string())
+        ),
+        "text": pa.array(texts, pa.large_string()),
+    })
+    table = table.replace_schema_metadata({"channel": channel})
+    pq.write_table(table, path, compression="zstd")
+
+
+def _read_parquet(path: str) -> Tuple[str, Columns]:
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    channel = (table.schema.metadata or {}).get(b"channel", b"").decode("utf-8")
+    user_column = table.column("user").combine_chunks()
+    columns = (
+        table.column("timestamp").to_numpy().tolist(),
+        user_column.dictionary.to_pylist(),
+        user_column.indices.to_numpy().tolist(),
+        table.column("text").to_pylist(),
+    )
+    return channel, columns
+
+
+def _pack_strings(values: List[str]):
+    """文字列のリストを (UTF-8 のバイト列, 文字数での開始位置) の numpy 配列にする"""
+    import numpy as np
+
+    buffer = np.frombuffer("".join(values).encode("utf-8"), dtype=np.uint8)
+    offsets = np.fromiter(accumulate((len(v) for v in values), initial=0), dtype=np.int64)
+    return buffer, offsets
+
+
+def _unpack_strings(buffer, offsets) -> Tuple[str, List[int]]:
+    """_pack_strings() の逆。つなげた文字列と開始位置のリストを返す"""
+    return buffer.tobytes().decode("utf-8"), offsets.tolist()
+
+
+def _write_npz(path: str, channel: str, columns: Columns) -> None:
+    import numpy as np
+
+    timestamps, users, user_codes, texts = columns
+    text_buffer, text_offsets = _pack_strings(texts)
+    user_buffer, user_offsets = _pack_strings(users)
+    # np.savez はファイル名に .npz を付け足すので、ファイルオブジェクトに書き込む
+    with open(path, "wb") as f:
+        np.savez_compressed(
+            f,
+            channel=np.frombuffer(channel.encode("utf-8"), dtype=np.uint8),
+            timestamps=np.asarray(timestamps, dtype=np.float64),
+            user_codes=np.asarray(user_codes, dtype=np.int32),
+            user_buffer=user_buffer,
+            user_offsets=user_offsets,
+            text_buffer=text_buffer,
+            text_offsets=text_offsets,
+        )
+
+
+def _read_npz_raw(path: str) -> Tuple[str, List[float], List[str], List[int], str, List[int]]:
+    """npz ファイルを (チャンネル, タイムスタンプ, ユーザー一覧, ユーザー番号, 本文, 本文の開始位置) で読み込む"""
+    import numpy as np
+
+    with np.load(path) as data:
+        channel = data["channel"].tobytes().decode("utf-8")
+        user_text, user_offsets = _unpack_strings(data["user_buffer"], data["user_offsets"])
+        text, text_offsets = _unpack_strings(data["text_buffer"], data["text_offsets"])
+        users = [user_text[start:end] for start, end in zip(user_offsets, user_offsets[1:])]
+        return (
+            channel,
+            data["timestamps"].tolist(),
+            users,
+            data["user_codes"].tolist(),
+            text,
+            text_offsets,
+        )
+
+
+def _read_npz(path: str) -> Tuple[str, Columns]:
+    channel, timestamps, users, user_codes, text, offsets = _read_npz_raw(path)
+    texts = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+    return channel, (timestamps, users, user_codes, texts)
+
+
+def _read_file(path: str) -> Tuple[str, Columns]:
+    if path.endswith(".parquet"):
+        return _read_parquet(path)
+    return _read_npz(path)
+
+
+def _write_file(path: str, fmt: str, channel: str, columns: Columns) -> None:
+    """書き込み途中で止まっても壊れないよう、一時ファイルに書いてから置き換える"""
+    tmp_path = path + ".tmp"
+    if fmt == "parquet":
+        _write_parquet(tmp_path, channel, columns)
+    else:
+        _write_npz(tmp_path, channel, columns)
+    os.replace(tmp_path, path)
+
+
+def _merge(existing: Optional[Columns], rows: List[Tuple[float, str, str]]) -> Columns:
+    """既存の列と新しい行をまとめ、タイムスタンプで重複を除いて古い順に並べる"""
+    by_timestamp: Dict[float, Tuple[str, str]] = {}
+    if existing is not None:
+        timestamps, users, user_codes, texts = existing
+        for timestamp, code, text in zip(timestamps, user_codes, texts):
+            by_timestamp[timestamp] = (users[code], text)
+    for timestamp, user, text in rows:
+        by_timestamp[timestamp] = (user, text)
+
+    user_index: Dict[str, int] = {}
+    merged: Columns = ([], [], [], [])
+    for timestamp in sorted(by_timestamp):
+        user, text = by_timestamp[timestamp]
+        code = user_index.setdefault(user, len(user_index))
+        if code == len(merged[1]):
+            merged[1].append(user)
+        merged[0].append(timestamp)
+        merged[2].append(code)
+        merged[3].append(text)
+    return merged
+
+
+def _rows_of(columns: Columns) -> List[Tuple[float, str, str]]:
+    """列を (タイムスタンプ, ユーザー名, 本文) の行に戻す"""
+    timestamps, users, user_codes, texts = columns
+    return [(t, users[c], text) for t, c, text in zip(timestamps, user_codes, texts)]
+
+
+def export_messages(
+    messages: Union[MessageBatch, Iterable[Dict]],
+    out_dir: str,
+    fmt: str = "auto"
+) -> List[str]:
+    """
+    メッセージをチャンネルごと・日付ごとのファイルに書き出す。
+
+    フォルダはチャンネルIDごとに分ける（チャンネルを名前で指定してもIDで指定しても同じフォルダになる）。
+    すでに書き出したメッセージしかない日のファイルは書き直さない。
+
+    Args:
+        messages: get_channel_messages() のメッセージリストまたは MessageBatch
+            （MessageBatch はチャンネルIDを持たないので、チャンネル名のフォルダになる）
+        out_dir: 出力先のフォルダ
+        fmt: "auto"、"parquet"、"npz" のいずれか（デフォルト: "auto"）
+
+    Returns:
+        書き出した（更新した）ファイルのパスのリスト
+
+    Raises:
+        RuntimeError: 必要なパッケージがインストールされていない場合
+    """
+    fmt = choose_format(fmt)
+    extension = FORMAT_EXTENSIONS[fmt]
+
+    # チャンネル・日付ごとに分ける（日付の計算は15分単位でまとめて行う）
+    groups: Dict[Tuple[str, str], List[Tuple[float, str, str]]] = {}
+    names: Dict[str, str] = {}
+    day_of_slot: Dict[int, str] = {}
+    for timestamp, user, channel_id, channel, text in _iter_export_rows(messages):
+        slot = int(timestamp // 900)
+        day = day_of_slot.get(slot)
+        if day is None:
+            day = datetime.fromtimestamp(slot * 900).strftime("%Y-%m-%d")
+            day_of_slot[slot] = day
+        groups.setdefault((channel_id, day), []).append((timestamp, user, text))
+        names[channel_id] = channel
+
+    os.makedirs(out_dir, exist_ok=True)
+    channel_index = _load_channel_index(out_dir)
+    updated_index = dict(channel_index)
+    for channel_id, channel in names.items():
+        name = channel.lstrip("#")
+        if name and name != channel_id:
+            updated_index[name] = channel_id
+    if updated_index != channel_index:
+        _save_channel_index(out_dir, updated_index)
+
+    paths = []
+    for (channel_id, day), rows in groups.items():
+        channel_dir = os.path.join(out_dir, _channel_dir(channel_id))
+        os.makedirs(channel_dir, exist_ok=True)
+        path = os.path.join(channel_dir, day + extension)
+
+        # 別の形式で書かれた同じ日のファイルがあれば、それも取り込む
+        existing = None
+        converted = []
+        for other in FORMAT_EXTENSIONS.values():
+            other_path = os.path.join(channel_dir, day + other)
+            if os.path.exists(other_path):
+                existing = _merge(existing, _rows_of(_read_file(other_path)[1]))
+                if other_path != path:
+                    converted.append(other_path)
+
+        merged = _merge(existing, rows)
+        if merged == existing and not converted:
+            # 新しいメッセージがない日は書き直さない
+            continue
+        _write_file(path, fmt, names[channel_id], merged)
+        for other_path in converted:
+            os.remove(other_path)
+        paths.append(path)
+    return paths
+
+
+def load_export(
+    out_dir: str,
+    channel: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None
+) -> MessageBatch:
+    """
+    export_messages() で書き出したファイルを読み込んで、1つの MessageBatch にする。
+
+    Args:
+        out_dir: 出力先のフォルダ
+        channel: 読み込むチャンネルの名前（#general）またはID（未指定の場合は全チャンネル）
+        start: 読み込む最初の日付（"YYYY-MM-DD"、この日を含む）
+        end: 読み込む最後の日付（"YYYY-MM-DD"、この日を含む）
+
+    Returns:
+        MessageBatch（get_channel_messages() と同じ新しい順）
+    """
+    if channel:
+        channel_id = _load_channel_index(out_dir).get(channel.lstrip("#"), channel)
+        pattern_dir = glob.escape(_channel_dir(channel_id))
+    else:
+        pattern_dir = "*"
+    paths = sorted(
+        glob.glob(os.path.join(out_dir, pattern_dir, "*.parquet"))
+        + glob.glob(os.path.join(out_dir, pattern_dir, "*.npz"))
+    )
+
+    batch = MessageBatch()
+    for path in paths:
+        day = os.path.splitext(os.path.basename(path))[0]
+        if (start and day < start) or (end and day > end):
+            continue
+
+        if path.endswith(".npz"):
+            # npz は本文が1つの文字列で保存されているので、そのまま使う
+            file_channel, timestamps, users, user_codes, text, offsets = _read_npz_raw(path)
+        else:
+            file_channel, (timestamps, users, user_codes, texts) = _read_parquet(path)
+            text = "".join(texts)
+            offsets = list(accumulate((len(t) for t in texts), initial=0))
+        batch.extend_columns(file_channel, timestamps, users, user_codes, text, offsets)
+    # ファイルはチャンネルごと・日付の古い順に読むので、最後にまとめて新しい順に並べ替える
+    return batch.sorted_by_time()
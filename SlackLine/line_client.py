@@ -5,11 +5,116 @@ LINE Messaging API を使用してメッセージを送信するモジュール
 """
 
 import os
-from typing import Optional
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
 from linebot import LineBotApi
+from linebot.http_client import HttpClient, RequestsHttpClient, RequestsHttpResponse
 from linebot.models import TextSendMessage
 from linebot.exceptions import LineBotApiError
 
+from text_chunker import iter_chunks, utf16_length
+
+
+# 1回の push で送れるメッセージの数の上限（LINE の仕様）
+MAX_MESSAGES_PER_PUSH = 5
+
+# 1回の multicast で送れる送信先の数の上限（LINE の仕様）
+MULTICAST_BATCH_SIZE = 500
+
+# multicast を同時に送る数の上限（デフォルト）
+DEFAULT_MULTICAST_WORKERS = 4
+
+# トークンごとの LINE クライアント（プロセス内で使い回す）
+_clients: Dict[str, LineBotApi] = {}
+_clients_lock = threading.Lock()
+
+
+class SessionHttpClient(RequestsHttpClient):
+    """
+    requests.Session で接続を使い回す LINE SDK 用の HTTP クライアント。
+
+    SDK 標準の RequestsHttpClient は呼び出しのたびに新しい接続を張るが、
+    こちらは一度張った接続（keep-alive）を次の呼び出しでも使うので、続けて送るときに速い。
+    requests.Session は複数のスレッドから同時に使うと安全ではないので、Session はスレッドごとに1つ作る
+    （1つのクライアントを Web サーバーとタイマーなど別々のスレッドから使ってもよい）。
+    """
+
+    def __init__(self, timeout=HttpClient.DEFAULT_TIMEOUT):
+        super().__init__(timeout)
+        self._local = threading.local()
+        # close() で閉じるために、作った Session を覚えておく（終了したスレッドの分は自動で消える）
+        self._sessions = weakref.WeakSet()
+        self._sessions_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """このスレッド用の Session（初めて使うときに作る）"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.add(session)
+        return session
+
+    def _request(self, method: str, url: str, timeout=None, **kwargs) -> RequestsHttpResponse:
+        if timeout is None:
+            timeout = self.timeout
+        return RequestsHttpResponse(self.session.request(method, url, timeout=timeout, **kwargs))
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request("GET", url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request("POST", url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request("DELETE", url, timeout, headers=headers, data=data)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request("PUT", url, timeout, headers=headers, data=data)
+
+    def close(self) -> None:
+        """全てのスレッドの Session を閉じる（この後に送ると、新しい Session で接続し直す）"""
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+            self._sessions.clear()
+            self._local = threading.local()
+        for session in sessions:
+            session.close()
+
+
+def get_line_bot_api(channel_access_token: str) -> LineBotApi:
+    """
+    トークンごとに1つの LineBotApi を作り、使い回す。
+
+    接続は SessionHttpClient が保持するので、同じトークンで何通送っても接続の準備はスレッドごとに最初の1回だけで済む。
+
+    Args:
+        channel_access_token: Channel Access Token
+
+    Returns:
+        LineBotApi
+    """
+    with _clients_lock:
+        line_bot_api = _clients.get(channel_access_token)
+        if line_bot_api is None:
+            line_bot_api = LineBotApi(channel_access_token, http_client=SessionHttpClient)
+            _clients[channel_access_token] = line_bot_api
+        return line_bot_api
+
+
+def close_line_clients() -> None:
+    """使い回している LINE クライアントの接続を全て閉じる"""
+    with _clients_lock:
+        for line_bot_api in _clients.values():
+            line_bot_api.http_client.close()
+        _clients.clear()
+
 
 def get_line_token() -> str:
     """
@@ -63,6 +168,24 @@ def get_line_user_id() -> str:
     )
 
 
+def _describe_error(e: LineBotApiError) -> str:
+    """LINE API のエラーを、原因の見当が付くメッセージにする"""
+    error_msg = f"LINE API エラー: {e.status_code} - {e.error.message}"
+    if e.status_code == 401:
+        error_msg += "\nChannel Access Token が無効です。トークンを確認してください。"
+    elif e.status_code == 400:
+        error_msg += "\nリクエストが無効です。User ID を確認してください。"
+    return error_msg
+
+
+def _text_messages(messages: List[str]) -> List[List[TextSendMessage]]:
+    """メッセージを、1回の呼び出しで送れる数（5通）ずつのまとまりにする"""
+    return [
+        [TextSendMessage(text=message) for message in messages[start:start + MAX_MESSAGES_PER_PUSH]]
+        for start in range(0, len(messages), MAX_MESSAGES_PER_PUSH)
+    ]
+
+
 def send_line_message(
     message: str,
     channel_access_token: Optional[str] = None,
@@ -83,6 +206,30 @@ def send_line_message(
         LineBotApiError: API呼び出しに失敗した場合
         RuntimeError: Token や User ID が設定されていない場合
     """
+    return send_line_messages([message], channel_access_token, user_id)
+
+
+def send_line_messages(
+    messages: List[str],
+    channel_access_token: Optional[str] = None,
+    user_id: Optional[str] = None
+) -> bool:
+    """
+    LINE に複数のメッセージを順番に送信する。
+
+    1回の push で最大5通まで送れるので、5通ずつまとめて送る（10通なら2回の呼び出しで済む）。
+
+    Args:
+        messages: 送信するメッセージ内容のリスト
+        channel_access_token: Channel Access Token（未指定の場合は自動取得）
+        user_id: 送信先のUser ID（未指定の場合は自動取得）
+
+    Returns:
+        送信成功時は True
+
+    Raises:
+        RuntimeError: API呼び出しに失敗した場合、Token や User ID が設定されていない場合
+    """
     if channel_access_token is None:
         channel_access_token = get_line_token()
     
@@ -90,17 +237,12 @@ def send_line_message(
         user_id = get_line_user_id()
     
     try:
-        line_bot_api = LineBotApi(channel_access_token)
-        text_message = TextSendMessage(text=message)
-        line_bot_api.push_message(user_id, text_message)
+        line_bot_api = get_line_bot_api(channel_access_token)
+        for text_messages in _text_messages(messages):
+            line_bot_api.push_message(user_id, text_messages)
         return True
     except LineBotApiError as e:
-        error_msg = f"LINE API エラー: {e.status_code} - {e.error.message}"
-        if e.status_code == 401:
-            error_msg += "\nChannel Access Token が無効です。トークンを確認してください。"
-        elif e.status_code == 400:
-            error_msg += "\nリクエストが無効です。User ID を確認してください。"
-        raise RuntimeError(error_msg) from e
+        raise RuntimeError(_describe_error(e)) from e
 
 
 def send_long_message(
@@ -110,7 +252,7 @@ def send_long_message(
     user_id: Optional[str] = None
 ) -> bool:
     """
-    LINE に長いメッセージを送信する（2000文字を超える場合は分割して送信）。
+    LINE に長いメッセージを送信する（2000文字を超える場合は分割し、5通ずつまとめて送信）。
 
     Args:
         message: 送信するメッセージ内容
@@ -121,33 +263,97 @@ def send_long_message(
     Returns:
         送信成功時は True
     """
-    if len(message) <= max_length:
-        return send_line_message(message, channel_access_token, user_id)
+    return send_line_messages(split_message(message, max_length), channel_access_token, user_id)
+
+
+def split_message(message: str, max_length: int = 2000) -> List[str]:
+    """
+    長いメッセージを max_length 文字以内の部分に分ける（text_chunker.iter_chunks() を使う）。
+
+    文字数は LINE と同じく UTF-16 の単位で数える（絵文字などは1文字で2と数える）。
+    2つ以上に分かれた場合は、各部分の先頭に【番号/全体の数】を付け、その分も含めて max_length 以内にする。
+
+    Args:
+        message: メッセージ内容
+        max_length: 1メッセージあたりの最大文字数（デフォルト: 2000）
+
+    Returns:
+        分けたメッセージのリスト（max_length 以内なら message だけのリスト）
+    """
+    total_length = utf16_length(message)
+    if total_length <= max_length:
+        return [message]
+    # 絵文字など（UTF-16 で2と数える文字）がなければ、速い len() で数えても同じ
+    measure = len if total_length == len(message) else utf16_length
     
-    # メッセージを分割
-    parts = []
-    current_part = ""
+    # 番号の分の文字数を空けて分ける。全体の数が想定した桁数に収まらなければ、桁を増やして分け直す
+    # （部分は max_length より短くなることが多いので、最初は max_length の半分ずつに分けた場合の数の桁数を想定する）
+    digits = len(str(total_length * 2 // max_length + 1))
+    while True:
+        reserved = utf16_length(f"【{'9' * digits}/{'9' * digits}】\n")
+        parts = list(iter_chunks(message, max_length - reserved, measure))
+        if len(str(len(parts))) <= digits:
+            break
+        digits += 1
     
-    for line in message.split("\n"):
-        if len(current_part) + len(line) + 1 > max_length:
-            if current_part:
-                parts.append(current_part)
-            current_part = line
-        else:
-            if current_part:
-                current_part += "\n" + line
-            else:
-                current_part = line
+    if len(parts) > 1:
+        parts = [f"【{i}/{len(parts)}】\n{part}" for i, part in enumerate(parts, 1)]
+    return parts
+
+
+def multicast_long_message(
+    message: str,
+    user_ids: List[str],
+    max_length: int = 2000,
+    channel_access_token: Optional[str] = None,
+    max_workers: int = DEFAULT_MULTICAST_WORKERS
+) -> List[Tuple[List[str], str]]:
+    """
+    たくさんの相手に同じメッセージを送信する（multicast）。
+
+    送信先を LINE の上限の500人ずつに分け、それぞれを別のスレッドで同時に送る。
+    長いメッセージは send_long_message() と同じように分割し、5通ずつまとめて送る。
+    一部の送信先への送信に失敗しても、ほかの送信先には送信する。
+
+    Args:
+        message: 送信するメッセージ内容
+        user_ids: 送信先の User ID のリスト（重複は除く）
+        max_length: 1メッセージあたりの最大文字数（デフォルト: 2000）
+        channel_access_token: Channel Access Token（未指定の場合は自動取得）
+        max_workers: 同時に送信する数の上限（デフォルト: 4）
+
+    Returns:
+        送信に失敗した分の (送信先の User ID のリスト, エラーメッセージ) のリスト。全て成功した場合は空のリスト
+
+    Raises:
+        RuntimeError: Token が設定されていない場合
+    """
+    if channel_access_token is None:
+        channel_access_token = get_line_token()
+    line_bot_api = get_line_bot_api(channel_access_token)
     
-    if current_part:
-        parts.append(current_part)
+    user_ids = list(dict.fromkeys(user_ids))
+    batches = [
+        user_ids[start:start + MULTICAST_BATCH_SIZE]
+        for start in range(0, len(user_ids), MULTICAST_BATCH_SIZE)
+    ]
+    if not batches:
+        return []
+    text_messages = _text_messages(split_message(message, max_length))
     
-    # 各部分を送信
-    for i, part in enumerate(parts, 1):
-        if len(parts) > 1:
-            header = f"【{i}/{len(parts)}】\n"
-            part = header + part
-        send_line_message(part, channel_access_token, user_id)
+    def send(batch: List[str]) -> None:
+        # 同じ送信先には、分割した順番どおりに届くよう1つのスレッドで順に送る
+        for messages in text_messages:
+            line_bot_api.multicast(batch, messages)
     
-    return True
-
+    failures: List[Tuple[List[str], str]] = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        futures = [(batch, executor.submit(send, batch)) for batch in batches]
+        for batch, future in futures:
+            try:
+                future.result()
+            except LineBotApiError as e:
+                failures.append((batch, _describe_error(e)))
+            except requests.RequestException as e:
+                failures.append((batch, f"LINE への接続に失敗しました: {e}"))
+    return failures
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LINE に送るメッセージを SQLite に貯めておき、バックグラウンドで送信するモジュール（送信待ちの箱 = outbox）
+
+送る側は enqueue_long_message() で箱に入れるだけですぐに次の処理に進める。
+別スレッドの送信係が箱から順に取り出して送り、429（呼び出しすぎ）や 5xx（LINE 側の一時的なエラー）、
+接続の失敗のときは、待ち時間を倍々に延ばしながらやり直す。
+箱はファイルに保存されるので、途中でプログラムが終了しても、次に起動したときに続きから送信される。
+
+同じ送信を2回届けないよう、送信ごとに X-Line-Retry-Key（やり直し用のキー）を付ける。
+やり直しのときは同じキーを使うので、前回の送信が実は届いていた場合は LINE 側で重複が防がれる。
+同じ送信先へのメッセージは、箱に入れた順番どおりに届ける。
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import requests
+from linebot import LineBotApi
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+
+from line_client import (
+    MAX_MESSAGES_PER_PUSH,
+    SessionHttpClient,
+    get_line_token,
+    get_line_user_id,
+    split_message,
+)
+from slack_cache import CACHE_DIR
+
+
+# 送信待ちのメッセージを保存するデータベースファイル
+DEFAULT_OUTBOX_PATH = os.path.join(CACHE_DIR, "outbox.db")
+
+# やり直しの回数の上限（これを超えたら送信をあきらめる）
+MAX_ATTEMPTS = 8
+
+# やり直しまでの待ち時間（秒）。1回目は BASE_DELAY 秒、以降は倍々に延ばし、MAX_DELAY 秒で頭打ちにする
+BASE_DELAY = 1.0
+MAX_DELAY = 300.0
+
+# join() で送信が終わるのを待つ時間（秒）のデフォルト
+DEFAULT_JOIN_TIMEOUT = 60.0
+
+# やり直し用のキーを付けるヘッダー
+RETRY_KEY_HEADER = "X-Line-Retry-Key"
+
+
+def _is_retryable(e: Exception) -> bool:
+    """時間をおけば成功する見込みのあるエラーか"""
+    if isinstance(e, requests.RequestException):
+        return True
+    return isinstance(e, LineBotApiError) and (e.status_code == 429 or e.status_code >= 500)
+
+
+def _backoff(attempts: int, e: Exception) -> float:
+    """attempts 回目の失敗の後、次にやり直すまでの待ち時間（秒）"""
+    delay = min(MAX_DELAY, BASE_DELAY * 2 ** (attempts - 1))
+    # 同時に失敗した送信が一斉にやり直さないよう、待ち時間を少しばらつかせる
+    delay *= 0.5 + random.random() / 2
+    # 429 で待ち時間を指定された場合は、それより早くやり直さない
+    if isinstance(e, LineBotApiError) and e.headers:
+        try:
+            delay = max(delay, float(e.headers.get("Retry-After", 0)))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+
+class LineOutbox:
+    """
+    LINE への送信待ちのメッセージを保存し、バックグラウンドのスレッドで送信する。
+
+    使い方:
+        outbox = LineOutbox()
+        outbox.start()                         # 前回送れなかった分の送信も始まる
+        outbox.enqueue_long_message(summary)   # 箱に入れるだけなので、すぐに戻る
+        ...
+        remaining = outbox.join(timeout=60)    # 送信が終わるのを待つ（残りは次回送信）
+        outbox.close()
+    """
+
+    def __init__(self, path: str = DEFAULT_OUTBOX_PATH, channel_access_token: Optional[str] = None):
+        """
+        Args:
+            path: データベースファイルのパス
+            channel_access_token: Channel Access Token（未指定の場合は start() のときに自動取得）
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.channel_access_token = channel_access_token
+        self.conn = self._connect()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " recipient TEXT NOT NULL,"
+            " messages TEXT NOT NULL,"
+            " retry_key TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL"
+            ")"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, recipient, id)"
+        )
+        self.conn.commit()
+
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 送信係のスレッドと同時に書き込むことがあるので、ロック待ちを長めにする
+        return sqlite3.connect(self.path, timeout=30)
+
+    def enqueue(self, messages: List[str], user_id: Optional[str] = None) -> int:
+        """
+        メッセージを送信待ちの箱に入れる（送信はバックグラウンドで行う）。
+
+        5通ずつを1回の送信にまとめ、それぞれにやり直し用のキーを付けて保存する。
+
+        Args:
+            messages: 送信するメッセージ内容のリスト（この順番で届く）
+            user_id: 送信先のUser ID（未指定の場合は自動取得）
+
+        Returns:
+            箱に入れた送信の数
+
+        Raises:
+            RuntimeError: User ID が設定されていない場合
+        """
+        if not messages:
+            return 0
+        if user_id is None:
+            user_id = get_line_user_id()
+        now = time.time()
+        rows = [
+            (user_id, json.dumps(messages[start:start + MAX_MESSAGES_PER_PUSH], ensure_ascii=False),
+             uuid.uuid4().hex, now, now)
+            for start in range(0, len(messages), MAX_MESSAGES_PER_PUSH)
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO outbox (recipient, messages, retry_key, next_attempt_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        self._wake.set()
+        return len(rows)
+
+    def enqueue_long_message(
+        self,
+        message: str,
+        max_length: int = 2000,
+        user_id: Optional[str] = None
+    ) -> int:
+        """
+        長いメッセージを send_long_message() と同じように分割して、送信待ちの箱に入れる。
+
+        Args:
+            message: 送信するメッセージ内容
+            max_length: 1メッセージあたりの最大文字数（デフォルト: 2000）
+            user_id: 送信先のUser ID（未指定の場合は自動取得）
+
+        Returns:
+            箱に入れた送信の数
+        """
+        return self.enqueue(split_message(message, max_length), user_id)
+
+    def pending_count(self) -> int:
+        """まだ送信していない（やり直し待ちを含む）送信の数"""
+        return self.conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def failed_count(self) -> int:
+        """送信をあきらめた送信の数"""
+        return self.conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+
+    def start(self) -> None:
+        """バックグラウンドで送信を始める（箱に残っている前回の分も送信する）"""
+        if self._thread is not None:
+            return
+        # トークンが設定されていない場合は、スレッドの中ではなくここでエラーにする
+        if self.channel_access_token is None:
+            self.channel_access_token = get_line_token()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="line-outbox", daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: float = DEFAULT_JOIN_TIMEOUT) -> int:
+        """
+        箱が空になるか timeout 秒たつまで待ち、送信係を止める。
+
+        Args:
+            timeout: 待つ時間の上限（秒）
+
+        Returns:
+            送信できずに箱に残った数（次に start() したときに送信される）
+        """
+        deadline = time.monotonic() + timeout
+        while self._thread is not None and self._thread.is_alive():
+            if self.pending_count() == 0 or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.pending_count()
+
+    def close(self) -> None:
+        """送信係を止め、データベースを閉じる（送信中の1回は最後まで行う）"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.conn.close()
+
+    def __enter__(self) -> "LineOutbox":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        """送信係のスレッド: 送れるものがあれば送り、なければ次のやり直しの時刻まで待つ"""
+        conn = self._connect()
+        # 送信係専用のクライアントを使う（やり直し用のキーのヘッダーを、ほかの送信と共有しないため）
+        line_bot_api = None
+        try:
+            while not self._stop.is_set():
+                row = self._next_ready(conn)
+                if row is None:
+                    self._wake.clear()
+                    self._wake.wait(self._seconds_until_next(conn))
+                    continue
+                if line_bot_api is None:
+                    line_bot_api = LineBotApi(self.channel_access_token, http_client=SessionHttpClient)
+                self._deliver(conn, line_bot_api, row)
+        finally:
+            if line_bot_api is not None:
+                line_bot_api.http_client.close()
+            conn.close()
+
+    @staticmethod
+    def _next_ready(conn: sqlite3.Connection) -> Optional[tuple]:
+        """
+        次に送る1件を選ぶ。
+
+        送信先ごとに、まだ送っていないうちで一番古いものだけが候補になる
+        （前のメッセージがやり直し待ちの間は、後のメッセージも待たせて順番を守る）。
+        """
+        return conn.execute(
+            "SELECT id, recipient, messages, retry_key, attempts FROM outbox AS o"
+            " WHERE status = 'pending' AND next_attempt_at <= ?"
+            " AND NOT EXISTS ("
+            "  SELECT 1 FROM outbox AS e"
+            "  WHERE e.status = 'pending' AND e.recipient = o.recipient AND e.id < o.id"
+            " )"
+            " ORDER BY id LIMIT 1",
+            (time.time(),)
+        ).fetchone()
+
+    @staticmethod
+    def _seconds_until_next(conn: sqlite3.Connection) -> float:
+        """次のやり直しの時刻までの秒数（送信待ちがなければ、新しく箱に入るまで待つので長め）"""
+        row = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()
+        if row[0] is None:
+            return MAX_DELAY
+        return min(max(row[0] - time.time(), 0.05), MAX_DELAY)
+
+    def _deliver(self, conn: sqlite3.Connection, line_bot_api: LineBotApi, row: tuple) -> None:
+        """1件を送信し、結果をデータベースに記録する"""
+        row_id, recipient, messages, retry_key, attempts = row
+        text_messages = [TextSendMessage(text=text) for text in json.loads(messages)]
+        try:
+            line_bot_api.push_message(recipient, text_messages, retry_key=retry_key)
+        except (LineBotApiError, requests.RequestException) as e:
+            # 409: 同じキーの送信は受け付け済み（前回の送信が届いていた）
+            if isinstance(e, LineBotApiError) and e.status_code == 409:
+                with conn:
+                    conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+                return
+            attempts += 1
+            if _is_retryable(e) and attempts < MAX_ATTEMPTS:
+                status, next_attempt_at = "pending", time.time() + _backoff(attempts, e)
+            else:
+                status, next_attempt_at = "failed", time.time()
+            with conn:
+                conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?"
+                    " WHERE id = ?",
+                    (status, attempts, next_attempt_at, str(e), row_id)
+                )
+            return
+        finally:
+            # SDK はこのヘッダーをクライアントに残したままにするので、次の送信に付かないよう外す
+            line_bot_api.headers.pop(RETRY_KEY_HEADER, None)
+
+        with conn:
+            conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
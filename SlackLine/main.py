@@ -6,9 +6,22 @@ Slackチャンネルからメッセージを取得し、LINEに送信するメ
 
 import argparse
 import sys
-from slack_client import get_channel_messages, format_messages_for_display
-from line_client import send_long_message
-from summarizer import summarize_messages, create_simple_summary
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from slack_sdk.errors import SlackApiError
+from slack_client import (
+    THREAD_WATCH_SECONDS, expand_thread_replies, fetch_channels_messages,
+    format_messages_for_display, get_user_directory, merge_messages, resolve_channel_id
+)
+from state_store import StateStore, digest_key
+from message_archive import MessageArchive
+from file_archiver import DEFAULT_FILES_DIR, FileArchiver
+from history_export import export_messages
+from dedup import collapse_near_duplicates
+from line_client import multicast_long_message, send_long_message
+from line_outbox import DEFAULT_JOIN_TIMEOUT, LineOutbox
+from summarizer import SUMMARY_MODES, summarize_messages, create_simple_summary
 
 
 def parse_args() -> argparse.Namespace:
@@ -29,12 +42,67 @@ def parse_args() -> argparse.Namespace:
   
   # 最大50件のメッセージを取得
   python main.py --channel "#general" --limit 50
+  
+  # 前回の実行以降の新しいメッセージだけを取得（定期実行向け）
+  python main.py --channel "#general" --since-last-run
+  
+  # 前回と同じ内容でも送信する（通常は同じ内容の要約は送信しない）
+  python main.py --channel "#general" --force
+  
+  # 複数のチャンネルをまとめて1つの要約にする
+  python main.py --channel "#general" "#random" "#dev"
+  
+  # チャンネル一覧ファイル（1行に1チャンネル）から読み込む
+  python main.py --channel-file channels.txt
+  
+  # スレッド内の返信も含める
+  python main.py --channel "#general" --threads
+  
+  # 最初と最後の数件ではなく、全体から重要なメッセージを選んで要約する
+  python main.py --channel "#general" --summary-mode tfidf
+  
+  # 1週間分の時間帯別の件数・よく投稿した人・盛り上がったスレッドを載せる
+  python main.py --channel "#general" --hours 168 --stats
+  
+  # 1か月分のよく出た話題とよく投稿した人の上位を載せる（件数が多くても一定のメモリで集計）
+  python main.py --channel "#general" --hours 720 --topics
+  
+  # 通知などのほぼ同じメッセージを1件にまとめて送る
+  python main.py --channel "#deploy" --no-summary --collapse-duplicates
+  
+  # ファイルに書いた全員（1行に1人の User ID）に送る
+  python main.py --channel "#general" --recipients-file team.txt
+  
+  # 送信を箱（.cache/outbox.db）に入れてバックグラウンドで送る（失敗しても次回やり直す）
+  python main.py --channel "#general" --outbox
+  
+  # 取得したメッセージをローカルに保存しておき、あとから検索する
+  python main.py --channel "#general" --archive
+  python main.py search "デプロイ"
+  
+  # メッセージに添付されたファイルも保存する（同じファイルは1回だけダウンロード）
+  python main.py --channel "#general" --download-files
+  
+  # 集計用に、チャンネル・日付ごとの列形式ファイルに書き出す（送信はしない）
+  python main.py --channel "#general" --hours 720 --export exports/
         """
     )
     parser.add_argument(
         "--channel", "-c",
-        required=True,
-        help="Slackチャンネル名（#general）またはチャンネルID（C1234567890）"
+        nargs="+",
+        action="extend",
+        default=[],
+        help="Slackチャンネル名（#general）またはチャンネルID（C1234567890）。複数指定可"
+    )
+    parser.add_argument(
+        "--channel-file",
+        help="取得するチャンネルを1行に1つずつ書いたファイル"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="複数チャンネルを同時に取得する数の上限（デフォルト: 8）"
     )
     parser.add_argument(
         "--hours", "-H",
@@ -45,49 +113,358 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--limit", "-l",
         type=int,
-        default=100,
-        help="取得するメッセージの最大数（デフォルト: 100）"
+        default=None,
+        help="取得するメッセージの最大数（デフォルト: 期間内の全件。--since-last-run とは併用できない）"
     )
     parser.add_argument(
         "--no-summary",
         action="store_true",
         help="要約機能を使わずに全てのメッセージを送信する"
     )
+    parser.add_argument(
+        "--summary-mode",
+        choices=SUMMARY_MODES,
+        default="digest",
+        help="要約の方式（digest: 最初と最後の3件、tfidf: 全体から重要なメッセージを選ぶ。numpy が必要）"
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="要約に時間帯別の件数・よく投稿した人・盛り上がったスレッドを載せる（numpy が必要）"
+    )
+    parser.add_argument(
+        "--topics",
+        action="store_true",
+        help="要約によく出た話題（単語）とよく投稿した人の上位を載せる（件数が多くても一定のメモリで集計）"
+    )
+    parser.add_argument(
+        "--collapse-duplicates",
+        action="store_true",
+        help="ほぼ同じ内容のメッセージ（通知など）を1件にまとめてから送信する（numpy が必要）"
+    )
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="スレッド内の返信も取得する（前回送信した後の新しい返信だけ。古いメッセージのスレッドも最近の返信は確認する）"
+    )
+    parser.add_argument(
+        "--since-last-run",
+        action="store_true",
+        help="前回LINEに送信したメッセージより新しいものだけを取得する（初回は --hours の範囲）"
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
         help="実際にLINEに送信せず、内容を表示するだけ"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="前回送信した要約と同じ内容でも送信する"
+    )
+    parser.add_argument(
+        "--recipients-file",
+        metavar="FILE",
+        help="送信先の LINE User ID を1行に1つずつ書いたファイル（指定すると LINE_USER_ID の代わりに全員へ送る）"
+    )
+    parser.add_argument(
+        "--outbox",
+        action="store_true",
+        help="送信を送信待ちの箱に入れ、バックグラウンドで送る（一時的なエラーはやり直し、送れなかった分は次回送信）"
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="取得したメッセージをローカルのアーカイブに保存する（search で検索できるようになる）"
+    )
+    parser.add_argument(
+        "--download-files",
+        nargs="?",
+        const=DEFAULT_FILES_DIR,
+        metavar="DIR",
+        help=f"添付ファイルをダウンロードして保存する（デフォルトの保存先: {DEFAULT_FILES_DIR}）"
+    )
+    
+    parser.add_argument(
+        "--export",
+        metavar="DIR",
+        help="取得したメッセージをチャンネル・日付ごとのファイルに書き出す（LINEには送信しない）"
+    )
+    parser.add_argument(
+        "--export-format",
+        choices=["auto", "parquet", "npz"],
+        default="auto",
+        help="--export のファイル形式（デフォルト: auto = pyarrow があれば Parquet、なければ npz）"
+    )
+    
+    subparsers = parser.add_subparsers(dest="command")
+    search_parser = subparsers.add_parser(
+        "search",
+        help="アーカイブに保存したメッセージを検索する（Slack には接続しない）"
+    )
+    search_parser.add_argument("query", help="検索する文字列")
+    search_parser.add_argument(
+        "--channel", "-c",
+        dest="search_channel",
+        help="検索するチャンネルを絞り込む"
+    )
+    search_parser.add_argument(
+        "--limit", "-l",
+        dest="search_limit",
+        type=int,
+        default=20,
+        help="表示する最大件数（デフォルト: 20）"
+    )
+    
+    args = parser.parse_args()
+    if args.command == "search":
+        return args
+    try:
+        args.channels = load_channels(args.channel, args.channel_file)
+    except OSError as e:
+        parser.error(f"チャンネル一覧ファイルを読み込めません: {e}")
+    if not args.channels:
+        parser.error("--channel または --channel-file でチャンネルを指定してください")
+    if args.outbox and args.recipients_file:
+        parser.error("--outbox と --recipients-file は同時に指定できません")
+    if args.since_last_run and args.limit is not None:
+        # 新しい順に limit 件で打ち切ると、前回の続きからその間の古いメッセージを取りこぼすため
+        parser.error("--since-last-run と --limit は同時に指定できません")
+    args.recipients = None
+    if args.recipients_file:
+        try:
+            args.recipients = load_recipients(args.recipients_file)
+        except OSError as e:
+            parser.error(f"送信先ファイルを読み込めません: {e}")
+        if not args.recipients:
+            parser.error(f"送信先ファイルに User ID がありません: {args.recipients_file}")
+    return args
+
+
+def load_channels(channels: List[str], channel_file: Optional[str] = None) -> List[str]:
+    """
+    コマンドラインとチャンネル一覧ファイルから、重複を除いたチャンネルのリストを作る。
+
+    Args:
+        channels: --channel で指定されたチャンネル
+        channel_file: チャンネル一覧ファイルのパス（空行は無視）
+
+    Returns:
+        チャンネルのリスト（指定順）
+
+    Raises:
+        OSError: チャンネル一覧ファイルを読み込めない場合
+    """
+    all_channels = list(channels)
+    if channel_file:
+        with open(channel_file, "r", encoding="utf-8") as f:
+            all_channels.extend(line.strip() for line in f)
+    return list(dict.fromkeys(ch for ch in all_channels if ch))
+
+
+def load_recipients(recipients_file: str) -> List[str]:
+    """
+    送信先ファイルから、重複を除いた LINE User ID のリストを作る。
+
+    Args:
+        recipients_file: 送信先ファイルのパス（空行と # で始まる行は無視）
+
+    Returns:
+        User ID のリスト（ファイルの順）
+
+    Raises:
+        OSError: 送信先ファイルを読み込めない場合
+    """
+    with open(recipients_file, "r", encoding="utf-8") as f:
+        user_ids = (line.strip() for line in f)
+        return list(dict.fromkeys(user_id for user_id in user_ids if user_id and not user_id.startswith("#")))
+
+
+def run_search(args: argparse.Namespace) -> None:
+    """アーカイブを検索して結果を表示する"""
+    with MessageArchive() as archive:
+        started = time.perf_counter()
+        results = archive.search(args.query, channel=args.search_channel, limit=args.search_limit)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    if not results:
+        print(f"ℹ️  '{args.query}' を含むメッセージは見つかりませんでした。")
+        return
+    
+    for msg in results:
+        time_str = datetime.fromtimestamp(msg["timestamp"]).strftime("%Y-%m-%d %H:%M")
+        print(f"[{time_str}] {msg['channel']} {msg['user']}: {msg['text']}")
+    print(f"\n🔎 {len(results)}件見つかりました（{elapsed_ms:.1f}ms）")
+
+
+def record_progress(
+    state_store: StateStore,
+    results: Dict[str, List[Dict]],
+    newest_ts: Dict[str, str],
+    channel_ids: Dict[str, str],
+    thread_latest: Dict[Tuple[str, str], str]
+) -> None:
+    """
+    送信（--export の場合は書き出し）できたところまで（チャンネルごとに取得した最新の ts、スレッドごとの最新の返信）を記録する。
+
+    取得位置は、ボットなど除外したメッセージも含めて取得した範囲の最新まで進める
+    （すべて除外されたチャンネルでも、次回同じメッセージを取得し直さない）。
+    取得位置は、取得前にチャンネルIDを調べられた（channel_ids にある）チャンネルだけ記録する。
+    """
+    for channel in results:
+        if channel in newest_ts and channel in channel_ids:
+            state_store.set_watermark(channel_ids[channel], newest_ts[channel])
+    for (channel_id, thread_ts), latest_reply in thread_latest.items():
+        state_store.set_thread_latest(channel_id, thread_ts, latest_reply)
+    if thread_latest:
+        state_store.forget_threads(time.time() - THREAD_WATCH_SECONDS)
 
 
 def main():
     """メイン処理"""
     args = parse_args()
+    outbox = None
+    state_store = None
+    digest_store = None
     
     try:
-        print(f"📥 Slackチャンネル '{args.channel}' からメッセージを取得中...")
+        if args.command == "search":
+            run_search(args)
+            return
+        
+        # 送信待ちの箱を使う場合は、前回送れなかった分の送信を取得と並行して始めておく
+        if args.outbox and not args.dry_run:
+            outbox = LineOutbox()
+            failed_before = outbox.failed_count()
+            outbox.start()
+        
+        channel_names = ", ".join(f"'{ch}'" for ch in args.channels)
+        print(f"📥 Slackチャンネル {channel_names} からメッセージを取得中...")
+        
+        # 前回の取得位置を読み込む
+        channel_ids = {}
+        oldest_by_channel = {}
+        newest_ts: Dict[str, str] = {}
+        thread_latest: Dict[Tuple[str, str], str] = {}
+        errors: Dict[str, str] = {}
+        channels = args.channels
+        if args.since_last_run:
+            state_store = StateStore()
+            # 見つからないチャンネルがあっても、ほかのチャンネルは取得する
+            for channel in args.channels:
+                try:
+                    channel_ids[channel] = resolve_channel_id(channel)
+                except (RuntimeError, SlackApiError, OSError) as e:
+                    errors[channel] = str(e)
+                    continue
+                oldest_by_channel[channel] = state_store.get_watermark(channel_ids[channel])
+            channels = [channel for channel in args.channels if channel in channel_ids]
+            if any(oldest_by_channel.values()):
+                print("🔖 前回の実行以降のメッセージを取得します")
         
-        # Slackからメッセージを取得
-        messages = get_channel_messages(
-            channel=args.channel,
+        # Slackからメッセージを取得（複数チャンネルは並列に取得）
+        results, fetch_errors = fetch_channels_messages(
+            channels,
             hours=args.hours,
-            limit=args.limit
+            limit=args.limit,
+            oldest_by_channel=oldest_by_channel,
+            max_workers=args.workers,
+            newest_ts=newest_ts
         )
+        errors.update(fetch_errors)
+        for channel, error in errors.items():
+            print(f"⚠️  チャンネル '{channel}' の取得に失敗しました: {error}", file=sys.stderr)
+        if not results:
+            raise RuntimeError("どのチャンネルからもメッセージを取得できませんでした。")
+        
+        messages = merge_messages(results.values())
+        
+        # スレッドの返信を並列に取得して加える（--since-last-run のときは前回の記録より新しい返信だけ）
+        if args.threads:
+            messages, thread_errors = expand_thread_replies(
+                messages,
+                state_store=state_store,
+                max_workers=args.workers,
+                channels=results,
+                thread_latest=thread_latest
+            )
+            for thread, error in thread_errors.items():
+                print(f"⚠️  {thread} の返信の取得に失敗しました: {error}", file=sys.stderr)
+        
+        # 取得中に新しく調べたユーザー名を、まとめてキャッシュファイルに書き込む
+        get_user_directory().flush()
+        
+        # ローカルのアーカイブに保存する（同じメッセージは重複しない）
+        if args.archive:
+            with MessageArchive() as archive:
+                saved = archive.add_messages(messages)
+            print(f"🗄️  アーカイブに{saved}件のメッセージを保存しました")
+        
+        # 添付ファイルを並列にダウンロードして保存する（保存済みのファイルは飛ばす）
+        if args.download_files:
+            with FileArchiver(args.download_files, max_workers=args.workers) as file_archiver:
+                file_stats = file_archiver.archive(messages)
+            print(
+                f"📎 添付ファイル: 保存 {file_stats['downloaded']}件 / "
+                f"保存済み {file_stats['skipped']}件 / 失敗 {file_stats['failed']}件"
+            )
         
         if not messages:
             print("ℹ️  メッセージが見つかりませんでした。")
+            # ボットのメッセージなどしかなかった場合も、次回はその続きから取得する
+            if state_store is not None:
+                record_progress(state_store, results, newest_ts, channel_ids, thread_latest)
             return
         
         print(f"✅ {len(messages)}件のメッセージを取得しました")
+        stats = get_user_directory().stats()
+        print(f"👥 ユーザー名キャッシュ: ヒット {stats['hits']}件 / API取得 {stats['misses']}件")
+        
+        # 集計用のファイルに書き出す場合は、ここで終了（書き出せたところまでを記録する）
+        if args.export:
+            paths = export_messages(messages, args.export, fmt=args.export_format)
+            print(f"💾 {len(paths)}個のファイルに書き出しました: {args.export}")
+            if state_store is not None:
+                record_progress(state_store, results, newest_ts, channel_ids, thread_latest)
+            return
+        
+        # 前回と同じメッセージ・同じ設定なら、要約を作り直さず送信もしない
+        cache_key = None
+        if not args.dry_run and not args.force:
+            digest_store = state_store if state_store is not None else StateStore()
+            cache_key = digest_key(messages, {
+                "no_summary": args.no_summary,
+                "summary_mode": args.summary_mode,
+                "stats": args.stats,
+                "topics": args.topics,
+                "recipients": args.recipients,
+                "collapse_duplicates": args.collapse_duplicates,
+            })
+            if digest_store.has_digest(cache_key):
+                print("ℹ️  前回送信した要約と同じ内容のため、送信しませんでした（--force で送信できます）")
+                if state_store is not None:
+                    record_progress(state_store, results, newest_ts, channel_ids, thread_latest)
+                return
+        
+        # ほぼ同じ内容のメッセージをまとめる（送信済みの記録には、まとめる前のメッセージを使う）
+        display_messages = messages
+        if args.collapse_duplicates:
+            display_messages = collapse_near_duplicates(messages)
+            print(f"🧹 似ているメッセージをまとめました: {len(messages)}件 → {len(display_messages)}件")
         
         # メッセージをフォーマット
         if args.no_summary:
             # 要約なしで全て送信
-            formatted_message = create_simple_summary(messages)
+            formatted_message = create_simple_summary(display_messages, total=len(messages))
         else:
-            # 要約して送信
-            formatted_message = summarize_messages(messages)
+            # 要約して送信（件数や集計は、まとめる前の全メッセージで数える）
+            formatted_message = summarize_messages(
+                display_messages,
+                mode=args.summary_mode,
+                stats=args.stats,
+                topics=args.topics,
+                all_messages=messages if args.collapse_duplicates else None
+            )
         
         # ドライラン（テスト実行）の場合は表示のみ
         if args.dry_run:
@@ -100,9 +477,45 @@ def main():
             return
         
         # LINEに送信
-        print("📤 LINEにメッセージを送信中...")
-        send_long_message(formatted_message)
-        print("✅ LINEへの送信が完了しました！")
+        failures = []
+        if args.recipients:
+            print(f"📤 LINEで {len(args.recipients)}人にメッセージを送信中...")
+            failures = multicast_long_message(formatted_message, args.recipients)
+            failed_count = sum(len(user_ids) for user_ids, _ in failures)
+            if failed_count == len(args.recipients):
+                raise RuntimeError(f"全員への送信に失敗しました: {failures[0][1]}")
+            for user_ids, error in failures:
+                print(f"⚠️  {len(user_ids)}人（{user_ids[0]} など）への送信に失敗しました: {error}")
+            print(f"✅ LINEへの送信が完了しました！（{len(args.recipients) - failed_count}人に送信）")
+            if failures:
+                print("ℹ️  送信に失敗した人がいるため、送信済みとして記録しませんでした（次に実行すると、全員にもう一度送信します）")
+        elif outbox is not None:
+            # 箱に入れた時点でファイルに保存されるので、送信済みとして記録してよい
+            count = outbox.enqueue_long_message(formatted_message)
+            print(f"📥 送信待ちの箱に入れました（{count}回分の送信）")
+        else:
+            print("📤 LINEにメッセージを送信中...")
+            send_long_message(formatted_message)
+            print("✅ LINEへの送信が完了しました！")
+        
+        # 送信できたところまでを記録する（一部の人に送れなかった場合は、次の実行で送り直すため記録しない）
+        if not failures:
+            if state_store is not None:
+                record_progress(state_store, results, newest_ts, channel_ids, thread_latest)
+            if digest_store is not None:
+                digest_store.remember_digest(cache_key)
+        
+        # 箱が空になるまで待つ（待ちきれなかった分は、次に --outbox で実行したときに送信する）
+        if outbox is not None:
+            print("📤 LINEにメッセージを送信中...")
+            remaining = outbox.join(DEFAULT_JOIN_TIMEOUT)
+            failed = outbox.failed_count() - failed_before
+            if failed:
+                print(f"⚠️  {failed}回分の送信に失敗しました（詳細は {outbox.path} に記録されています）", file=sys.stderr)
+            if remaining:
+                print(f"⏳ {remaining}回分の送信が残っています（次に --outbox で実行したときに送信します）")
+            elif not failed:
+                print("✅ LINEへの送信が完了しました！")
         
     except RuntimeError as e:
         print(f"❌ エラー: {e}", file=sys.stderr)
@@ -113,6 +526,14 @@ def main():
     except Exception as e:
         print(f"❌ 予期しないエラーが発生しました: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        # 途中で終わった場合も、箱に入っている分はファイルに残り、次回送信される
+        if outbox is not None:
+            outbox.close()
+        if digest_store is not None and digest_store is not state_store:
+            digest_store.close()
+        if state_store is not None:
+            state_store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+取得したSlackメッセージをローカルの SQLite に保存して、全文検索できるようにするモジュール
+
+日本語は単語の区切りがないため、FTS5 の trigram トークナイザ（3文字ずつ区切る方式）で索引を作る。
+"""
+
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+
+from slack_cache import CACHE_DIR
+
+
+# アーカイブのデータベースファイル
+DEFAULT_ARCHIVE_PATH = os.path.join(CACHE_DIR, "archive.db")
+
+# trigram トークナイザで検索できる最短の文字数（これより短い語は LIKE で検索する）
+MIN_FTS_QUERY_LENGTH = 3
+
+
+class MessageArchive:
+    """
+    Slackメッセージのローカルアーカイブ。
+
+    (チャンネルID, ts) が同じメッセージは1件として保存されるので、同じ期間を何度取得して保存しても、
+    チャンネルを名前で指定してもIDで指定しても重複しない。
+    表示用に、取得したときに指定されたチャンネル名も保存する。
+    """
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH):
+        """
+        Args:
+            path: データベースファイルのパス（":memory:" も指定可能）
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        legacy = self._is_legacy()
+        if legacy:
+            self.conn.execute("ALTER TABLE messages RENAME TO messages_legacy")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " channel_id TEXT NOT NULL,"
+            " channel TEXT NOT NULL,"
+            " ts TEXT NOT NULL,"
+            " timestamp REAL NOT NULL,"
+            " user TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " UNIQUE (channel_id, ts)"
+            ")"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp)"
+        )
+        # チャンネル名 → チャンネルID（名前で指定して保存したときに覚え、名前での絞り込みに使う）
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS channels ("
+            " name TEXT PRIMARY KEY,"
+            " channel_id TEXT NOT NULL"
+            ")"
+        )
+        if legacy:
+            self._migrate_legacy()
+        self.has_fts = self._create_fts(rebuild=legacy)
+        self._backfill_channel_ids()
+        self.conn.commit()
+
+    def _is_legacy(self) -> bool:
+        """チャンネルIDの列がない、以前の形式のアーカイブか"""
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(messages)")]
+        return bool(columns) and "channel_id" not in columns
+
+    def _migrate_legacy(self) -> None:
+        """
+        以前の形式（指定されたチャンネル名で保存していた）のメッセージを新しい形式に移す。
+
+        以前の形式にはチャンネルIDがないので、指定された名前（# を除く）をIDの代わりに使う
+        （その名前のチャンネルIDが分かったときに、_backfill_channel_ids() で付け替える）。
+        """
+        self.conn.executescript(
+            """
+            DROP TRIGGER IF EXISTS messages_ai;
+            DROP TRIGGER IF EXISTS messages_ad;
+            DROP TRIGGER IF EXISTS messages_au;
+            DROP TABLE IF EXISTS messages_fts;
+            INSERT OR IGNORE INTO messages (channel_id, channel, ts, timestamp, user, text)
+                SELECT ltrim(channel, '#'), channel, ts, timestamp, user, text FROM messages_legacy;
+            DROP TABLE messages_legacy;
+            """
+        )
+
+    def _backfill_channel_ids(self) -> None:
+        """
+        名前をIDの代わりにして保存したメッセージ（以前の形式から移したもの）を、
+        channels テーブルで分かったチャンネルIDに付け替える。
+
+        同じメッセージがすでにチャンネルIDで保存されている場合は、名前で保存した方を消す。
+        """
+        self.conn.execute(
+            "UPDATE OR IGNORE messages"
+            " SET channel_id = (SELECT c.channel_id FROM channels c WHERE c.name = messages.channel_id)"
+            " WHERE channel_id IN (SELECT name FROM channels)"
+        )
+        self.conn.execute("DELETE FROM messages WHERE channel_id IN (SELECT name FROM channels)")
+
+    def _create_fts(self, rebuild: bool = False) -> bool:
+        """
+        全文検索用の索引を作る。
+
+        Args:
+            rebuild: True の場合は、保存済みのメッセージから索引を作り直す（以前の形式から移した場合）
+
+        Returns:
+            作れた場合は True（古い SQLite で trigram が使えない場合は False になり、LIKE で検索する）
+        """
+        try:
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                " text, user, content='messages', content_rowid='rowid', tokenize='trigram'"
+                ")"
+            )
+        except sqlite3.OperationalError:
+            return False
+
+        if rebuild:
+            self.conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+        # messages テーブルの変更を索引に反映する
+        self.conn.executescript(
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, text, user) VALUES (new.rowid, new.text, new.user);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text, user)
+                VALUES ('delete', old.rowid, old.text, old.user);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text, user)
+                VALUES ('delete', old.rowid, old.text, old.user);
+                INSERT INTO messages_fts (rowid, text, user) VALUES (new.rowid, new.text, new.user);
+            END;
+            """
+        )
+        return True
+
+    def add_messages(self, messages: Iterable[Dict]) -> int:
+        """
+        メッセージを保存する。保存済みのメッセージは、本文などが変わっていれば更新する。
+
+        Args:
+            messages: get_channel_messages() で取得したメッセージ
+                （channel_id がない場合は、channel の # を除いたものをIDとして使う）
+
+        Returns:
+            新しく保存・更新したメッセージの件数
+        """
+        rows = []
+        names: Dict[str, str] = {}
+        for msg in messages:
+            name = msg["channel"].lstrip("#")
+            channel_id = msg.get("channel_id") or name
+            if name != channel_id:
+                names[name] = channel_id
+            rows.append((channel_id, msg["channel"], msg["ts"], msg["timestamp"], msg["user"], msg["text"]))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO channels (name, channel_id) VALUES (?, ?)", names.items()
+            )
+            if names:
+                self._backfill_channel_ids()
+            cursor = self.conn.executemany(
+                "INSERT INTO messages (channel_id, channel, ts, timestamp, user, text)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (channel_id, ts) DO UPDATE SET user = excluded.user, text = excluded.text"
+                " WHERE user != excluded.user OR text != excluded.text",
+                rows
+            )
+        return cursor.rowcount
+
+    def search(
+        self,
+        query: str,
+        channel: Optional[str] = None,
+        limit: int = 20
+    ) -> List[Dict]:
+        """
+        本文または投稿者名に query を含むメッセージを検索する。
+
+        Args:
+            query: 検索する文字列
+            channel: チャンネルを絞り込む場合に、チャンネル名（#general）またはチャンネルIDを指定
+                （名前とIDのどちらで指定して保存したメッセージも見つかる）
+            limit: 返す最大件数（デフォルト: 20）
+
+        Returns:
+            見つかったメッセージのリスト（新しい順）。キーは get_channel_messages() と同じ
+        """
+        params: List = []
+        if self.has_fts and len(query) >= MIN_FTS_QUERY_LENGTH:
+            # 記号などが検索構文として解釈されないよう、全体をフレーズとして渡す
+            sql = (
+                "SELECT m.channel, m.ts, m.timestamp, m.user, m.text"
+                " FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid"
+                " WHERE messages_fts MATCH ?"
+            )
+            params.append('"' + query.replace('"', '""') + '"')
+        else:
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            sql = (
+                "SELECT m.channel, m.ts, m.timestamp, m.user, m.text FROM messages m"
+                " WHERE (m.text LIKE ? ESCAPE '\\' OR m.user LIKE ? ESCAPE '\\')"
+            )
+            params.extend([f"%{escaped}%", f"%{escaped}%"])
+
+        if channel is not None:
+            channel = channel.lstrip("#")
+            row = self.conn.execute(
+                "SELECT channel_id FROM channels WHERE name = ?", (channel,)
+            ).fetchone()
+            sql += " AND m.channel_id = ?"
+            params.append(row[0] if row else channel)
+        sql += " ORDER BY m.timestamp DESC LIMIT ?"
+        params.append(limit)
+
+        return [
+            {"channel": row[0], "ts": row[1], "timestamp": row[2], "user": row[3], "text": row[4]}
+            for row in self.conn.execute(sql, params)
+        ]
+
+    def count(self) -> int:
+        """保存されているメッセージの件数を返す"""
+        return self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self) -> None:
+        """データベースを閉じる"""
+        self.conn.close()
+
+    def __enter__(self) -> "MessageArchive":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
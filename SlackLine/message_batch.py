@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大量のメッセージを少ないメモリで保持するためのモジュール
+
+メッセージごとに辞書を作る代わりに、列ごと（タイムスタンプ・ユーザー・本文…）にまとめて保持する。
+- タイムスタンプ: float の配列（array('d')）。numpy があれば numpy 配列としてそのまま扱える
+- ユーザー名・チャンネル名: 同じ名前は1回だけ保存し、各メッセージは番号で参照する
+- 本文: 1つの文字列につなげて、各メッセージは開始位置で参照する
+"""
+
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from numpy_utils import import_numpy
+
+
+# 1件のメッセージを表す行（タイムスタンプ, ユーザー名, チャンネル名, 本文）
+Row = Tuple[float, str, str, str]
+
+# スレッド関連や添付ファイルなど、一部のメッセージにだけ付くキー
+EXTRA_KEYS = ("reply_count", "latest_reply", "parent_ts", "files")
+
+
+class MessageBatch:
+    """
+    メッセージの列指向コンテナ。
+
+    get_channel_messages() が返す辞書のリストと同じように、len()・添字・for 文で扱える
+    （そのときは辞書が返る）。要約などの処理は row() / rows() や各列を直接使うと速い。
+    """
+
+    __slots__ = (
+        "timestamps", "user_codes", "users", "channel_codes", "channels",
+        "text_offsets", "extras", "_user_index", "_channel_index", "_text", "_pending"
+    )
+
+    def __init__(self):
+        self.timestamps = array("d")
+        self.user_codes = array("i")
+        self.users: List[str] = []
+        self.channel_codes = array("i")
+        self.channels: List[str] = []
+        self.text_offsets = array("q", [0])
+        self.extras: Dict[int, Dict] = {}
+        self._user_index: Dict[str, int] = {}
+        self._channel_index: Dict[str, int] = {}
+        self._text = ""
+        self._pending: List[str] = []
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Dict]) -> "MessageBatch":
+        """
+        メッセージの辞書（リストやジェネレータ）から MessageBatch を作る。
+
+        Args:
+            messages: get_channel_messages() / iter_channel_messages() のメッセージ
+
+        Returns:
+            MessageBatch
+        """
+        batch = cls()
+        for msg in messages:
+            batch.append(msg)
+        return batch
+
+    def append(self, msg: Dict) -> None:
+        """
+        メッセージを1件追加する。
+
+        Args:
+            msg: get_channel_messages() と同じ形式のメッセージ
+        """
+        index = len(self.timestamps)
+        self.timestamps.append(msg["timestamp"])
+        self.user_codes.append(self._intern(self._user_index, self.users, msg["user"]))
+        self.channel_codes.append(
+            self._intern(self._channel_index, self.channels, msg.get("channel", ""))
+        )
+
+        text = msg["text"]
+        self._pending.append(text)
+        self.text_offsets.append(self.text_offsets[-1] + len(text))
+
+        extra = {key: msg[key] for key in EXTRA_KEYS if msg.get(key) is not None}
+        if extra:
+            self.extras[index] = extra
+
+    def extend_columns(
+        self,
+        channel: str,
+        timestamps: Sequence[float],
+        users: Sequence[str],
+        user_codes: Sequence[int],
+        text: str,
+        text_offsets: Sequence[int]
+    ) -> None:
+        """
+        1チャンネル分の列をまとめて末尾に追加する（エクスポートしたファイルの読み込みなどに使う）。
+
+        Args:
+            channel: チャンネル名
+            timestamps: タイムスタンプの列
+            users: ユーザー名の一覧（user_codes が指す先）
+            user_codes: 各メッセージのユーザー番号の列
+            text: 本文をつなげた文字列
+            text_offsets: 各本文の開始位置（先頭の 0 と末尾の位置を含み、件数 + 1 個）
+        """
+        code_map = [self._intern(self._user_index, self.users, user) for user in users]
+        channel_code = self._intern(self._channel_index, self.channels, channel)
+        base = self.text_offsets[-1]
+
+        self.timestamps.extend(timestamps)
+        self.user_codes.extend(code_map[code] for code in user_codes)
+        self.channel_codes.extend(array("i", [channel_code]) * len(timestamps))
+        self.text_offsets.extend(base + offset for offset in text_offsets[1:])
+        self._pending.append(text)
+
+    @staticmethod
+    def _intern(index: Dict[str, int], values: List[str], value: str) -> int:
+        code = index.get(value)
+        if code is None:
+            code = len(values)
+            index[value] = code
+            values.append(value)
+        return code
+
+    def _buffer(self) -> str:
+        """本文をつなげた文字列（追加された分があればここでまとめてつなげる）"""
+        if self._pending:
+            self._text = self._text + "".join(self._pending)
+            self._pending = []
+        return self._text
+
+    def text(self, index: int) -> str:
+        """index 番目のメッセージの本文を返す"""
+        return self._buffer()[self.text_offsets[index]:self.text_offsets[index + 1]]
+
+    def row(self, index: int) -> Row:
+        """
+        index 番目のメッセージを (タイムスタンプ, ユーザー名, チャンネル名, 本文) で返す。
+        """
+        if index < 0:
+            index += len(self)
+        return (
+            self.timestamps[index],
+            self.users[self.user_codes[index]],
+            self.channels[self.channel_codes[index]],
+            self.text(index),
+        )
+
+    def rows(self) -> Iterator[Row]:
+        """全メッセージを (タイムスタンプ, ユーザー名, チャンネル名, 本文) で順に返す"""
+        buffer = self._buffer()
+        offsets = self.text_offsets
+        users = self.users
+        channels = self.channels
+        for i, timestamp in enumerate(self.timestamps):
+            yield (
+                timestamp,
+                users[self.user_codes[i]],
+                channels[self.channel_codes[i]],
+                buffer[offsets[i]:offsets[i + 1]],
+            )
+
+    def message(self, index: int) -> Dict:
+        """index 番目のメッセージを get_channel_messages() と同じ形式の辞書で返す"""
+        if index < 0:
+            index += len(self)
+        timestamp, user, channel, text = self.row(index)
+        msg = {
+            "text": text,
+            "user": user,
+            "timestamp": timestamp,
+            "ts": f"{timestamp:.6f}",
+            "channel": channel,
+        }
+        msg.update(self.extras.get(index, {}))
+        return msg
+
+    def sorted_by_time(self, newest_first: bool = True) -> "MessageBatch":
+        """
+        タイムスタンプの順に並べ替えた新しい MessageBatch を返す（同じ時刻のメッセージは元の順）。
+
+        Args:
+            newest_first: True の場合は新しい順、False の場合は古い順
+
+        Returns:
+            MessageBatch
+        """
+        timestamps = self.timestamps
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__, reverse=newest_first)
+        buffer = self._buffer()
+        offsets = self.text_offsets
+        texts = [buffer[offsets[i]:offsets[i + 1]] for i in order]
+
+        batch = MessageBatch()
+        batch.timestamps = array("d", (timestamps[i] for i in order))
+        batch.user_codes = array("i", (self.user_codes[i] for i in order))
+        batch.channel_codes = array("i", (self.channel_codes[i] for i in order))
+        batch.users = list(self.users)
+        batch.channels = list(self.channels)
+        batch._user_index = dict(self._user_index)
+        batch._channel_index = dict(self._channel_index)
+        batch._text = "".join(texts)
+        batch.text_offsets = array("q", accumulate((len(text) for text in texts), initial=0))
+        batch.extras = {new: self.extras[old] for new, old in enumerate(order) if old in self.extras}
+        return batch
+
+    def timestamp_array(self):
+        """
+        タイムスタンプを numpy 配列で返す（コピーせずに同じメモリを参照する）。
+
+        Returns:
+            numpy.ndarray（float64）
+
+        Raises:
+            RuntimeError: numpy がインストールされていない場合
+        """
+        np = import_numpy("列を numpy 配列で取り出す")
+        return np.frombuffer(self.timestamps, dtype=np.float64)
+
+    def user_code_array(self):
+        """
+        各メッセージのユーザー番号（users の添字）を numpy 配列で返す（コピーせずに同じメモリを参照する）。
+
+        Returns:
+            numpy.ndarray（int32）
+
+        Raises:
+            RuntimeError: numpy がインストールされていない場合
+        """
+        np = import_numpy("列を numpy 配列で取り出す")
+        return np.frombuffer(self.user_codes, dtype=np.int32)
+
+    def user_count(self) -> int:
+        """参加者数（重複を除いたユーザー数）を返す"""
+        return len(self.users)
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """(最も古いタイムスタンプ, 最も新しいタイムスタンプ) を返す（空の場合は None）"""
+        if not self.timestamps:
+            return None
+        return min(self.timestamps), max(self.timestamps)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict, List[Dict]]:
+        if isinstance(index, slice):
+            return [self.message(i) for i in range(*index.indices(len(self)))]
+        if not -len(self) <= index < len(self):
+            raise IndexError("MessageBatch index out of range")
+        return self.message(index)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self.message(i)
+
+
+def iter_rows(messages: Union[MessageBatch, Iterable[Dict]]) -> Iterator[Row]:
+    """
+    メッセージの辞書のリストでも MessageBatch でも、(タイムスタンプ, ユーザー名, チャンネル名, 本文) で順に返す。
+
+    Args:
+        messages: メッセージのリストまたは MessageBatch
+
+    Returns:
+        行のイテレータ
+    """
+    if isinstance(messages, MessageBatch):
+        return messages.rows()
+    return ((msg["timestamp"], msg["user"], msg.get("channel", ""), msg["text"]) for msg in messages)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+numpy を使うモジュール（text_rank・dedup・activity など）が共通で使う処理
+
+numpy は必須ではないので、ここでもモジュールの先頭では読み込まず、使うときに読み込む。
+文字 n-gram のハッシュ（TF-IDF の採点と類似メッセージの判定の両方で使う）もここにまとめる。
+"""
+
+from typing import Sequence
+
+
+# ハッシュ用の乗数（32ビットの奇数）。n-gram を1文字ずつ伸ばすときと、最後に混ぜるときに使う
+HASH_MULTIPLIER = 0x9E3779B1
+MIX_MULTIPLIER = 0x85EBCA77
+
+
+def import_numpy(purpose: str):
+    """
+    numpy を読み込む。
+
+    Args:
+        purpose: エラーメッセージに出す用途（「TF-IDF による要約」など）
+
+    Returns:
+        numpy モジュール
+
+    Raises:
+        RuntimeError: numpy がインストールされていない場合
+    """
+    try:
+        import numpy as np
+    except ImportError as e:
+        raise RuntimeError(
+            f"{purpose}には numpy が必要です。\n"
+            "pip install numpy を実行してください。"
+        ) from e
+    return np
+
+
+def has_numpy() -> bool:
+    """numpy がインストールされていれば True を返す"""
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def code_points(texts: Sequence[str], fold_digits: bool = False):
+    """
+    全テキストを区切り文字（\0）でつなげ、Unicode のコードポイントの配列にする（最後にも区切り文字を付ける）。
+
+    英字は小文字にそろえる。
+
+    Args:
+        texts: テキストのリスト
+        fold_digits: True の場合、数字を全て 0 にそろえる（build #123 と build #124 を同じものとして扱う）
+
+    Returns:
+        numpy.ndarray（uint32、書き換え可能）
+    """
+    import numpy as np
+
+    codes = np.frombuffer(("\0".join(texts) + "\0").encode("utf-32-le"), dtype=np.uint32).copy()
+    # 一時配列を増やさないよう、その場で書き換える
+    if fold_digits:
+        np.copyto(codes, np.uint32(0x30), where=(codes - np.uint32(0x30)) < np.uint32(10))
+    np.bitwise_or(codes, np.uint32(0x20), out=codes, where=(codes - np.uint32(0x41)) < np.uint32(26))
+    return codes
+
+
+def ngram_hashes(codes, usable, sizes: Sequence[int]):
+    """
+    各位置から始まる文字 n-gram のハッシュ値（32 ビット）を、n-gram の長さごとに返す。
+
+    n-gram は1文字ずつ伸ばしながら作るので、(2, 3) のように複数の長さを指定してもまとめて計算できる。
+
+    Args:
+        codes: code_points() で作ったコードポイントの配列
+        usable: 各位置の文字を n-gram に含めてよいかどうか（bool の配列。区切り文字は False にする）
+        sizes: n-gram の長さ（2 以上）
+
+    Yields:
+        (n-gram の長さ, ハッシュ値の配列（uint32）, n-gram の全ての文字が usable かどうかの配列)。
+        配列の長さは len(codes) - n-gram の長さ + 1
+    """
+    import numpy as np
+
+    multiplier = np.uint32(HASH_MULTIPLIER)
+    key = codes
+    valid = usable
+    for size in range(2, max(sizes) + 1):
+        span = len(codes) - size + 1
+        if span <= 0:
+            return
+        key = key[:span] * multiplier
+        key += codes[size - 1:]
+        valid = valid[:span] & usable[size - 1:]
+        if size in sizes:
+            yield size, key, valid
+
+
+def mix_hashes(keys, salt: int, bits: int):
+    """
+    ngram_hashes() のハッシュ値をよく混ぜて、上位 bits ビットを取り出す。
+
+    Args:
+        keys: ハッシュ値の配列（uint32）
+        salt: 混ぜる前に xor する値（長さの違う n-gram が同じ値にならないようにする）
+        bits: 取り出すビット数（32 以下）
+
+    Returns:
+        numpy.ndarray（uint32、0 〜 2^bits - 1）
+    """
+    import numpy as np
+
+    hashed = keys ^ np.uint32(salt)
+    hashed *= np.uint32(MIX_MULTIPLIER)
+    hashed >>= np.uint32(32 - bits)
+    return hashed
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+よく出た話題（単語）とよく投稿した人の上位を、一定のメモリで数えるモジュール
+
+1週間分・1か月分のメッセージで全ての単語を数えると、単語の種類の数だけメモリを使ってしまう。
+ここでは Space-Saving というアルゴリズムで、決まった数（capacity）のカウンタだけを持ちながら
+上位の単語・ユーザーを求める。何百万件を流しても使うメモリは変わらず、
+本当に多く出たもの（全体の 1/capacity より多く出たもの）は必ず上位に残る。
+件数は多めに見積もられることがあり、その最大の誤差も一緒に記録する。
+numpy は不要。
+"""
+
+import re
+from collections import Counter
+from itertools import islice
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple, Union
+
+from message_batch import MessageBatch, Row, iter_rows
+
+
+# 話題（単語）を数えるカウンタの数（多いほど正確になるが、メモリを使う）
+DEFAULT_TERM_CAPACITY = 1000
+
+# ユーザーを数えるカウンタの数
+DEFAULT_USER_CAPACITY = 200
+
+# 要約に載せる上位の数
+DEFAULT_TOP_N = 5
+
+# まとめて数えるときに、1回に集計するメッセージの数
+# （この件数ごとに単語を Counter で数えてから、種類ごとに1回だけカウンタに加える）
+BATCH_SIZE = 1024
+
+# 単語として数えるもの: カタカナ2文字以上・漢字2文字以上・英字で始まる3文字以上の英数字（小文字にそろえてから探す）
+_TERM_PATTERN = re.compile(r"[ァ-ヴー]{2,}|[一-龯々]{2,}|[a-z][a-z0-9_\-]{2,}")
+
+# Slack の書式（<@U123>・<https://...|リンク>・:emoji:）は単語として数えない
+_MARKUP_PATTERN = re.compile(r"<[^>]*>|:[a-z0-9_+\-]+:")
+
+# 数えない英単語
+_STOP_WORDS = frozenset({
+    "the", "and", "for", "you", "this", "that", "with", "are", "was", "have", "not", "but",
+})
+
+
+def _strip_markup(text: str) -> str:
+    # Slack の書式が含まれないことが多いので、含まれる場合だけ取り除く
+    if "<" in text or ":" in text:
+        return _MARKUP_PATTERN.sub(" ", text)
+    return text
+
+
+def count_terms(texts: Iterable[str]) -> Counter:
+    """
+    複数の本文の単語をまとめて数える（extract_terms() を1件ずつ呼ぶより速い）。
+
+    Args:
+        texts: メッセージ本文の集まり
+
+    Returns:
+        単語 → 出た回数 の Counter
+    """
+    # 改行をまたぐ単語はないので、つなげて1回で探す
+    text = "\n".join(map(_strip_markup, texts))
+    counts = Counter(_TERM_PATTERN.findall(text.lower()))
+    for word in _STOP_WORDS:
+        counts.pop(word, None)
+    return counts
+
+
+def extract_terms(text: str) -> List[str]:
+    """
+    本文から数える単語を取り出す。
+
+    日本語は単語の区切りがないため、カタカナ・漢字のひと続きをそれぞれ1語とみなす
+    （「本番環境でデプロイ」→「本番環境」「デプロイ」）。英単語は小文字にそろえる。
+
+    Args:
+        text: メッセージ本文
+
+    Returns:
+        単語のリスト（同じ単語が複数回出れば、その回数だけ含む）
+    """
+    # 英字だけが小文字になる（日本語はそのまま）
+    return [term for term in _TERM_PATTERN.findall(_strip_markup(text).lower()) if term not in _STOP_WORDS]
+
+
+class SpaceSaving:
+    """
+    Space-Saving アルゴリズムで、よく出る値の上位を一定のメモリで数える。
+
+    カウンタが capacity 個埋まった後に新しい値が来たら、いちばん件数の少ない値を追い出し、
+    その件数 + 1 から数え始める（追い出した値の件数が、新しい値の件数の最大の誤差になる）。
+    件数ごとに値をまとめて持つので、1回の追加は値の数によらず一定の時間で終わる。
+
+    使い方:
+        counter = SpaceSaving(100)
+        for word in words:
+            counter.add(word)
+        print(counter.top(5))
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Args:
+            capacity: カウンタの数（数える値の種類の上限）
+
+        Raises:
+            ValueError: capacity が 1 未満の場合
+        """
+        if capacity < 1:
+            raise ValueError("capacity は 1 以上にしてください。")
+        self.capacity = capacity
+        self.total = 0
+        self._counts: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        # 件数 → その件数の値（順番を保つため dict を集合の代わりに使う）
+        self._buckets: Dict[int, Dict[str, None]] = {}
+        self._min_count = 0
+
+    def _remove(self, item: str, count: int) -> None:
+        bucket = self._buckets[count]
+        del bucket[item]
+        if not bucket:
+            del self._buckets[count]
+
+    def add(self, item: str, count: int = 1) -> None:
+        """値を count 回出たものとして数える"""
+        self.total += count
+        current = self._counts.get(item)
+        if current is not None:
+            self._remove(item, current)
+        elif len(self._counts) < self.capacity:
+            current = 0
+            self._errors[item] = 0
+        else:
+            # いちばん件数の少ない値を追い出し、その件数を引き継ぐ
+            victim, _ = self._buckets[self._min_count].popitem()
+            if not self._buckets[self._min_count]:
+                del self._buckets[self._min_count]
+            del self._counts[victim]
+            del self._errors[victim]
+            current = self._min_count
+            self._errors[item] = current
+
+        new_count = current + count
+        self._counts[item] = new_count
+        self._buckets.setdefault(new_count, {})[item] = None
+
+        # いちばん少ない件数を更新する（1ずつ増やす場合は、空いた件数の次が最小になる）
+        if current == 0 and (self._min_count == 0 or new_count < self._min_count):
+            self._min_count = new_count
+        elif self._min_count not in self._buckets:
+            self._min_count = new_count if count == 1 else min(self._buckets)
+
+    def update(self, items: Iterable[str]) -> None:
+        """複数の値を1回ずつ数える"""
+        counts = self._counts
+        buckets = self._buckets
+        for item in items:
+            current = counts.get(item)
+            # よくある「数えている値が1回増える」場合は、ここで直接処理する
+            if current is not None and current != self._min_count:
+                bucket = buckets[current]
+                del bucket[item]
+                if not bucket:
+                    del buckets[current]
+                counts[item] = current + 1
+                buckets.setdefault(current + 1, {})[item] = None
+                self.total += 1
+            else:
+                self.add(item)
+
+    def update_counts(self, counts: Mapping[str, int]) -> None:
+        """
+        値ごとにまとめて数えた件数を加える（Counter で集計してから渡すと、1回ずつ数えるより速い）。
+
+        件数の多いものから加えるので、少ないものどうしが追い出し合い、多いものは残りやすい。
+        """
+        for item, count in sorted(counts.items(), key=lambda item: -item[1]):
+            self.add(item, count)
+
+    def count(self, item: str) -> int:
+        """値の推定件数（実際の件数以上。数えていない値は 0）"""
+        return self._counts.get(item, 0)
+
+    def error(self, item: str) -> int:
+        """推定件数の最大の誤差（実際の件数は count - error 以上）"""
+        return self._errors.get(item, 0)
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        """
+        推定件数の多い順に n 個返す。
+
+        Returns:
+            [(値, 推定件数), ...]（件数が同じなら先に数え始めた順）
+        """
+        return sorted(self._counts.items(), key=lambda item: -item[1])[:n]
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+
+class HeavyHitters:
+    """
+    メッセージを1件ずつ受け取りながら、よく出た話題とよく投稿した人の上位を数える。
+
+    StreamingSummarizer に渡すと、要約を作るのと同じ1回の読み込みで数えられる。
+
+    使い方:
+        heavy_hitters = HeavyHitters()
+        heavy_hitters.extend(iter_channel_messages("#general", hours=720))
+        print("\\n".join(heavy_hitters.format_lines()))
+    """
+
+    def __init__(
+        self,
+        term_capacity: int = DEFAULT_TERM_CAPACITY,
+        user_capacity: int = DEFAULT_USER_CAPACITY,
+        track_users: bool = True
+    ):
+        """
+        Args:
+            term_capacity: 話題（単語）を数えるカウンタの数
+            user_capacity: ユーザーを数えるカウンタの数
+            track_users: False の場合は話題だけを数える（よく投稿した人を別の方法で集計する場合など）
+        """
+        self.terms = SpaceSaving(term_capacity)
+        self.users = SpaceSaving(user_capacity) if track_users else None
+
+    def add_row(self, timestamp: float, user: str, channel: str, text: str) -> None:
+        """メッセージを1件 (タイムスタンプ, ユーザー名, チャンネル名, 本文) で加える"""
+        if self.users is not None:
+            self.users.add(user)
+        self.terms.update(extract_terms(text))
+
+    def add_rows(self, rows: Sequence[Row]) -> None:
+        """
+        行のリストをまとめて加える（1件ずつ add_row() するより速い）。
+
+        単語・ユーザーを Counter で数えてから、種類ごとに1回だけカウンタに加える。
+        """
+        if self.users is not None:
+            self.users.update_counts(Counter(row[1] for row in rows))
+        self.terms.update_counts(count_terms(row[3] for row in rows))
+
+    def extend(self, messages: Union[Iterable[Dict], MessageBatch]) -> None:
+        """メッセージのリスト・ジェネレータ・MessageBatch を BATCH_SIZE 件ずつまとめて加える"""
+        rows = iter_rows(messages)
+        while True:
+            chunk = list(islice(rows, BATCH_SIZE))
+            if not chunk:
+                return
+            self.add_rows(chunk)
+
+    @staticmethod
+    def _format_ranking(counter: SpaceSaving, n: int, unit: str) -> str:
+        entries = []
+        for item, count in counter.top(n):
+            # 誤差がある（追い出された値の件数を引き継いだ）ものは「約」を付ける
+            approx = "約" if counter.error(item) else ""
+            entries.append(f"{item} {approx}{count}{unit}")
+        return " / ".join(entries)
+
+    def format_lines(self, top_n: int = DEFAULT_TOP_N) -> List[str]:
+        """
+        要約の見出しに載せる行を作る。
+
+        Args:
+            top_n: 上位いくつまで載せるか（デフォルト: 5）
+
+        Returns:
+            行のリスト
+        """
+        lines = []
+        if len(self.terms):
+            lines.append(f"🔥 よく出た話題: {self._format_ranking(self.terms, top_n, '回')}")
+        if self.users is not None and len(self.users):
+            lines.append(f"🗣 よく投稿した人: {self._format_ranking(self.users, top_n, '件')}")
+        return lines
+
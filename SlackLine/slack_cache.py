@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Slack のユーザー情報やチャンネル一覧をローカルにキャッシュするモジュール
+
+API を毎回呼び出さずに済むように、一覧をまとめて取得してメモリとディスクに保存する。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from slack_rate_limit import get_rate_limiter
+
+
+# キャッシュファイルを保存するディレクトリ
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# ユーザー一覧キャッシュの有効期間（秒）
+DEFAULT_USER_TTL = 24 * 60 * 60
+
+# チャンネル一覧キャッシュの有効期間（秒）
+DEFAULT_CHANNEL_TTL = 6 * 60 * 60
+
+# users.list の1ページあたりの取得件数
+USERS_PAGE_SIZE = 200
+
+# conversations.list の1ページあたりの取得件数
+CHANNELS_PAGE_SIZE = 200
+
+
+def token_key(token: str) -> str:
+    """
+    トークンからキャッシュファイル名に使うキーを作る（トークン自体はファイル名に出さない）。
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+
+
+def load_json_cache(path: str, ttl: float) -> Optional[Dict]:
+    """
+    JSON キャッシュを読み込む。
+
+    Args:
+        path: キャッシュファイルのパス
+        ttl: 有効期間（秒）
+
+    Returns:
+        キャッシュの中身。存在しない・期限切れ・壊れている場合は None
+    """
+    loaded = _read_json_cache(path, ttl)
+    return loaded[1] if loaded is not None else None
+
+
+def _read_json_cache(path: str, ttl: float) -> Optional[Tuple[float, Dict]]:
+    """load_json_cache() と同じだが、(保存した時刻, 中身) を返す"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    saved_at = cache.get("saved_at", 0)
+    if time.time() - saved_at > ttl:
+        return None
+    return saved_at, cache.get("data")
+
+
+def save_json_cache(path: str, data: Dict, saved_at: Optional[float] = None) -> None:
+    """
+    JSON キャッシュを保存する。書き込み途中で止まっても壊れないよう、一時ファイル経由で置き換える。
+
+    Args:
+        path: キャッシュファイルのパス
+        data: 保存する内容
+        saved_at: 有効期間の起点にする時刻（未指定の場合は現在時刻。追記だけの場合は元の時刻を渡す）
+    """
+    if saved_at is None:
+        saved_at = time.time()
+    tmp_path = path + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"saved_at": saved_at, "data": data}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        # キャッシュが保存できなくても処理は続ける
+        pass
+
+
+def _display_name(user: Dict) -> str:
+    """users.list / users.info のユーザー情報から表示名を取り出す"""
+    profile = user.get("profile") or {}
+    return (
+        user.get("real_name")
+        or profile.get("real_name")
+        or user.get("name")
+        or user.get("id", "不明")
+    )
+
+
+class UserDirectory:
+    """
+    Slack のユーザーID → 表示名 の対応表。
+
+    users.list をページ送りしながらまとめて取得し、メモリとディスクに保持する。
+    名前解決（resolve）は通常 API を呼ばずに済み、キャッシュにないユーザーだけ users.info で取得する。
+    users.info で取得した名前はメモリに追加するだけで、ディスクには flush() でまとめて書き込む
+    （有効期間は users.list で一覧を取得した時刻から数えるので、追加しても期限は延びない）。
+    複数のスレッドから同時に使ってもよい。
+    """
+
+    def __init__(
+        self,
+        client: WebClient,
+        cache_path: Optional[str] = None,
+        ttl: float = DEFAULT_USER_TTL
+    ):
+        """
+        Args:
+            client: Slack の WebClient
+            cache_path: キャッシュファイルのパス（未指定の場合はトークンごとに自動で決定）
+            ttl: ディスクキャッシュの有効期間（秒）
+        """
+        self.client = client
+        if cache_path is None:
+            cache_path = os.path.join(CACHE_DIR, f"users_{token_key(client.token or '')}.json")
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._names: Dict[str, str] = {}
+        self._unknown: Set[str] = set()
+        self._saved_at: Optional[float] = None
+        self._dirty = False
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def prefetch(self, force: bool = False) -> None:
+        """
+        ユーザー一覧を読み込む。有効なディスクキャッシュがあればそれを使い、なければ users.list で取得する。
+
+        Args:
+            force: True の場合はキャッシュを無視して取得し直す
+        """
+        with self._lock:
+            self._prefetch(force)
+
+    def _prefetch(self, force: bool) -> None:
+        self._loaded = True
+
+        if not force:
+            cached = _read_json_cache(self.cache_path, self.ttl)
+            if cached is not None:
+                self._saved_at, names = cached
+                self._names.update(names)
+                return
+
+        names: Dict[str, str] = {}
+        cursor = None
+        try:
+            while True:
+                response = get_rate_limiter().call(
+                    "users.list", self.client.users_list, limit=USERS_PAGE_SIZE, cursor=cursor
+                )
+                for user in response["members"]:
+                    names[user["id"]] = _display_name(user)
+                cursor = (response.get("response_metadata") or {}).get("next_cursor")
+                if not cursor:
+                    break
+        except SlackApiError:
+            # users:read スコープがない場合などは、1人ずつの取得にフォールバックする
+            return
+
+        self._names.update(names)
+        self._saved_at = time.time()
+        self._dirty = False
+        save_json_cache(self.cache_path, self._names, self._saved_at)
+
+    def flush(self) -> None:
+        """users.info で新しく取得した名前があれば、ディスクキャッシュに書き込む"""
+        with self._lock:
+            if not self._dirty:
+                return
+            # 一覧を取得していない（users.list が使えない）場合は、今から有効期間を数える
+            if self._saved_at is None:
+                self._saved_at = time.time()
+            save_json_cache(self.cache_path, self._names, self._saved_at)
+            self._dirty = False
+
+    def resolve(self, user_id: str) -> str:
+        """
+        ユーザーIDを表示名に変換する。
+
+        Args:
+            user_id: ユーザーID（U1234567890）
+
+        Returns:
+            表示名。取得できない場合はユーザーIDをそのまま返す
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._prefetch(False)
+
+        name = self._names.get(user_id)
+        if name is not None:
+            with self._lock:
+                self.hits += 1
+            return name
+
+        with self._lock:
+            return self._resolve_miss(user_id)
+
+    def _resolve_miss(self, user_id: str) -> str:
+        # ロックを待っている間に別のスレッドが取得済みかもしれない
+        name = self._names.get(user_id)
+        if name is not None:
+            self.hits += 1
+            return name
+
+        if user_id in self._unknown:
+            self.hits += 1
+            return user_id
+
+        self.misses += 1
+        try:
+            user_info = get_rate_limiter().call("users.info", self.client.users_info, user=user_id)
+            name = _display_name(user_info["user"])
+        except SlackApiError:
+            # 次回も同じユーザーで API を呼ばないよう、IDのまま覚えておく（ディスクには保存しない）
+            self._unknown.add(user_id)
+            return user_id
+
+        self._names[user_id] = name
+        self._dirty = True
+        return name
+
+    def resolve_many(self, user_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        複数のユーザーIDをまとめて表示名に変換する（キャッシュにないIDだけ、1つにつき1回 API を呼ぶ）。
+
+        Args:
+            user_ids: ユーザーIDの集まり（重複があってもよい）
+
+        Returns:
+            ユーザーID → 表示名 の辞書
+        """
+        return {user_id: self.resolve(user_id) for user_id in set(user_ids)}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        キャッシュのヒット数・ミス数を返す。
+
+        Returns:
+            {"hits": ヒット数, "misses": ミス数（API を呼んだ回数）, "size": 登録ユーザー数}
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._names)}
+
+
+class ChannelIndex:
+    """
+    Slack のチャンネル名 → チャンネルID の対応表。
+
+    conversations.list をページ送りしながら全チャンネルを取得し、メモリとディスクに保持する。
+    見つからない名前を引いたときは、新しく作られた・名前が変わったチャンネルの可能性があるので一度だけ取り直す。
+    複数のスレッドから同時に使ってもよい。
+    """
+
+    def __init__(
+        self,
+        client: WebClient,
+        cache_path: Optional[str] = None,
+        ttl: float = DEFAULT_CHANNEL_TTL
+    ):
+        """
+        Args:
+            client: Slack の WebClient
+            cache_path: キャッシュファイルのパス（未指定の場合はトークンごとに自動で決定）
+            ttl: ディスクキャッシュの有効期間（秒）
+        """
+        self.client = client
+        if cache_path is None:
+            cache_path = os.path.join(CACHE_DIR, f"channels_{token_key(client.token or '')}.json")
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self._ids: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}
+        self._loaded = False
+        self._refreshed = False
+        self._lock = threading.RLock()
+
+    def _set(self, ids: Dict[str, str]) -> None:
+        """対応表を入れ替える（ID → 名前 の逆引きも作り直す）"""
+        self._ids = ids
+        self._names = {channel_id: name for name, channel_id in ids.items()}
+
+    def load(self) -> None:
+        """
+        チャンネル一覧を読み込む。有効なディスクキャッシュがあればそれを使い、なければ取得する。
+
+        Raises:
+            SlackApiError: API呼び出しに失敗した場合
+        """
+        self._loaded = True
+        cached = load_json_cache(self.cache_path, self.ttl)
+        if cached is not None:
+            self._set(cached)
+            return
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        conversations.list で全チャンネルを取得し直して、ディスクにも保存する。
+
+        Raises:
+            SlackApiError: API呼び出しに失敗した場合
+        """
+        ids: Dict[str, str] = {}
+        cursor = None
+        while True:
+            response = get_rate_limiter().call(
+                "conversations.list",
+                self.client.conversations_list,
+                types="public_channel,private_channel",
+                exclude_archived=True,
+                limit=CHANNELS_PAGE_SIZE,
+                cursor=cursor
+            )
+            for ch in response["channels"]:
+                ids[ch["name"]] = ch["id"]
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                break
+
+        self._loaded = True
+        self._refreshed = True
+        self._set(ids)
+        save_json_cache(self.cache_path, ids)
+
+    def lookup(self, name: str) -> Optional[str]:
+        """
+        チャンネル名からチャンネルIDを取得する。
+
+        Args:
+            name: チャンネル名（# なし）
+
+        Returns:
+            チャンネルID。見つからない場合は None
+
+        Raises:
+            SlackApiError: API呼び出しに失敗した場合
+        """
+        with self._lock:
+            if not self._loaded:
+                self.load()
+
+            channel_id = self._ids.get(name)
+            if channel_id is None and not self._refreshed:
+                # キャッシュが古い可能性があるので、このプロセスで一度だけ取り直す
+                self.refresh()
+                channel_id = self._ids.get(name)
+            return channel_id
+
+    def name_of(self, channel_id: str) -> Optional[str]:
+        """
+        チャンネルIDからチャンネル名を取得する（キャッシュにある場合のみ）。
+
+        Args:
+            channel_id: チャンネルID（C1234567890）
+
+        Returns:
+            チャンネル名。見つからない場合は None
+        """
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            return self._names.get(channel_id)
@@ -4,12 +4,53 @@
 Slack API を使用してチャンネルからメッセージを取得するモジュール
 """
 
+import heapq
 import os
-from typing import List, Dict, Optional
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from datetime import datetime, timedelta
-from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
+from message_batch import MessageBatch, iter_rows
+from slack_cache import ChannelIndex, UserDirectory
+from slack_clients import get_web_client
+from slack_rate_limit import get_rate_limiter
+from state_store import StateStore
+
+
+# conversations.history の1ページあたりの取得件数
+HISTORY_PAGE_SIZE = 200
+
+# 複数チャンネルを同時に取得するときの最大並列数
+DEFAULT_MAX_WORKERS = 8
+
+# 最新の返信がこの秒数以内のスレッドは、親メッセージが取得範囲より古くても新しい返信を確認する
+THREAD_WATCH_SECONDS = 7 * 24 * 60 * 60
+
+# 親メッセージが取得範囲より古いスレッドは、前回の確認からこの秒数がたつまで確認し直さない
+THREAD_RECHECK_SECONDS = 60 * 60
+
+# 親メッセージが取得範囲より古いスレッドを、1回の実行で確認する数の上限
+# （conversations.replies は1分に50回までなので、実行のたびに使い切らないようにする）
+THREAD_RECHECK_LIMIT = 20
+
+# メッセージに残す添付ファイルの情報
+FILE_KEYS = ("id", "name", "mimetype", "size", "url_private")
+
+# 本文中の Slack 独自の書式（<@U123>、<#C123|general>、<!here>、<https://...|リンク> など）
+SLACK_MARKUP_PATTERN = re.compile(r"<([@#!]?)([^<>|]*)(?:\|([^<>]*))?>")
+
+# Slack が本文中でエスケープする文字
+SLACK_ESCAPES = (("&lt;", "<"), ("&gt;", ">"), ("&amp;", "&"))
+
+# トークンごとのユーザー名キャッシュ（プロセス内で使い回す）
+_user_directories: Dict[str, UserDirectory] = {}
+
+# トークンごとのチャンネル名キャッシュ（プロセス内で使い回す）
+_channel_indexes: Dict[str, ChannelIndex] = {}
+
 
 def get_slack_token() -> str:
     """
@@ -37,11 +78,307 @@ def get_slack_token() -> str:
     )
 
 
+def get_user_directory(bot_token: Optional[str] = None) -> UserDirectory:
+    """
+    Bot Token に対応するユーザー名キャッシュを取得する（同じトークンなら同じものを返す）。
+
+    Args:
+        bot_token: Bot Token（未指定の場合は自動取得）
+
+    Returns:
+        UserDirectory
+    """
+    if bot_token is None:
+        bot_token = get_slack_token()
+
+    directory = _user_directories.get(bot_token)
+    if directory is None:
+        # 複数のスレッドから同時に呼ばれても、同じトークンのキャッシュは1つだけになるようにする
+        directory = _user_directories.setdefault(
+            bot_token, UserDirectory(get_web_client(bot_token))
+        )
+    return directory
+
+
+def get_channel_index(bot_token: Optional[str] = None) -> ChannelIndex:
+    """
+    Bot Token に対応するチャンネル名キャッシュを取得する（同じトークンなら同じものを返す）。
+
+    Args:
+        bot_token: Bot Token（未指定の場合は自動取得）
+
+    Returns:
+        ChannelIndex
+    """
+    if bot_token is None:
+        bot_token = get_slack_token()
+
+    index = _channel_indexes.get(bot_token)
+    if index is None:
+        index = _channel_indexes.setdefault(bot_token, ChannelIndex(get_web_client(bot_token)))
+    return index
+
+
+def resolve_channel_id(channel: str, bot_token: Optional[str] = None) -> str:
+    """
+    チャンネル名またはチャンネルIDからチャンネルIDを取得する。
+
+    Args:
+        channel: チャンネル名（#general）またはチャンネルID（C1234567890）
+        bot_token: Bot Token（未指定の場合は自動取得）
+
+    Returns:
+        チャンネルID
+
+    Raises:
+        RuntimeError: チャンネルが見つからない場合や、API呼び出しに失敗した場合
+    """
+    # チャンネル名が # で始まる場合は、# を削除
+    channel_name = channel[1:] if channel.startswith("#") else channel
+    
+    if channel_name.startswith("C"):
+        return channel_name
+    
+    # チャンネル名からIDを取得（キャッシュにない場合のみ一覧を取り直す）
+    try:
+        channel_id = get_channel_index(bot_token).lookup(channel_name)
+    except SlackApiError as e:
+        error_code = e.response.get("error", "unknown_error")
+        if error_code == "missing_scope":
+            raise RuntimeError(
+                f"必要な権限（スコープ）が不足しています。\n"
+                f"Slack Appの設定で以下のスコープを追加してください：\n"
+                f"  - channels:read（公開チャンネルの情報を読み取る）\n"
+                f"  - groups:read（プライベートチャンネルの情報を読み取る）\n\n"
+                f"または、チャンネルIDを直接指定してください。\n"
+                f"例: python main.py --channel \"C1234567890\""
+            ) from e
+        else:
+            raise RuntimeError(f"チャンネル情報の取得に失敗しました: {error_code}") from e
+    
+    if not channel_id:
+        raise RuntimeError(f"チャンネル '{channel}' が見つかりません。")
+    return channel_id
+
+
+def _api_error(e: SlackApiError, channel: str) -> RuntimeError:
+    """SlackApiError を分かりやすいメッセージの RuntimeError に変換する"""
+    error_msg = f"Slack API エラー: {e.response['error']}"
+    if e.response.get("error") == "channel_not_found":
+        error_msg += f"\nチャンネル '{channel}' が見つかりません。チャンネルIDを確認するか、ボットをチャンネルに追加してください。"
+    elif e.response.get("error") == "not_in_channel":
+        error_msg += f"\nボットがチャンネル '{channel}' に参加していません。チャンネルにボットを追加してください。"
+    elif e.response.get("error") == "invalid_auth":
+        error_msg += "\nBot Token が無効です。トークンを確認してください。"
+    return RuntimeError(error_msg)
+
+
+def _unescape(text: str) -> str:
+    """Slack のエスケープ（&lt; &gt; &amp;）を元の文字に戻す"""
+    if "&" not in text:
+        return text
+    for escaped, char in SLACK_ESCAPES:
+        text = text.replace(escaped, char)
+    return text
+
+
+def render_messages(messages: List[Dict], bot_token: Optional[str] = None) -> List[Dict]:
+    """
+    メッセージ本文のメンションやチャンネルリンクを、読める名前に置き換える（messages をそのまま書き換える）。
+
+    例: "<@U012AB3CD> さん、<#C123|general> を見てください" → "@山田 さん、#general を見てください"
+
+    まず全メッセージから ID を集めてから、まとめて名前に変換する。
+    名前はキャッシュから引くので、API を呼ぶのはキャッシュにないユーザー1人につき1回だけ。
+
+    Args:
+        messages: get_channel_messages() と同じ形式のメッセージのリスト
+        bot_token: Bot Token（未指定の場合は自動取得）
+
+    Returns:
+        本文を置き換えた messages
+    """
+    # 本文を1回だけ分割して、書式部分（種類, ID, 表示名）と通常の文字列に分ける
+    split_texts = []
+    user_ids = set()
+    channel_ids = set()
+    for msg in messages:
+        parts = SLACK_MARKUP_PATTERN.split(msg["text"])
+        split_texts.append(parts)
+        for i in range(1, len(parts), 4):
+            kind, target, label = parts[i], parts[i + 1], parts[i + 2]
+            if label:
+                continue
+            if kind == "@":
+                user_ids.add(target)
+            elif kind == "#":
+                channel_ids.add(target)
+    
+    user_names = get_user_directory(bot_token).resolve_many(user_ids) if user_ids else {}
+    channel_names = {}
+    if channel_ids:
+        try:
+            channel_index = get_channel_index(bot_token)
+            channel_names = {channel_id: channel_index.name_of(channel_id) for channel_id in channel_ids}
+        except SlackApiError:
+            # チャンネル一覧が取得できない場合は ID のまま表示する
+            pass
+    
+    for msg, parts in zip(messages, split_texts):
+        if len(parts) == 1:
+            msg["text"] = _unescape(parts[0])
+            continue
+        rendered = [_unescape(parts[0])]
+        for i in range(1, len(parts), 4):
+            kind, target, label = parts[i], parts[i + 1], parts[i + 2]
+            if kind == "@":
+                rendered.append("@" + (label or user_names.get(target, target)))
+            elif kind == "#":
+                rendered.append("#" + (label or channel_names.get(target) or target))
+            elif kind == "!":
+                # <!here> <!channel> <!everyone> や、<!subteam^S123|@team> などの特殊なメンション
+                rendered.append(label or "@" + target.split("^")[0])
+            else:
+                # リンクは表示名があれば表示名、なければ URL
+                rendered.append(label or target)
+            rendered.append(_unescape(parts[i + 3]))
+        msg["text"] = "".join(rendered)
+    return messages
+
+
+def _to_message(
+    msg: Dict,
+    channel: str,
+    channel_id: str,
+    user_directory: UserDirectory
+) -> Optional[Dict]:
+    """
+    API から返ってきたメッセージを、このツールで使う辞書形式に変換する。
+
+    Returns:
+        変換したメッセージ。ボットメッセージや削除されたメッセージの場合は None
+    """
+    # ボットメッセージや削除されたメッセージは除外
+    if msg.get("subtype") in ["bot_message", "message_deleted"]:
+        return None
+    
+    # ユーザー名を取得（キャッシュにない場合のみ API を呼ぶ）
+    user_name = "不明"
+    if "user" in msg:
+        user_name = user_directory.resolve(msg["user"])
+    
+    message = {
+        "text": msg.get("text", ""),
+        "user": user_name,
+        "timestamp": float(msg.get("ts", 0)),
+        "ts": msg.get("ts", "0"),
+        "channel": channel,
+        "channel_id": channel_id
+    }
+    
+    # スレッドの親メッセージには返信の情報を付ける
+    if msg.get("reply_count") and msg.get("thread_ts") == msg.get("ts"):
+        message["reply_count"] = msg["reply_count"]
+        message["latest_reply"] = msg.get("latest_reply")
+
+    # 添付ファイルは保存（--download-files）に必要な情報だけ残す
+    files = [
+        {key: file.get(key) for key in FILE_KEYS}
+        for file in msg.get("files") or []
+        if file.get("url_private")
+    ]
+    if files:
+        message["files"] = files
+    return message
+
+
+def iter_channel_messages(
+    channel: str,
+    hours: int = 24,
+    limit: Optional[int] = None,
+    bot_token: Optional[str] = None,
+    page_size: int = HISTORY_PAGE_SIZE,
+    oldest: Optional[str] = None,
+    render: bool = True,
+    newest_ts: Optional[Dict[str, str]] = None
+) -> Iterator[Dict]:
+    """
+    Slackチャンネルのメッセージを新しい順に1件ずつ返す。
+
+    conversations.history をページ送り（cursor）しながら必要になった分だけ取得するので、
+    期間が長くても全件を一度にメモリに載せずに済む。途中でループを抜ければ、残りのページは取得しない。
+
+    Args:
+        channel: チャンネル名（#general）またはチャンネルID（C1234567890）
+        hours: 何時間前までのメッセージを取得するか（デフォルト: 24時間）
+        limit: 取得するメッセージの最大数（未指定の場合は期間内の全件）
+        bot_token: Bot Token（未指定の場合は自動取得）
+        page_size: 1回のAPI呼び出しで取得する件数（デフォルト: 200）
+        oldest: この ts より新しいメッセージだけを取得する（指定した場合は hours より優先）
+        render: True の場合、本文のメンションやチャンネルリンクを名前に置き換える（ページごとにまとめて変換）
+        newest_ts: 指定した場合、取得した中で最新の ts（ボットなど除外したメッセージも含む）を
+            newest_ts[channel] に書き込む（次回の取得位置の記録に使う）
+
+    Yields:
+        メッセージの辞書（キーは get_channel_messages() と同じ）
+
+    Raises:
+        RuntimeError: Bot Token が設定されていない場合や、API呼び出しに失敗した場合
+    """
+    if bot_token is None:
+        bot_token = get_slack_token()
+    
+    client = get_web_client(bot_token)
+    user_directory = get_user_directory(bot_token)
+    channel_id = resolve_channel_id(channel, bot_token)
+    
+    # 指定時間前のタイムスタンプを計算
+    if oldest is None:
+        oldest = str((datetime.now() - timedelta(hours=hours)).timestamp())
+    
+    count = 0
+    cursor = None
+    while limit is None or count < limit:
+        try:
+            response = get_rate_limiter().call(
+                "conversations.history",
+                client.conversations_history,
+                channel=channel_id,
+                oldest=oldest,
+                limit=page_size if limit is None else min(page_size, limit - count),
+                cursor=cursor
+            )
+        except SlackApiError as e:
+            raise _api_error(e, channel) from e
+        
+        # 新しい順に返ってくるので、最初のページの先頭が最新（除外するメッセージでも記録する）
+        if newest_ts is not None and cursor is None and response["messages"]:
+            newest_ts[channel] = response["messages"][0].get("ts", "0")
+        
+        page = [_to_message(msg, channel, channel_id, user_directory) for msg in response["messages"]]
+        page = [message for message in page if message is not None]
+        if render:
+            render_messages(page, bot_token)
+        
+        for message in page:
+            yield message
+            
+            count += 1
+            if limit is not None and count >= limit:
+                return
+        
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            return
+
+
 def get_channel_messages(
     channel: str,
     hours: int = 24,
-    limit: int = 100,
-    bot_token: Optional[str] = None
+    limit: Optional[int] = 100,
+    bot_token: Optional[str] = None,
+    oldest: Optional[str] = None,
+    newest_ts: Optional[Dict[str, str]] = None
 ) -> List[Dict]:
     """
     Slackチャンネルからメッセージを取得する。
@@ -49,108 +386,330 @@ def get_channel_messages(
     Args:
         channel: チャンネル名（#general）またはチャンネルID（C1234567890）
         hours: 何時間前までのメッセージを取得するか（デフォルト: 24時間）
-        limit: 取得するメッセージの最大数（デフォルト: 100）
+        limit: 取得するメッセージの最大数（デフォルト: 100、None の場合は期間内の全件）
         bot_token: Bot Token（未指定の場合は自動取得）
+        oldest: この ts より新しいメッセージだけを取得する（指定した場合は hours より優先）
+        newest_ts: iter_channel_messages() と同じ
 
     Returns:
-        メッセージのリスト。各メッセージは辞書形式で以下のキーを持つ:
+        メッセージのリスト（新しい順）。各メッセージは辞書形式で以下のキーを持つ:
         - text: メッセージ本文
         - user: ユーザー名
         - timestamp: タイムスタンプ
-        - channel: チャンネル名
+        - ts: Slack の ts（文字列のまま。次回取得の起点などに使う）
+        - channel: チャンネル名（指定されたとおりの名前またはID）
+        - channel_id: チャンネルID
+        スレッドの親メッセージには、さらに以下のキーが付く:
+        - reply_count: 返信数
+        - latest_reply: 最新の返信の ts
 
     Raises:
-        SlackApiError: API呼び出しに失敗した場合
-        RuntimeError: Bot Token が設定されていない場合
+        RuntimeError: Bot Token が設定されていない場合や、API呼び出しに失敗した場合
+    """
+    return list(iter_channel_messages(
+        channel, hours=hours, limit=limit, bot_token=bot_token, oldest=oldest, newest_ts=newest_ts
+    ))
+
+
+def get_thread_replies(
+    channel: str,
+    thread_ts: str,
+    bot_token: Optional[str] = None,
+    oldest: Optional[str] = None,
+    newest_ts: Optional[Dict[str, str]] = None
+) -> List[Dict]:
+    """
+    スレッドの返信を取得する（親メッセージは含まない）。
+
+    Args:
+        channel: チャンネル名（#general）またはチャンネルID（C1234567890）
+        thread_ts: 親メッセージの ts
+        bot_token: Bot Token（未指定の場合は自動取得）
+        oldest: この ts より新しい返信だけを取得する（未指定の場合は全ての返信）
+        newest_ts: 指定した場合、スレッドの最新の返信の ts（ボットなど除外した返信も含む）を
+            newest_ts[thread_ts] に書き込む
+
+    Returns:
+        返信のリスト（新しい順）。各返信には get_channel_messages() と同じキーに加えて
+        parent_ts（親メッセージの ts）が付く
+
+    Raises:
+        RuntimeError: API呼び出しに失敗した場合
     """
     if bot_token is None:
         bot_token = get_slack_token()
     
-    client = WebClient(token=bot_token)
+    client = get_web_client(bot_token)
+    user_directory = get_user_directory(bot_token)
+    channel_id = resolve_channel_id(channel, bot_token)
     
-    try:
-        # チャンネル名が # で始まる場合は、# を削除
-        channel_name = channel[1:] if channel.startswith("#") else channel
-        
-        # チャンネルIDを取得
-        channel_id = None
-        if not channel_name.startswith("C"):
-            # チャンネル名からIDを取得
-            try:
-                result = client.conversations_list(types="public_channel,private_channel")
-                for ch in result["channels"]:
-                    if ch["name"] == channel_name:
-                        channel_id = ch["id"]
-                        break
-                if not channel_id:
-                    raise RuntimeError(f"チャンネル '{channel}' が見つかりません。")
-            except SlackApiError as e:
-                error_code = e.response.get("error", "unknown_error")
-                if error_code == "missing_scope":
-                    raise RuntimeError(
-                        f"必要な権限（スコープ）が不足しています。\n"
-                        f"Slack Appの設定で以下のスコープを追加してください：\n"
-                        f"  - channels:read（公開チャンネルの情報を読み取る）\n"
-                        f"  - groups:read（プライベートチャンネルの情報を読み取る）\n\n"
-                        f"または、チャンネルIDを直接指定してください。\n"
-                        f"例: python main.py --channel \"C1234567890\""
-                    ) from e
-                else:
-                    raise RuntimeError(f"チャンネル情報の取得に失敗しました: {error_code}") from e
-        else:
-            channel_id = channel_name
-        
-        # 指定時間前のタイムスタンプを計算
-        oldest_timestamp = (datetime.now() - timedelta(hours=hours)).timestamp()
+    replies = []
+    latest = oldest or thread_ts
+    cursor = None
+    while True:
+        try:
+            response = get_rate_limiter().call(
+                "conversations.replies",
+                client.conversations_replies,
+                channel=channel_id,
+                ts=thread_ts,
+                oldest=oldest,
+                limit=HISTORY_PAGE_SIZE,
+                cursor=cursor
+            )
+        except SlackApiError as e:
+            raise _api_error(e, channel) from e
         
-        # メッセージを取得
-        response = client.conversations_history(
-            channel=channel_id,
-            oldest=str(oldest_timestamp),
-            limit=limit
-        )
-        
-        messages = []
+        page = []
         for msg in response["messages"]:
-            # ボットメッセージや削除されたメッセージは除外
-            if msg.get("subtype") in ["bot_message", "message_deleted"]:
+            # 親メッセージの latest_reply と、除外するものを含む全ての返信から最新の ts を求める
+            candidate = msg.get("latest_reply") if msg.get("ts") == thread_ts else msg.get("ts")
+            if candidate and float(candidate) > float(latest):
+                latest = candidate
+            if msg.get("ts") == thread_ts:
                 continue
-            
-            # ユーザー情報を取得
-            user_name = "不明"
-            if "user" in msg:
-                try:
-                    user_info = client.users_info(user=msg["user"])
-                    user_name = user_info["user"]["real_name"] or user_info["user"]["name"]
-                except SlackApiError:
-                    user_name = msg["user"]
-            
-            messages.append({
-                "text": msg.get("text", ""),
-                "user": user_name,
-                "timestamp": float(msg.get("ts", 0)),
-                "channel": channel
-            })
+            reply = _to_message(msg, channel, channel_id, user_directory)
+            if reply is not None:
+                reply["parent_ts"] = thread_ts
+                page.append(reply)
+        replies.extend(render_messages(page, bot_token))
         
-        return messages
-        
-    except SlackApiError as e:
-        error_msg = f"Slack API エラー: {e.response['error']}"
-        if e.response.get("error") == "channel_not_found":
-            error_msg += f"\nチャンネル '{channel}' が見つかりません。チャンネルIDを確認するか、ボットをチャンネルに追加してください。"
-        elif e.response.get("error") == "not_in_channel":
-            error_msg += f"\nボットがチャンネル '{channel}' に参加していません。チャンネルにボットを追加してください。"
-        elif e.response.get("error") == "invalid_auth":
-            error_msg += "\nBot Token が無効です。トークンを確認してください。"
-        raise RuntimeError(error_msg) from e
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            break
+    
+    if newest_ts is not None:
+        newest_ts[thread_ts] = latest
+    
+    # conversations.replies は古い順に返すので、他のメッセージに合わせて新しい順にする
+    replies.reverse()
+    return replies
+
+
+def expand_thread_replies(
+    messages: List[Dict],
+    bot_token: Optional[str] = None,
+    state_store: Optional[StateStore] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    channels: Optional[Iterable[str]] = None,
+    thread_latest: Optional[Dict[Tuple[str, str], str]] = None
+) -> Tuple[List[Dict], Dict[str, str]]:
+    """
+    メッセージリストに含まれるスレッドの返信を並列に取得して、メッセージリストに加える。
+
+    state_store は --since-last-run のように、前回送信した続きだけを送る場合に指定する。
+    このときは前回記録したところ（set_thread_latest()）より新しい返信だけを取得し、
+    latest_reply が記録と同じスレッドは取得しない。また、親メッセージが今回の取得範囲より古いスレッドも、
+    最新の返信が THREAD_WATCH_SECONDS 以内のものは新しい返信がないか確認する（古いスレッドに付いた返信も
+    取りこぼさない）。ただし確認は前回の確認から THREAD_RECHECK_SECONDS たったものだけ、1回の実行で
+    THREAD_RECHECK_LIMIT 個まで（新しい返信があったものから）にする。
+    state_store を指定しない場合は、messages に含まれるスレッドの返信を全て取得する。
+
+    Args:
+        messages: get_channel_messages() で取得したメッセージリスト（新しい順）
+        bot_token: Bot Token（未指定の場合は自動取得）
+        state_store: 前回取得したスレッドの状態（StateStore。前回の続きだけを取得する場合に指定する）
+        max_workers: 同時に取得するスレッド数の上限（デフォルト: 8）
+        channels: 記録済みのスレッドを確認するチャンネル（未指定の場合は messages に含まれるチャンネル）
+        thread_latest: 指定した場合、取得できたスレッドの最新の返信の ts を
+            thread_latest[(チャンネルID, 親メッセージの ts)] に書き込む（送信後に set_thread_latest() で記録する）
+
+    Returns:
+        (返信を加えたメッセージのリスト（新しい順。返信には parent_ts が付く), スレッド → エラーメッセージ) のタプル。
+        一部のスレッドで失敗しても、取得できたスレッドの返信は加える
+    """
+    if bot_token is None:
+        bot_token = get_slack_token()
+    if channels is None:
+        channels = dict.fromkeys(msg["channel"] for msg in messages)
+    
+    errors: Dict[str, str] = {}
+    channel_ids: Dict[str, str] = {}
+    for channel in channels:
+        try:
+            channel_ids[channel] = resolve_channel_id(channel, bot_token)
+        except (RuntimeError, SlackApiError, OSError) as e:
+            errors[channel] = str(e)
+    
+    # (チャンネルID, 親メッセージの ts) → (チャンネル, 親メッセージの ts, 前回記録した最新の返信の ts)
+    targets: Dict[Tuple[str, str], Tuple[str, str, Optional[str]]] = {}
+    recorded: Dict[Tuple[str, str], str] = {}
+    if state_store is not None:
+        # 親メッセージが取得範囲より古くても、最近まで返信があったスレッドは確認する
+        now = time.time()
+        remaining = THREAD_RECHECK_LIMIT
+        for channel, channel_id in channel_ids.items():
+            if remaining <= 0:
+                break
+            watched = state_store.get_threads(
+                channel_id,
+                now - THREAD_WATCH_SECONDS,
+                checked_before=now - THREAD_RECHECK_SECONDS,
+                limit=remaining
+            )
+            remaining -= len(watched)
+            for thread_ts, latest_reply in watched.items():
+                recorded[(channel_id, thread_ts)] = latest_reply
+                targets[(channel_id, thread_ts)] = (channel, thread_ts, latest_reply)
+    
+    for msg in messages:
+        if not msg.get("reply_count") or msg["channel"] not in channel_ids:
+            continue
+        key = (channel_ids[msg["channel"]], msg["ts"])
+        latest_reply = recorded.get(key)
+        if latest_reply is None and state_store is not None:
+            latest_reply = state_store.get_thread_latest(*key)
+        if latest_reply is not None and latest_reply == msg.get("latest_reply"):
+            # 前回から新しい返信がない
+            targets.pop(key, None)
+            continue
+        targets[key] = (msg["channel"], msg["ts"], latest_reply)
+    
+    if not targets:
+        return messages, errors
+    
+    def fetch(channel: str, thread_ts: str, oldest: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+        newest_ts: Dict[str, str] = {}
+        replies = get_thread_replies(channel, thread_ts, bot_token, oldest=oldest, newest_ts=newest_ts)
+        return replies, newest_ts.get(thread_ts)
+    
+    reply_lists = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as executor:
+        futures = {key: executor.submit(fetch, *target) for key, target in targets.items()}
+        for key, future in futures.items():
+            channel, thread_ts, _ = targets[key]
+            try:
+                replies, latest_reply = future.result()
+            except (RuntimeError, SlackApiError, OSError) as e:
+                # 1つのスレッドで失敗しても、ほかのスレッドの返信は加える（OSError は接続の失敗やタイムアウト）
+                errors[f"{channel} のスレッド {thread_ts}"] = str(e)
+                continue
+            reply_lists.append(replies)
+            if thread_latest is not None and latest_reply is not None:
+                thread_latest[key] = latest_reply
+    
+    # チャンネルにも投稿された返信（thread_broadcast）は、すでに messages に含まれている
+    seen = {(msg["channel"], msg["ts"]) for msg in messages}
+    replies = [
+        reply
+        for reply_list in reply_lists
+        for reply in reply_list
+        if (reply["channel"], reply["ts"]) not in seen
+    ]
+    replies.sort(key=lambda msg: msg["timestamp"], reverse=True)
+    return merge_messages([messages, replies]), errors
+
+
+def get_channel_batch(
+    channel: str,
+    hours: int = 24,
+    limit: Optional[int] = None,
+    bot_token: Optional[str] = None,
+    oldest: Optional[str] = None
+) -> MessageBatch:
+    """
+    Slackチャンネルからメッセージを取得して、MessageBatch にまとめる。
+
+    メッセージごとの辞書をリストにためずに直接詰めるので、長い期間・大量のメッセージでもメモリが少なくて済む。
+
+    Args:
+        channel: チャンネル名（#general）またはチャンネルID（C1234567890）
+        hours: 何時間前までのメッセージを取得するか（デフォルト: 24時間）
+        limit: 取得するメッセージの最大数（未指定の場合は期間内の全件）
+        bot_token: Bot Token（未指定の場合は自動取得）
+        oldest: この ts より新しいメッセージだけを取得する（指定した場合は hours より優先）
+
+    Returns:
+        MessageBatch（新しい順）
+
+    Raises:
+        RuntimeError: Bot Token が設定されていない場合や、API呼び出しに失敗した場合
+    """
+    return MessageBatch.from_messages(iter_channel_messages(
+        channel, hours=hours, limit=limit, bot_token=bot_token, oldest=oldest
+    ))
+
+
+def fetch_channels_messages(
+    channels: List[str],
+    hours: int = 24,
+    limit: Optional[int] = None,
+    bot_token: Optional[str] = None,
+    oldest_by_channel: Optional[Dict[str, Optional[str]]] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    newest_ts: Optional[Dict[str, str]] = None
+) -> Tuple[Dict[str, List[Dict]], Dict[str, str]]:
+    """
+    複数のSlackチャンネルからメッセージを並列に取得する。
+
+    全体の所要時間は、チャンネル数の合計ではなく一番遅いチャンネルの取得時間に近くなる。
+
+    Args:
+        channels: チャンネル名またはチャンネルIDのリスト
+        hours: 何時間前までのメッセージを取得するか（デフォルト: 24時間）
+        limit: チャンネルごとに取得するメッセージの最大数（未指定の場合は期間内の全件）
+        bot_token: Bot Token（未指定の場合は自動取得）
+        oldest_by_channel: チャンネルごとの取得開始 ts（指定したチャンネルは hours より優先）
+        max_workers: 同時に取得するチャンネル数の上限（デフォルト: 8）
+        newest_ts: 指定した場合、チャンネルごとに取得した中で最新の ts（ボットなど除外したメッセージも含む）を書き込む
+
+    Returns:
+        (チャンネル → メッセージのリスト, チャンネル → エラーメッセージ) のタプル。
+        一部のチャンネルで失敗しても（API のエラー・通信エラーを含む）、取得できたチャンネルの結果は返す。
+
+    Raises:
+        RuntimeError: Bot Token が設定されていない場合
+    """
+    if bot_token is None:
+        bot_token = get_slack_token()
+    oldest_by_channel = oldest_by_channel or {}
+    
+    # キャッシュはスレッドを起動する前に読み込んでおく（同じ一覧を何度も取得しないように）
+    get_user_directory(bot_token).prefetch()
+    
+    def fetch(channel: str) -> List[Dict]:
+        return get_channel_messages(
+            channel,
+            hours=hours,
+            limit=limit,
+            bot_token=bot_token,
+            oldest=oldest_by_channel.get(channel),
+            newest_ts=newest_ts
+        )
+    
+    results: Dict[str, List[Dict]] = {}
+    errors: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(channels)))) as executor:
+        futures = {channel: executor.submit(fetch, channel) for channel in channels}
+        for channel, future in futures.items():
+            try:
+                results[channel] = future.result()
+            except (RuntimeError, SlackApiError, OSError) as e:
+                # OSError: 接続の失敗やタイムアウト（urllib.error.URLError など）
+                errors[channel] = str(e)
+    
+    return results, errors
 
 
-def format_messages_for_display(messages: List[Dict]) -> str:
+def merge_messages(message_lists: Iterable[List[Dict]]) -> List[Dict]:
+    """
+    チャンネルごとのメッセージリスト（それぞれ新しい順）を、1つの新しい順のリストにまとめる。
+
+    Args:
+        message_lists: get_channel_messages() で取得したメッセージリストの集まり
+
+    Returns:
+        まとめたメッセージのリスト（新しい順）
+    """
+    return list(heapq.merge(*message_lists, key=lambda msg: msg["timestamp"], reverse=True))
+
+
+def format_messages_for_display(messages: Union[List[Dict], MessageBatch]) -> str:
     """
     メッセージリストを表示用の文字列にフォーマットする。
 
     Args:
-        messages: get_channel_messages() で取得したメッセージリスト
+        messages: get_channel_messages() で取得したメッセージリストまたは MessageBatch
 
     Returns:
         フォーマットされた文字列
@@ -159,10 +718,10 @@ def format_messages_for_display(messages: List[Dict]) -> str:
         return "メッセージが見つかりませんでした。"
     
     formatted_lines = []
-    for msg in messages:
-        dt = datetime.fromtimestamp(msg["timestamp"])
+    for timestamp, user, _, text in iter_rows(messages):
+        dt = datetime.fromtimestamp(timestamp)
         time_str = dt.strftime("%Y-%m-%d %H:%M")
-        formatted_lines.append(f"[{time_str}] {msg['user']}: {msg['text']}")
+        formatted_lines.append(f"[{time_str}] {user}: {text}")
     
     return "\n".join(formatted_lines)
 
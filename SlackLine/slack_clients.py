@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Slack の WebClient をプロセス全体で使い回すモジュール
+
+呼び出しのたびに WebClient を作ると、クライアントの準備や証明書の読み込みを毎回やり直すことになる。
+ここでは Bot Token ごとに1つのクライアントを作り、SSL コンテキストも1つを共有する。
+
+なお、slack_sdk の WebClient は urllib（urlopen）で通信し、通信部分を差し替える方法がないため、
+API 呼び出しごとに新しく接続する（接続そのもの（keep-alive）は使い回されない）。
+ここで省けるのは、クライアントと証明書の準備だけ。
+接続も使い回したい場合は get_async_web_client() を使う（イベントループごとに1つの aiohttp セッションを共有する）。
+"""
+
+import asyncio
+import ssl
+import threading
+import weakref
+from typing import Dict
+
+from slack_sdk import WebClient
+
+
+# 非同期クライアント1つあたりの同時接続数の上限
+ASYNC_CONNECTION_LIMIT = 16
+
+_lock = threading.Lock()
+_ssl_context = None
+_web_clients: Dict[str, WebClient] = {}
+
+# イベントループ → そのループ用の aiohttp セッションと、Bot Token ごとの AsyncWebClient
+# （変更は _lock を取ってから行う。セッションがループを参照し続けるので、ループが回収されるだけでは消えない。
+#   閉じたループの分は、次に get_async_web_client() を呼んだときに取り除く）
+_async_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncState]" = weakref.WeakKeyDictionary()
+
+
+class _AsyncState:
+    """1つのイベントループで共有する aiohttp セッションと AsyncWebClient"""
+
+    def __init__(self, session):
+        self.session = session
+        self.clients: Dict[str, object] = {}
+
+
+def get_ssl_context() -> ssl.SSLContext:
+    """
+    共有の SSL コンテキストを取得する（証明書の読み込みはプロセスで1回だけ）。
+
+    Returns:
+        ssl.SSLContext
+    """
+    global _ssl_context
+    with _lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context()
+        return _ssl_context
+
+
+def get_web_client(token: str) -> WebClient:
+    """
+    Bot Token に対応する WebClient を取得する（同じトークンなら同じものを返す）。
+
+    WebClient はリクエストごとの状態を持たないので、複数のスレッドから同時に使ってよい。
+
+    Args:
+        token: Bot Token
+
+    Returns:
+        WebClient
+    """
+    client = _web_clients.get(token)
+    if client is not None:
+        return client
+
+    ssl_context = get_ssl_context()
+    with _lock:
+        client = _web_clients.get(token)
+        if client is None:
+            client = WebClient(token=token, ssl=ssl_context)
+            _web_clients[token] = client
+        return client
+
+
+async def get_async_web_client(token: str):
+    """
+    Bot Token に対応する AsyncWebClient を取得する（同じイベントループ・同じトークンなら同じものを返す）。
+
+    イベントループごとに1つの aiohttp セッションを共有するので、接続（keep-alive）が使い回される。
+    ループを終える前に close_async_clients() で接続を閉じる。aiohttp が必要（pip install aiohttp）。
+
+    Args:
+        token: Bot Token
+
+    Returns:
+        slack_sdk.web.async_client.AsyncWebClient
+
+    Raises:
+        RuntimeError: aiohttp がインストールされていない場合
+    """
+    try:
+        import aiohttp
+        from slack_sdk.web.async_client import AsyncWebClient
+    except ImportError as e:
+        raise RuntimeError(
+            "非同期クライアントを使うには aiohttp が必要です。\n"
+            "pip install aiohttp を実行してください。"
+        ) from e
+
+    loop = asyncio.get_running_loop()
+    ssl_context = get_ssl_context()
+    with _lock:
+        for closed_loop in [key for key in _async_states if key.is_closed()]:
+            del _async_states[closed_loop]
+        state = _async_states.get(loop)
+        if state is None or state.session.closed:
+            state = _AsyncState(aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT, ssl=ssl_context)
+            ))
+            _async_states[loop] = state
+        client = state.clients.get(token)
+        if client is None:
+            client = AsyncWebClient(token=token, session=state.session)
+            state.clients[token] = client
+        return client
+
+
+async def close_async_clients() -> None:
+    """
+    現在のイベントループで作った AsyncWebClient の接続を閉じる（ループを終える前に呼ぶ）。
+    """
+    with _lock:
+        state = _async_states.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state.session.close()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Slack API のレート制限に合わせて呼び出し間隔を調整するモジュール
+
+API メソッドごとに Slack のティア（Tier）に合わせたトークンバケットを持ち、
+上限を超えそうなときはエラーにせず待ってから呼び出す。
+429（Too Many Requests）が返ってきた場合は Retry-After の秒数だけ待ってやり直す。
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from slack_sdk.errors import SlackApiError
+
+
+# ティアごとの1分あたりの呼び出し上限
+# https://api.slack.com/apis/rate-limits
+TIER_LIMITS = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+}
+
+# API メソッドとティアの対応
+METHOD_TIERS = {
+    "users.list": 2,
+    "users.info": 4,
+    "conversations.list": 2,
+    "conversations.history": 3,
+    "conversations.replies": 3,
+}
+
+# chat.postMessage はティアではなく「1チャンネルあたり1秒に1件」が目安
+SPECIAL_LIMITS = {
+    "chat.postMessage": 60,
+}
+
+# 429 が返ってきたときにやり直す最大回数
+DEFAULT_MAX_RETRIES = 5
+
+
+class TokenBucket:
+    """
+    一定の速さでトークンがたまり、呼び出しごとに1つ消費するバケット。
+    """
+
+    def __init__(self, per_minute: float):
+        """
+        Args:
+            per_minute: 1分あたりの呼び出し上限
+        """
+        self.rate = per_minute / 60.0
+        # 短い時間にまとめて呼び出せる数（10秒分、最低1回）
+        self.capacity = max(1.0, per_minute / 6.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """
+        トークンを1つ予約する。
+
+        Returns:
+            呼び出してよくなるまでに待つ秒数（0 ならすぐに呼び出してよい）
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+
+        wait = 0.0
+        if self.tokens < 0:
+            wait = -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds: float) -> None:
+        """
+        Retry-After を受け取ったときに、指定秒数のあいだ呼び出しを止める。
+
+        Args:
+            seconds: 止める秒数
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    """
+    Slack API の呼び出しを、メソッドごとのレート制限に合わせて順番に実行する。
+
+    複数のスレッドから同時に使ってもよい。
+    """
+
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES):
+        """
+        Args:
+            max_retries: 429 が返ってきたときにやり直す最大回数
+        """
+        self.max_retries = max_retries
+        self._buckets: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, method: str, key: Optional[str]) -> TokenBucket:
+        bucket = self._buckets.get((method, key))
+        if bucket is None:
+            per_minute = SPECIAL_LIMITS.get(method) or TIER_LIMITS[METHOD_TIERS.get(method, 3)]
+            bucket = TokenBucket(per_minute)
+            self._buckets[(method, key)] = bucket
+        return bucket
+
+    def acquire(self, method: str, key: Optional[str] = None) -> None:
+        """
+        API を呼び出してよくなるまで待つ。
+
+        Args:
+            method: API メソッド名（例: "conversations.history"）
+            key: 同じメソッドでも別々に制限を数える単位（例: chat.postMessage のチャンネル）
+        """
+        with self._lock:
+            wait = self._bucket(method, key).reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def call(
+        self,
+        method: str,
+        func: Callable[..., Any],
+        *args: Any,
+        key: Optional[str] = None,
+        **kwargs: Any
+    ) -> Any:
+        """
+        レート制限を守って API を呼び出す。429 の場合は Retry-After の秒数だけ待ってやり直す。
+
+        Args:
+            method: API メソッド名（例: "conversations.history"）
+            func: 呼び出す WebClient のメソッド（例: client.conversations_history）
+            key: 同じメソッドでも別々に制限を数える単位（例: chat.postMessage のチャンネル）
+            *args, **kwargs: func に渡す引数
+
+        Returns:
+            func の戻り値
+
+        Raises:
+            SlackApiError: 429 以外のエラーの場合や、やり直しの回数を超えた場合
+        """
+        attempt = 0
+        while True:
+            self.acquire(method, key)
+            try:
+                return func(*args, **kwargs)
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._bucket(method, key).block(_retry_after(e))
+
+
+def _retry_after(e: SlackApiError) -> float:
+    """429 のレスポンスから Retry-After（秒）を取り出す（見つからない場合は1秒）"""
+    headers = e.response.headers or {}
+    for name, value in headers.items():
+        if name.lower() == "retry-after":
+            try:
+                return float(value if not isinstance(value, list) else value[0])
+            except (TypeError, ValueError):
+                break
+    return 1.0
+
+
+# プロセス全体で共有するレート制限
+_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    プロセス全体で共有する RateLimiter を取得する。
+
+    Returns:
+        RateLimiter
+    """
+    return _rate_limiter
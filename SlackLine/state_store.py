@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+実行ごとの状態（どこまでメッセージを取得したか）を SQLite に保存するモジュール
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional, Union
+
+from message_batch import MessageBatch, iter_rows
+from slack_cache import CACHE_DIR
+
+
+# 状態を保存するデータベースファイル
+DEFAULT_STATE_PATH = os.path.join(CACHE_DIR, "state.db")
+
+# 送信済みの要約を覚えておく期間（秒）と件数
+DIGEST_TTL = 7 * 24 * 60 * 60
+DIGEST_CACHE_SIZE = 200
+
+
+def digest_key(messages: Union[MessageBatch, Iterable[Dict]], options: Dict) -> str:
+    """
+    要約の内容を決めるもの（メッセージの (チャンネル, ts) の集合と要約の設定）からキーを作る。
+
+    同じメッセージの集合・同じ設定なら、並び順にかかわらず同じキーになる。
+
+    Args:
+        messages: メッセージのリストまたは MessageBatch
+        options: 要約の設定（JSON にできる値の辞書）
+
+    Returns:
+        キー（SHA-256 の16進文字列）
+    """
+    pairs = sorted(f"{channel}\t{timestamp:.6f}" for timestamp, _, channel, _ in iter_rows(messages))
+    hasher = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8"))
+    hasher.update("\n".join(pairs).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class StateStore:
+    """
+    チャンネルごとに「最後に取得したメッセージのタイムスタンプ（ts）」を記録する。
+
+    次回の実行ではこの ts より新しいメッセージだけを取得すればよい。
+    スレッドごとの最新の返信 ts も記録し、新しい返信がないスレッドは取得し直さずに済むようにする。
+    送信した要約のキー（digest_key()）も記録し、前回と同じ内容なら作り直し・送信をしないで済むようにする。
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        """
+        Args:
+            path: データベースファイルのパス（":memory:" も指定可能）
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS watermarks ("
+            " channel_id TEXT PRIMARY KEY,"
+            " ts TEXT NOT NULL,"
+            " updated_at REAL NOT NULL"
+            ")"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            " channel_id TEXT NOT NULL,"
+            " thread_ts TEXT NOT NULL,"
+            " latest_reply TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (channel_id, thread_ts)"
+            ")"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            " key TEXT PRIMARY KEY,"
+            " created_at REAL NOT NULL,"
+            " used_at REAL NOT NULL"
+            ")"
+        )
+        self.conn.commit()
+
+    def get_watermark(self, channel_id: str) -> Optional[str]:
+        """
+        チャンネルの最新取得済み ts を取得する。
+
+        Args:
+            channel_id: チャンネルID
+
+        Returns:
+            ts（"1234567890.123456" 形式）。まだ記録がない場合は None
+        """
+        row = self.conn.execute(
+            "SELECT ts FROM watermarks WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, channel_id: str, ts: str) -> None:
+        """
+        チャンネルの最新取得済み ts を記録する。記録済みの ts より古い場合は更新しない。
+
+        Args:
+            channel_id: チャンネルID
+            ts: メッセージの ts
+        """
+        current = self.get_watermark(channel_id)
+        if current is not None and float(current) >= float(ts):
+            return
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watermarks (channel_id, ts, updated_at) VALUES (?, ?, ?)",
+                (channel_id, ts, time.time())
+            )
+
+    def get_thread_latest(self, channel_id: str, thread_ts: str) -> Optional[str]:
+        """
+        スレッドの返信を前回取得したときの latest_reply を取得する。
+
+        Args:
+            channel_id: チャンネルID
+            thread_ts: 親メッセージの ts
+
+        Returns:
+            latest_reply。まだ記録がない場合は None
+        """
+        row = self.conn.execute(
+            "SELECT latest_reply FROM threads WHERE channel_id = ? AND thread_ts = ?",
+            (channel_id, thread_ts)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_thread_latest(self, channel_id: str, thread_ts: str, latest_reply: str) -> None:
+        """
+        スレッドの返信を取得したときの latest_reply を記録する（記録した時刻が、最後に確認した時刻になる）。
+
+        Args:
+            channel_id: チャンネルID
+            thread_ts: 親メッセージの ts
+            latest_reply: 最新の返信の ts
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO threads (channel_id, thread_ts, latest_reply, updated_at)"
+                " VALUES (?, ?, ?, ?)",
+                (channel_id, thread_ts, latest_reply, time.time())
+            )
+
+    def get_threads(
+        self,
+        channel_id: str,
+        since: float,
+        checked_before: Optional[float] = None,
+        limit: Optional[int] = None
+    ) -> Dict[str, str]:
+        """
+        最新の返信が since より新しいスレッドの記録をまとめて取得する（最新の返信が新しい順）。
+
+        Args:
+            channel_id: チャンネルID
+            since: この時刻（UNIX 時間）より後に返信があったスレッドだけを返す
+            checked_before: 指定した場合、この時刻より前に記録した（最後に確認した）スレッドだけを返す
+            limit: 返すスレッドの数の上限（未指定の場合は全て）
+
+        Returns:
+            親メッセージの ts → latest_reply の辞書
+        """
+        query = (
+            "SELECT thread_ts, latest_reply FROM threads"
+            " WHERE channel_id = ? AND CAST(latest_reply AS REAL) > ?"
+        )
+        params = [channel_id, since]
+        if checked_before is not None:
+            query += " AND updated_at < ?"
+            params.append(checked_before)
+        query += " ORDER BY CAST(latest_reply AS REAL) DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return dict(self.conn.execute(query, params))
+
+    def forget_threads(self, before: float) -> None:
+        """
+        最新の返信が before より古いスレッドの記録を消す。
+
+        Args:
+            before: この時刻（UNIX 時間）より前に最後の返信があったスレッドを消す
+        """
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM threads WHERE CAST(latest_reply AS REAL) <= ?", (before,)
+            )
+
+    def has_digest(self, key: str, ttl: int = DIGEST_TTL) -> bool:
+        """
+        同じ要約を最近送信したかどうかを返す。
+
+        Args:
+            key: digest_key() で作ったキー
+            ttl: これより前（秒）に送信したものは送信していないものとみなす
+
+        Returns:
+            送信済みなら True
+        """
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE digests SET used_at = ? WHERE key = ? AND created_at >= ?",
+                (now, key, now - ttl)
+            )
+        return cursor.rowcount > 0
+
+    def remember_digest(
+        self,
+        key: str,
+        ttl: int = DIGEST_TTL,
+        max_entries: int = DIGEST_CACHE_SIZE
+    ) -> None:
+        """
+        要約を送信したことを記録し、古いもの・使われていないものを消す。
+
+        Args:
+            key: digest_key() で作ったキー
+            ttl: この秒数より前に記録したものは消す
+            max_entries: 残す件数の上限（最近使われたものから残す）
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO digests (key, created_at, used_at) VALUES (?, ?, ?)",
+                (key, now, now)
+            )
+            self.conn.execute("DELETE FROM digests WHERE created_at < ?", (now - ttl,))
+            self.conn.execute(
+                "DELETE FROM digests WHERE key NOT IN"
+                " (SELECT key FROM digests ORDER BY used_at DESC LIMIT ?)",
+                (max_entries,)
+            )
+
+    def close(self) -> None:
+        """データベースを閉じる"""
+        self.conn.close()
+
+    def __enter__(self) -> "StateStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
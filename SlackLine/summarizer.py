@@ -4,98 +4,373 @@
 メッセージを要約するモジュール
 """
 
-from typing import List, Dict
+from collections import deque
+from operator import itemgetter
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from typing import Deque, Dict, Iterable, List, Optional, Sequence, Union
 
+from message_batch import MessageBatch, Row, iter_rows
+from numpy_utils import import_numpy
+from sketches import BATCH_SIZE, HeavyHitters
 
-def summarize_messages(messages: List[Dict], max_length: int = 1000) -> str:
+
+# 要約に載せる最初・最後のメッセージの件数
+HEAD_SIZE = 3
+TAIL_SIZE = 3
+
+# この件数以下なら、全てのメッセージを要約に載せる
+SHOW_ALL_LIMIT = 5
+
+# 要約の方式（digest: 最初と最後の数件、tfidf: 重要なメッセージを選ぶ）
+SUMMARY_MODES = ("digest", "tfidf")
+
+
+@lru_cache(maxsize=4096)
+def _format_minute(minute: int) -> str:
+    return datetime.fromtimestamp(minute * 60).strftime("%m/%d %H:%M")
+
+
+def format_time(timestamp: float) -> str:
+    """
+    タイムスタンプを "MM/DD HH:MM" の形式にする。
+
+    表示は分単位なので、同じ分のメッセージは1回だけ変換する。
+    """
+    return _format_minute(int(timestamp // 60))
+
+
+def _format_line(row: Row, text_limit: int, multi_channel: bool) -> str:
+    """要約の1行（• [時刻] 名前: 本文）を作る"""
+    timestamp, user, channel, text = row
+    text = text.replace('\n', ' ').strip()
+    # 長いメッセージは切り詰め
+    if len(text) > text_limit:
+        text = text[:text_limit] + "..."
+    prefix = f"{channel} " if multi_channel else ""
+    return f"• [{format_time(timestamp)}] {prefix}{user}: {text}"
+
+
+def _truncate(summary: str, max_length: int) -> str:
+    """最大文字数を超える場合は切り詰める"""
+    if len(summary) > max_length:
+        summary = summary[:max_length] + "\n\n...（要約が長すぎるため一部を省略）"
+    return summary
+
+
+class StreamingSummarizer:
+    """
+    メッセージを1件ずつ受け取りながら要約を作る。
+
+    全件をリストに持たず、件数・参加者・期間と、最初と最後の数件だけを覚えておくので、
+    iter_channel_messages() のようなジェネレータをそのまま渡せば、何万件でも少ないメモリで要約できる。
+    summarize_messages() と同じ要約が作られる。
+
+    heavy_hitters（HeavyHitters）を渡すと、同じ読み込みでよく出た話題・よく投稿した人も数え、見出しに載せる。
+
+    使い方:
+        summarizer = StreamingSummarizer()
+        summarizer.extend(iter_channel_messages("#general", hours=168))
+        print(summarizer.summary())
     """
-    メッセージリストを要約する。
+
+    def __init__(self, heavy_hitters: Optional[HeavyHitters] = None):
+        self.heavy_hitters = heavy_hitters
+        self.total = 0
+        self.users = set()
+        self.channels: Dict[str, None] = {}
+        self.oldest: Optional[float] = None
+        self.newest: Optional[float] = None
+        self.head: List[Row] = []
+        self.tail: Deque[Row] = deque(maxlen=TAIL_SIZE)
+
+    def add_row(self, timestamp: float, user: str, channel: str, text: str) -> None:
+        """メッセージを1件 (タイムスタンプ, ユーザー名, チャンネル名, 本文) で加える"""
+        row = (timestamp, user, channel, text)
+        self.total += 1
+        self.users.add(user)
+        if channel not in self.channels:
+            self.channels[channel] = None
+        if self.oldest is None or timestamp < self.oldest:
+            self.oldest = timestamp
+        if self.newest is None or timestamp > self.newest:
+            self.newest = timestamp
+        if len(self.head) < HEAD_SIZE:
+            self.head.append(row)
+        self.tail.append(row)
+        if self.heavy_hitters is not None:
+            self.heavy_hitters.add_row(timestamp, user, channel, text)
+
+    def add_rows(self, rows: Sequence[Row]) -> None:
+        """行のリストをまとめて加える（1件ずつ add_row() するより速い）"""
+        if not rows:
+            return
+        self.head.extend(rows[:max(HEAD_SIZE - len(self.head), 0)])
+        self.tail.extend(rows[-TAIL_SIZE:])
+
+        self.total += len(rows)
+        self.users.update(map(itemgetter(1), rows))
+        for channel in dict.fromkeys(map(itemgetter(2), rows)):
+            self.channels.setdefault(channel, None)
+        timestamps = list(map(itemgetter(0), rows))
+        oldest, newest = min(timestamps), max(timestamps)
+        self.oldest = oldest if self.oldest is None else min(self.oldest, oldest)
+        self.newest = newest if self.newest is None else max(self.newest, newest)
+        if self.heavy_hitters is not None:
+            self.heavy_hitters.add_rows(rows)
+
+    def add(self, msg: Dict) -> None:
+        """メッセージを1件加える（get_channel_messages() と同じ形式の辞書）"""
+        self.add_row(msg["timestamp"], msg["user"], msg.get("channel", ""), msg["text"])
+
+    def add_batch(self, batch: MessageBatch) -> None:
+        """
+        MessageBatch をまとめて加える。
+
+        件数・参加者・期間は列から直接求め、行として取り出すのは最初と最後の数件だけ。
+        """
+        count = len(batch)
+        if not count:
+            return
+        for i in range(min(count, max(HEAD_SIZE - len(self.head), 0))):
+            self.head.append(batch.row(i))
+        self.tail.extend(batch.row(i) for i in range(max(count - TAIL_SIZE, 0), count))
+
+        self.total += count
+        self.users.update(batch.users)
+        for channel in batch.channels:
+            self.channels.setdefault(channel, None)
+        oldest, newest = batch.time_range()
+        self.oldest = oldest if self.oldest is None else min(self.oldest, oldest)
+        self.newest = newest if self.newest is None else max(self.newest, newest)
+        if self.heavy_hitters is not None:
+            self.heavy_hitters.extend(batch)
+
+    def extend(self, messages: Union[Iterable[Dict], MessageBatch]) -> None:
+        """メッセージのリスト・ジェネレータ・MessageBatch をまとめて加える（BATCH_SIZE 件ずつ add_rows() する）"""
+        if isinstance(messages, MessageBatch):
+            self.add_batch(messages)
+            return
+        rows = iter_rows(messages)
+        while True:
+            chunk = list(islice(rows, BATCH_SIZE))
+            if not chunk:
+                return
+            self.add_rows(chunk)
+
+    def _rows_to_show(self) -> List[Row]:
+        """件数が少ない場合に載せる全メッセージ（最初の数件 + 残りを最後の数件から）"""
+        rest = self.total - len(self.head)
+        tail = list(self.tail)
+        return self.head + tail[len(tail) - rest:] if rest > 0 else list(self.head)
+
+    @property
+    def multi_channel(self) -> bool:
+        return len(self.channels) > 1
+
+    def header_lines(
+        self,
+        stats_lines: Sequence[str] = (),
+        header: Optional["StreamingSummarizer"] = None
+    ) -> List[str]:
+        """
+        要約の見出し（件数・参加者数・チャンネル・期間）の行を返す。
+
+        Args:
+            stats_lines: 見出しの最後に加える行（activity.format_activity() の結果など）
+                heavy_hitters がある場合は、その行も続けて加える
+            header: 件数・参加者数・チャンネル・期間・話題を、このインスタンスではなく header から取る
+                （似ているメッセージをまとめる前の全メッセージを加えたものを渡す）
+        """
+        source = header if header is not None else self
+        summary_lines = [f"📬 Slackメッセージ要約\n"]
+        summary_lines.append("=" * 40)
+        summary_lines.append(f"📊 総メッセージ数: {source.total}件")
+        if source.total != self.total:
+            summary_lines.append(f"🧹 似ているメッセージをまとめて{self.total}件として要約")
+        summary_lines.append(f"👥 参加者数: {len(source.users)}名")
+        if source.multi_channel:
+            summary_lines.append(f"📺 チャンネル: {', '.join(source.channels)}")
+        summary_lines.append(f"⏰ 期間: {format_time(source.oldest)} ～ {format_time(source.newest)}")
+        summary_lines.extend(stats_lines)
+        if source.heavy_hitters is not None:
+            summary_lines.extend(source.heavy_hitters.format_lines())
+        summary_lines.append("=" * 40)
+        summary_lines.append("")
+        return summary_lines
+
+    def summary(
+        self,
+        max_length: int = 1000,
+        stats_lines: Sequence[str] = (),
+        header: Optional["StreamingSummarizer"] = None
+    ) -> str:
+        """
+        ここまでに加えたメッセージの要約を作る。
+
+        Args:
+            max_length: 要約の最大文字数（デフォルト: 1000）
+            stats_lines: 見出しに加える行（activity.format_activity() の結果など）
+            header: 見出しの件数などを取る StreamingSummarizer（header_lines() と同じ）
+
+        Returns:
+            要約された文字列
+        """
+        if not self.total:
+            return "メッセージがありません。"
+
+        multi_channel = self.multi_channel
+        summary_lines = self.header_lines(stats_lines, header)
+
+        # メッセージが少ない場合（5件以下）
+        if self.total <= SHOW_ALL_LIMIT:
+            summary_lines.append("【メッセージ内容】")
+            summary_lines.extend(_format_line(row, 150, multi_channel) for row in self._rows_to_show())
+
+        # メッセージが多い場合（6件以上）
+        else:
+            summary_lines.append("【最新のメッセージ（最初の3件）】")
+            summary_lines.extend(_format_line(row, 120, multi_channel) for row in self.head)
+
+            summary_lines.append("")
+            summary_lines.append(f"... 他 {self.total - HEAD_SIZE - TAIL_SIZE}件のメッセージ ...")
+            summary_lines.append("")
+
+            summary_lines.append("【最新のメッセージ（最後の3件）】")
+            summary_lines.extend(_format_line(row, 120, multi_channel) for row in self.tail)
+
+        return _truncate("\n".join(summary_lines), max_length)
+
+
+def summarize_extractive(
+    messages: Union[Iterable[Dict], MessageBatch],
+    max_length: int = 1000,
+    stats_lines: Sequence[str] = (),
+    heavy_hitters: Optional[HeavyHitters] = None,
+    header: Optional[StreamingSummarizer] = None
+) -> str:
+    """
+    全メッセージを TF-IDF で採点し、重要なものを max_length に収まるだけ選んで要約する（numpy が必要）。
+
+    最初と最後の数件だけを載せる summarize_messages() と違い、途中のメッセージも選ばれる。
 
     Args:
-        messages: メッセージのリスト
+        messages: メッセージのリスト（新しい順）・ジェネレータ、または MessageBatch
         max_length: 要約の最大文字数（デフォルト: 1000）
+        stats_lines: 見出しに加える行（activity.format_activity() の結果など）
+        heavy_hitters: よく出た話題・よく投稿した人を数えて見出しに載せる場合に渡す
+        header: 見出しの件数などを取る StreamingSummarizer（StreamingSummarizer.header_lines() と同じ）
 
     Returns:
         要約された文字列
+
+    Raises:
+        RuntimeError: numpy がインストールされていない場合
     """
-    if not messages:
-        return "メッセージがありません。"
-    
-    from datetime import datetime
-    
-    total_messages = len(messages)
-    users = set()
-    
-    # ユーザー数をカウント
-    for msg in messages:
-        users.add(msg['user'])
-    
-    # 要約ヘッダー
-    summary_lines = [f"📬 Slackメッセージ要約\n"]
-    summary_lines.append("=" * 40)
-    summary_lines.append(f"📊 総メッセージ数: {total_messages}件")
-    summary_lines.append(f"👥 参加者数: {len(users)}名")
-    
-    # 時間範囲を表示
-    if messages:
-        first_time = datetime.fromtimestamp(messages[-1]["timestamp"])
-        last_time = datetime.fromtimestamp(messages[0]["timestamp"])
-        summary_lines.append(f"⏰ 期間: {first_time.strftime('%m/%d %H:%M')} ～ {last_time.strftime('%m/%d %H:%M')}")
-    
-    summary_lines.append("=" * 40)
+    from text_rank import select_top
+
+    np = import_numpy("TF-IDF による要約")
+    rows: List[Row] = list(iter_rows(messages))
+    summarizer = StreamingSummarizer(heavy_hitters)
+    summarizer.add_rows(rows)
+
+    # 少ない場合は全件載せるので、選ぶ必要がない
+    if summarizer.total <= SHOW_ALL_LIMIT:
+        return summarizer.summary(max_length, stats_lines, header)
+
+    multi_channel = summarizer.multi_channel
+    # 採点にも文字数の計算にも、行から1回だけ取り出した列を使う
+    _, users, channels, texts = zip(*rows)
+    count = len(rows)
+
+    # 各行の文字数（_format_line() の結果と同じ長さ）を、行を作らずに配列でまとめて計算する
+    # "• [MM/DD HH:MM] " が16文字、": " と改行が3文字。本文は120文字を超えると "..." を付けて切る
+    lengths = np.fromiter(map(len, map(str.strip, texts)), dtype=np.int64, count=count)
+    costs = 19 + np.where(lengths > 120, 123, lengths)
+    costs += np.fromiter(map(len, users), dtype=np.int64, count=count)
+    if multi_channel:
+        costs += np.fromiter(map(len, channels), dtype=np.int64, count=count) + 1
+
+    summary_lines = summarizer.header_lines(stats_lines, header)
+    title = f"【重要なメッセージ（全{summarizer.total}件から選択）】"
+    summary_lines.append(title)
+    # 見出しと、選ばれなかった件数の行の分を除いた文字数に収まるだけ選ぶ
+    footer = f"... 他 {summarizer.total}件のメッセージ ..."
+    budget = max_length - len("\n".join(summary_lines)) - len(footer) - 2
+    chosen = select_top(texts, budget, costs=costs)
+
+    summary_lines.extend(_format_line(rows[i], 120, multi_channel) for i in chosen)
     summary_lines.append("")
-    
-    # メッセージが少ない場合（5件以下）
-    if total_messages <= 5:
-        summary_lines.append("【メッセージ内容】")
-        for msg in messages:
-            dt = datetime.fromtimestamp(msg["timestamp"])
-            time_str = dt.strftime("%m/%d %H:%M")
-            text = msg['text'].replace('\n', ' ').strip()
-            # 長いメッセージは切り詰め
-            if len(text) > 150:
-                text = text[:150] + "..."
-            summary_lines.append(f"• [{time_str}] {msg['user']}: {text}")
-    
-    # メッセージが多い場合（6件以上）
-    else:
-        summary_lines.append("【最新のメッセージ（最初の3件）】")
-        for msg in messages[:3]:
-            dt = datetime.fromtimestamp(msg["timestamp"])
-            time_str = dt.strftime("%m/%d %H:%M")
-            text = msg['text'].replace('\n', ' ').strip()
-            if len(text) > 120:
-                text = text[:120] + "..."
-            summary_lines.append(f"• [{time_str}] {msg['user']}: {text}")
-        
-        summary_lines.append("")
-        summary_lines.append(f"... 他 {total_messages - 6}件のメッセージ ...")
-        summary_lines.append("")
-        
-        summary_lines.append("【最新のメッセージ（最後の3件）】")
-        for msg in messages[-3:]:
-            dt = datetime.fromtimestamp(msg["timestamp"])
-            time_str = dt.strftime("%m/%d %H:%M")
-            text = msg['text'].replace('\n', ' ').strip()
-            if len(text) > 120:
-                text = text[:120] + "..."
-            summary_lines.append(f"• [{time_str}] {msg['user']}: {text}")
-    
-    summary = "\n".join(summary_lines)
-    
-    # 最大文字数を超える場合は切り詰め
-    if len(summary) > max_length:
-        summary = summary[:max_length] + "\n\n...（要約が長すぎるため一部を省略）"
-    
-    return summary
+    summary_lines.append(f"... 他 {summarizer.total - len(chosen)}件のメッセージ ...")
+    return _truncate("\n".join(summary_lines), max_length)
+
+
+def summarize_messages(
+    messages: Union[Iterable[Dict], MessageBatch],
+    max_length: int = 1000,
+    mode: str = "digest",
+    stats: bool = False,
+    topics: bool = False,
+    all_messages: Optional[Union[Iterable[Dict], MessageBatch]] = None
+) -> str:
+    """
+    メッセージを要約する。
+
+    Args:
+        messages: メッセージのリスト（新しい順）・ジェネレータ、または MessageBatch
+        max_length: 要約の最大文字数（デフォルト: 1000）
+        mode: "digest"（最初と最後の3件）または "tfidf"（重要なメッセージを選ぶ、numpy が必要）
+        stats: True の場合、時間帯別の件数・よく投稿した人・盛り上がったスレッドも載せる（numpy が必要）
+        topics: True の場合、よく出た話題とよく投稿した人の上位も載せる（件数によらず一定のメモリで数える）
+        all_messages: messages が collapse_near_duplicates() でまとめたものの場合に、まとめる前の全メッセージを渡す。
+            見出しの件数・参加者数・期間と、stats・topics の集計にはこちらを使う
 
+    Returns:
+        要約された文字列
 
-def create_simple_summary(messages: List[Dict]) -> str:
+    Raises:
+        RuntimeError: numpy が必要な指定で、numpy がインストールされていない場合
+    """
+    stats_lines: List[str] = []
+    if stats:
+        from activity import compute_activity, format_activity
+
+        # 集計は列に対してまとめて行うので、MessageBatch にそろえる
+        if all_messages is not None:
+            if not isinstance(all_messages, MessageBatch):
+                all_messages = MessageBatch.from_messages(all_messages)
+            stats_lines = format_activity(compute_activity(all_messages))
+        else:
+            if not isinstance(messages, MessageBatch):
+                messages = MessageBatch.from_messages(messages)
+            stats_lines = format_activity(compute_activity(messages))
+
+    # --stats でよく投稿した人を正確に集計している場合は、話題だけを数える
+    heavy_hitters = HeavyHitters(track_users=not stats) if topics else None
+    header = None
+    if all_messages is not None:
+        # 見出しの件数・参加者・期間・話題は、まとめる前の全メッセージで数える
+        header = StreamingSummarizer(heavy_hitters)
+        header.extend(all_messages)
+        heavy_hitters = None
+    if mode == "tfidf":
+        return summarize_extractive(messages, max_length, stats_lines, heavy_hitters, header)
+    summarizer = StreamingSummarizer(heavy_hitters)
+    summarizer.extend(messages)
+    return summarizer.summary(max_length, stats_lines, header)
+
+
+def create_simple_summary(
+    messages: Union[List[Dict], MessageBatch],
+    total: Optional[int] = None
+) -> str:
     """
     シンプルな要約を作成する（要約機能を使わない場合）。
 
     Args:
-        messages: メッセージのリスト
+        messages: メッセージのリストまたは MessageBatch
+        total: messages が collapse_near_duplicates() でまとめたものの場合に、まとめる前の件数
 
     Returns:
         フォーマットされた文字列
@@ -103,16 +378,22 @@ def create_simple_summary(messages: List[Dict]) -> str:
     if not messages:
         return "メッセージがありません。"
     
-    from datetime import datetime
+    if isinstance(messages, MessageBatch):
+        multi_channel = len(messages.channels) > 1
+    else:
+        multi_channel = len({msg.get('channel') for msg in messages}) > 1
     
-    summary_lines = [f"📬 Slackメッセージ通知 ({len(messages)}件)\n"]
+    if total is not None and total != len(messages):
+        summary_lines = [f"📬 Slackメッセージ通知 ({total}件、似ているものをまとめて{len(messages)}件)\n"]
+    else:
+        summary_lines = [f"📬 Slackメッセージ通知 ({len(messages)}件)\n"]
     summary_lines.append("=" * 30 + "\n")
     
-    for msg in messages:
-        dt = datetime.fromtimestamp(msg["timestamp"])
-        time_str = dt.strftime("%m/%d %H:%M")
-        text = msg['text'][:200] + ("..." if len(msg['text']) > 200 else "")
-        summary_lines.append(f"[{time_str}] {msg['user']}\n{text}\n")
+    for timestamp, user, channel, text in iter_rows(messages):
+        time_str = format_time(timestamp)
+        text = text[:200] + ("..." if len(text) > 200 else "")
+        prefix = f"{channel} " if multi_channel else ""
+        summary_lines.append(f"[{time_str}] {prefix}{user}\n{text}\n")
     
     return "\n".join(summary_lines)
 
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+長いテキストを、送信先の文字数の上限に収まる部分に分けるモジュール
+
+文字数の数え方は送信先によって違う。LINE は UTF-16 の単位で数えるので、
+絵文字などの一部の文字（U+10000 以上）は Python の len() では1文字でも2文字として数えられる。
+ここでは数え方を関数（measure）で指定できるようにし、LINE 用には utf16_length() を使う。
+
+行の区切りで分けるのが基本で、1行だけで上限を超える場合は、句読点や空白の後ろで分ける
+（見つからなければ上限の位置で分けるが、絵文字の組み合わせの途中では分けない）。
+各部分はリストに貯めた行を最後に1回だけ join して作り、ジェネレータで1つずつ返すので、
+全体の長さに比例した時間で終わり、途中で全体のコピーを作らない。
+"""
+
+from typing import Callable, Iterator, List
+
+
+# 1行が長すぎる場合に、分ける位置として選ぶ文字（前にあるものほど優先する）
+BREAK_CHARS = ("。", "！", "？", "!", "?", "、", "，", ",", "　", " ")
+
+# 分ける位置を探す範囲（上限の何割より後ろで探すか。前の方で分けると部分が短くなりすぎる）
+MIN_FILL_RATIO = 0.5
+
+# この文字の直前では分けない（絵文字の肌の色・異体字セレクタ・結合文字など、前の文字と組み合わせて1文字になるもの）
+_JOINING_RANGES = (
+    (0x0300, 0x036F),    # 結合用の記号
+    (0x200D, 0x200D),    # ゼロ幅接合子（ZWJ）
+    (0x20E3, 0x20E3),    # 囲み記号（キーキャップ）
+    (0xFE00, 0xFE0F),    # 異体字セレクタ
+    (0x1F3FB, 0x1F3FF),  # 肌の色
+    (0xE0020, 0xE007F),  # タグ文字（旗）
+)
+
+
+def utf16_length(text: str) -> int:
+    """UTF-16 の単位での長さ（LINE の文字数の数え方）"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _is_joining(char: str) -> bool:
+    code = ord(char)
+    return any(low <= code <= high for low, high in _JOINING_RANGES)
+
+
+def _iter_lines(text: str) -> Iterator[str]:
+    """text.split("\\n") と同じ行を、リストを作らずに1行ずつ返す"""
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def _split_line(line: str, max_length: int, measure: Callable[[str], int]) -> Iterator[str]:
+    """
+    上限を超える1行を、上限以内の部分に分ける。
+
+    Args:
+        line: 分ける行
+        max_length: 1部分の長さの上限（measure で数えた長さ）
+        measure: 長さの数え方
+    """
+    start = 0
+    while start < len(line):
+        # 上限に収まる一番後ろの位置を探す。1文字は長さ1以上なので、max_length 文字から始めて、
+        # はみ出した分の半分ずつ減らしていく（文字ごとのループにしないので、長い行でも速い）
+        end = min(len(line), start + max_length)
+        excess = measure(line[start:end]) - max_length
+        while excess > 0:
+            end = max(start + 1, end - (excess + 1) // 2)
+            excess = measure(line[start:end]) - max_length if end > start + 1 else 0
+        if end >= len(line):
+            yield line[start:]
+            return
+
+        # 句読点や空白の直後で分ける（優先度の高い文字から、範囲の後ろ寄りで探す）
+        lowest = start + max(1, int((end - start) * MIN_FILL_RATIO))
+        cut = -1
+        for char in BREAK_CHARS:
+            position = line.rfind(char, lowest, end)
+            if position >= 0:
+                cut = position + 1
+                break
+        if cut < 0:
+            # 見つからなければ上限の位置で分ける。ただし組み合わせ文字の途中では分けない
+            cut = end
+            while cut > start + 1 and (_is_joining(line[cut]) or line[cut - 1] == "\u200d"):
+                cut -= 1
+        yield line[start:cut]
+        start = cut
+
+
+def _joined(lines: List[str]) -> Iterator[str]:
+    """行をまとめた1部分を返す（空になる場合は何も返さない）"""
+    chunk = "\n".join(lines)
+    if chunk:
+        yield chunk
+
+
+def iter_chunks(
+    text: str,
+    max_length: int,
+    measure: Callable[[str], int] = utf16_length
+) -> Iterator[str]:
+    """
+    テキストを、長さが max_length 以内の部分に分けて1つずつ返す。
+
+    できるだけ多くの行を1つの部分にまとめ、行の途中では分けない。
+    1行だけで max_length を超える場合は、その行を句読点や空白の後ろで分ける。
+
+    Args:
+        text: 分けるテキスト
+        max_length: 1部分の長さの上限（measure で数えた長さ）
+        measure: 長さの数え方（デフォルト: UTF-16 の単位。len を渡すと Python の文字数）
+
+    Returns:
+        部分を1つずつ返すイテレータ（空の部分は返さない）
+
+    Raises:
+        ValueError: max_length が 1 未満の場合
+    """
+    if max_length < 1:
+        raise ValueError("max_length は 1 以上にしてください。")
+    buffer: List[str] = []
+    used = 0
+    for line in _iter_lines(text):
+        length = measure(line)
+        if length > max_length:
+            # 長すぎる行は分け、最後の部分には続く行をまとめられるようにする
+            *pieces, line = _split_line(line, max_length, measure)
+            length = measure(line)
+            yield from _joined(buffer)
+            buffer, used = [], 0
+            yield from pieces
+
+        if buffer and used + 1 + length > max_length:
+            yield from _joined(buffer)
+            buffer, used = [], 0
+        used += length + 1 if buffer else length
+        buffer.append(line)
+
+    yield from _joined(buffer)
+
@@ -7,13 +7,16 @@ from __future__ import annotations
 
 import os
 import re
+import threading
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Tuple
 
+import requests
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import Flask, abort, request
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
+from linebot.http_client import HttpClient, RequestsHttpClient, RequestsHttpResponse
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
 
 JST = timezone(timedelta(hours=9))
@@ -27,7 +30,46 @@ if "YOUR_CHANNEL_ACCESS_TOKEN" in CHANNEL_ACCESS_TOKEN:
 if "YOUR_CHANNEL_SECRET" in CHANNEL_SECRET:
     raise ValueError("CHANNEL_SECRET を reminder_bot.py に設定してください。")
 
-line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
+
+class SessionHttpClient(RequestsHttpClient):
+    """
+    一度つないだ接続を使い回して LINE に送る（返信やリマインドのたびに接続し直さない）。
+
+    requests.Session は複数のスレッドから同時に使うと安全ではないので、Session はスレッドごとに1つ作る。
+    """
+
+    def __init__(self, timeout=HttpClient.DEFAULT_TIMEOUT):
+        super().__init__(timeout)
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        """このスレッド用の Session（初めて使うときに作る）"""
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _request(self, method: str, url: str, timeout=None, **kwargs) -> RequestsHttpResponse:
+        if timeout is None:
+            timeout = self.timeout
+        return RequestsHttpResponse(self.session.request(method, url, timeout=timeout, **kwargs))
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request("GET", url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request("POST", url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request("DELETE", url, timeout, headers=headers, data=data)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request("PUT", url, timeout, headers=headers, data=data)
+
+
+# 返信・リマインドの全てで、この1つのクライアントを使い回す
+# （接続は Flask とタイマーのスレッドごとに張り、スレッドの中で使い回す）
+line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN, http_client=SessionHttpClient)
 handler = WebhookHandler(CHANNEL_SECRET)
 
 # --- 2. 予定を覚えておくタイマーを用意 ---
@@ -14,12 +14,19 @@ Slack API を使用して指定のチャンネルにメッセージを投稿す
 """
 
 import os
+import sys
 import argparse
 from typing import Optional
 
-from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
+# レート制限・クライアントの共有は SlackLine と同じモジュールを使う（コピーを持たない）
+# 末尾に追加するので、config.py はこのディレクトリのものが優先される
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SlackLine"))
+
+from slack_clients import get_web_client
+from slack_rate_limit import get_rate_limiter
+
 
 def get_bot_token() -> str:
     """
@@ -72,7 +79,8 @@ def send_message(
     if bot_token is None:
         bot_token = get_bot_token()
     
-    client = WebClient(token=bot_token)
+    # 同じトークンのクライアントは使い回す（何千件も送る場合に毎回作り直さない）
+    client = get_web_client(bot_token)
     
     try:
         # チャンネル名が # で始まる場合は、# を削除
@@ -87,7 +95,10 @@ def send_message(
         if thread_ts:
             payload["thread_ts"] = thread_ts
         
-        response = client.chat_postMessage(**payload)
+        # 投稿が続いても 429 で止まらないよう、レート制限に合わせて待ちながら送る
+        response = get_rate_limiter().call(
+            "chat.postMessage", client.chat_postMessage, key=channel, **payload
+        )
         return response.data
         
     except SlackApiError as e: